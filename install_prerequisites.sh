@@ -88,7 +88,7 @@ function do_install()
 
     echo "+++ Installing additional tools... +++"
     sudo apt-get -y install net-tools tmux screen
-    sudo pip3 install kneed
+    sudo pip3 install kneed pyroute2
 }
 
 echo "+++ Installation started - it may take a while... +++"
@@ -0,0 +1,61 @@
+import numpy as np
+
+from tools.clusteringCache import ClusteringCache
+
+
+def makeData():
+    return np.arange(12, dtype=np.float64).reshape(4, 3)
+
+
+def test_key_is_stable():
+    cache = ClusteringCache()
+    parameters = {"n_clusters": 5, "balance_weight": "packets"}
+    key = cache.makeKey(makeData(), "Birch", parameters, 2)
+    assert key == cache.makeKey(makeData().astype(np.float32), "Birch", dict(reversed(list(parameters.items()))), 2)
+    assert len(key) == 64
+
+
+def test_key_depends_on_every_input():
+    cache = ClusteringCache()
+    key = cache.makeKey(makeData(), "K-means", {"balance_weight": "packets"}, 2, weights=[1, 2, 3, 4])
+    changed_data = makeData()
+    changed_data[0, 0] = 0.5
+    assert key != cache.makeKey(changed_data, "K-means", {"balance_weight": "packets"}, 2, weights=[1, 2, 3, 4])
+    assert key != cache.makeKey(makeData().reshape(3, 4), "K-means", {"balance_weight": "packets"}, 2,
+                                weights=[1, 2, 3, 4])
+    assert key != cache.makeKey(makeData(), "Birch", {"balance_weight": "packets"}, 2, weights=[1, 2, 3, 4])
+    assert key != cache.makeKey(makeData(), "K-means", {"balance_weight": "bytes"}, 2, weights=[1, 2, 3, 4])
+    assert key != cache.makeKey(makeData(), "K-means", {"balance_weight": "packets"}, 3, weights=[1, 2, 3, 4])
+    assert key != cache.makeKey(makeData(), "K-means", {"balance_weight": "packets"}, 2, weights=[1, 2, 3, 5])
+    assert key != cache.makeKey(makeData(), "K-means", {"balance_weight": "packets"}, 2)
+
+
+def test_memory_entries_are_least_recently_used():
+    cache = ClusteringCache(max_entries=2)
+    for key in ("a", "b"):
+        cache.put(key, [0, 1], [1, 0], {0: 1, 1: 0})
+    assert cache.get("a") is not None  # "b" is now the least recently used
+    cache.put("c", [0], [0], {0: 0})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_entry_is_restored_from_disk(tmp_path):
+    leaderboard = [{"mode": "Birch", "silhouette": np.float64(0.5), "status": "ok"}]
+    ClusteringCache(directory=str(tmp_path)).put("key", [3, 4, 3], [1, 0, 1], {3: 1, 4: 0},
+                                                 {"selected": "Birch"}, leaderboard)
+
+    entry = ClusteringCache(directory=str(tmp_path)).get("key")
+    assert entry.labels.tolist() == [3, 4, 3]
+    assert entry.clusters.tolist() == [1, 0, 1]
+    assert entry.mapping == {3: 1, 4: 0}
+    assert entry.details == {"selected": "Birch"}
+    assert entry.leaderboard == [{"mode": "Birch", "silhouette": 0.5, "status": "ok"}]
+
+
+def test_disk_entries_are_limited(tmp_path):
+    cache = ClusteringCache(directory=str(tmp_path), max_disk_entries=2)
+    for key in ("a", "b", "c"):
+        cache.put(key, [0], [0], {0: 0})
+    assert len(list(tmp_path.glob("*.npz"))) == 2
@@ -0,0 +1,134 @@
+import struct
+
+import numpy as np
+import pytest
+from scapy.all import Ether, IP, TCP, UDP, Raw
+
+from tools import pcapFile, nativeRewrite
+
+MAC1 = "00:00:00:00:00:01"
+MAC2 = "00:00:00:00:00:02"
+
+
+def client(payload=b"", **tcp):  # packet from client 192.168.1.10:40000 to server 192.168.1.20:8080
+    return Ether(src="aa:aa:aa:aa:aa:aa", dst="bb:bb:bb:bb:bb:bb") / IP(src="192.168.1.10", dst="192.168.1.20") \
+        / TCP(sport=40000, dport=8080, **tcp) / Raw(payload)
+
+
+def server(payload=b"", **tcp):
+    return Ether(src="bb:bb:bb:bb:bb:bb", dst="aa:aa:aa:aa:aa:aa") / IP(src="192.168.1.20", dst="192.168.1.10") \
+        / TCP(sport=8080, dport=40000, **tcp) / Raw(payload)
+
+
+def writePcap(path, packets):
+    with pcapFile.PcapWriter(str(path), nanoseconds=True) as writer:
+        for number, packet in enumerate(packets):
+            writer.write(number * 1000000, bytes(packet))
+    return str(path)
+
+
+def readPackets(path):
+    with pcapFile.PcapFile(str(path)) as pcap:
+        return [Ether(bytes(data)) for timestamp, data in pcap.packets()]
+
+
+def readCache(path):  # (number of packets, list of codes - 2 bits per packet)
+    with open(path, "rb") as file:
+        content = file.read()
+    magic, version, count, per_byte, comment_length = nativeRewrite.CACHE_HEADER.unpack_from(content)
+    assert (magic.rstrip(b"\0"), version.rstrip(b"\0"), per_byte) == (b"tcpprep", b"04", 4)
+    packed = content[nativeRewrite.CACHE_HEADER.size + comment_length:]
+    assert len(packed) == -(-count // 4)
+    return count, [(packed[i // 4] >> (2 * (i % 4))) & 3 for i in range(count)]
+
+
+def checksumsValid(packet):  # checksums of IP and TCP/UDP equal to the ones computed by scapy
+    copy = packet.copy()
+    del copy[IP].chksum
+    layer = TCP if TCP in copy else UDP
+    del copy[layer].chksum
+    copy = Ether(bytes(copy))
+    return packet[IP].chksum == copy[IP].chksum and packet[layer].chksum == copy[layer].chksum
+
+
+def test_cache_format(tmp_path):
+    clients = np.array([True, False, False, True, True])
+    nativeRewrite.writeCache(str(tmp_path / "test.cache"), clients)
+    # higher bit - sent, lower bit - client (primary interface)
+    assert readCache(tmp_path / "test.cache") == (5, [3, 2, 2, 3, 3])
+
+
+def test_rewrite_changes_endpoints_and_keeps_checksums_valid(tmp_path):
+    packets = [client(flags="S"), server(flags="SA"), client(b"data", flags="PA"),
+               Ether(src="aa:aa:aa:aa:aa:aa", dst="bb:bb:bb:bb:bb:bb") / IP(src="192.168.1.10", dst="192.168.1.20")
+               / UDP(sport=40001, dport=53) / Raw(b"query")]
+    original = writePcap(tmp_path / "in.pcap", packets)
+    count = nativeRewrite.rewritePcap(original, str(tmp_path / "out.pcap"), str(tmp_path / "out.cache"),
+                                      "10.0.0.1", "10.0.0.2", MAC1, MAC2)
+
+    assert count == 4
+    assert readCache(tmp_path / "out.cache") == (4, [3, 2, 3, 3])
+    rewritten = readPackets(tmp_path / "out.pcap")
+    for packet, is_client in zip(rewritten, [True, False, True, True]):
+        assert checksumsValid(packet)
+        assert (packet[IP].src, packet[IP].dst) == (("10.0.0.1", "10.0.0.2") if is_client else ("10.0.0.2", "10.0.0.1"))
+        assert (packet.src, packet.dst) == ((MAC1, MAC2) if is_client else (MAC2, MAC1))
+    assert bytes(rewritten[2][Raw]) == b"data"
+
+
+def test_segmentation_of_tcp_and_fragmentation_of_udp(tmp_path):
+    payload = bytes(range(256)) * 10  # 2560 bytes
+    packets = [client(payload, flags="FPA", seq=1000), client(b"small", flags="A"),
+               Ether() / IP(src="192.168.1.10", dst="192.168.1.20", flags="DF") / UDP(sport=40001, dport=53)
+               / Raw(payload)]
+    path = writePcap(tmp_path / "in.pcap", packets)
+    count, clients = nativeRewrite.segmentPcap(path, path, 1500, np.array([True, True, False]))
+
+    segments = readPackets(path)
+    assert count == len(segments) == 2 + 1 + 2
+    assert clients.tolist() == [True, True, True, False, False]
+    tcp = segments[:2]
+    assert [len(segment[IP]) for segment in tcp] == [1500, 20 + 20 + 2560 - 1460]
+    assert [segment[TCP].seq for segment in tcp] == [1000, 2460]
+    assert [str(segment[TCP].flags) for segment in tcp] == ["A", "FPA"]
+    assert b"".join(bytes(segment[TCP].payload) for segment in tcp) == payload
+    assert all(checksumsValid(segment) for segment in tcp)
+    assert bytes(segments[2][Raw]) == b"small"
+
+    fragments = [segment[IP] for segment in segments[3:]]
+    assert [(fragment.frag * 8, fragment.flags.MF, fragment.flags.DF) for fragment in fragments] == \
+        [(0, True, False), (1480, False, False)]
+    reassembled = b"".join(bytes(fragment.payload) for fragment in fragments)
+    assert reassembled[8:] == payload
+    assert struct.unpack(">H", reassembled[4:6])[0] == 8 + len(payload)  # UDP length
+
+
+def test_amplified_clones_move_only_client_port(tmp_path):
+    rewritten = str(tmp_path / "rewritten.pcap")
+    nativeRewrite.rewritePcap(writePcap(tmp_path / "in.pcap", [client(flags="S"), server(flags="SA")]), rewritten,
+                              str(tmp_path / "rewritten.cache"), "10.0.0.1", "10.0.0.2", MAC1, MAC2)
+    space = nativeRewrite.AddressSpace("10.0.0.0/8", 256)
+    assert nativeRewrite.amplifyPcap(rewritten, str(tmp_path / "amplified.pcap"), 2, 500000, space) == 6
+
+    packets = readPackets(tmp_path / "amplified.pcap")
+    assert all(checksumsValid(packet) for packet in packets)
+    flows = [(packet[IP].src, packet[TCP].sport, packet[IP].dst, packet[TCP].dport) for packet in packets]
+    # clone k 0.5 ms later - packets of clone 1 and 2 interleave with the original ones
+    assert flows == [("10.0.0.1", 40000, "10.0.0.2", 8080),
+                     ("10.0.1.1", 41009, "10.0.1.2", 8080),
+                     ("10.0.0.2", 8080, "10.0.0.1", 40000),
+                     ("10.0.2.1", 42018, "10.0.2.2", 8080),
+                     ("10.0.1.2", 8080, "10.0.1.1", 41009),
+                     ("10.0.2.2", 8080, "10.0.2.1", 42018)]
+    assert [packet.src for packet in packets[:2]] == [MAC1, "02:00:01:00:00:01"]
+
+    nativeRewrite.writeMacCache(str(tmp_path / "amplified.pcap"), str(tmp_path / "amplified.cache"), MAC1, 2)
+    assert readCache(tmp_path / "amplified.cache") == (6, [3, 3, 2, 3, 2, 2])
+
+
+def test_amplification_checks_clones():
+    space = nativeRewrite.AddressSpace("10.0.0.0/24", 64)
+    with pytest.raises(ValueError):
+        space.check(4)
+    with pytest.raises(ValueError):
+        nativeRewrite.amplifyPcap("unused.pcap", "unused_amplified.pcap", -1, 0, space)
@@ -0,0 +1,86 @@
+import struct
+
+import numpy as np
+import pytest
+
+from tools import pcapFile
+
+
+def writePcap(path, packets, nanoseconds=True, linktype=pcapFile.LINKTYPE_ETHERNET):  # packets - (timestamp ns, data)
+    with pcapFile.PcapWriter(str(path), linktype, nanoseconds=nanoseconds) as writer:
+        for timestamp, data in packets:
+            writer.write(timestamp, data)
+    return str(path)
+
+
+def readPcap(path):  # list of (timestamp ns, data)
+    with pcapFile.PcapFile(str(path)) as pcap:
+        return list(pcap.packets())
+
+
+PACKETS = [(1000000000, b"a" * 60), (1000500000, b"b" * 61), (1002000000, b"c" * 63)]
+
+
+@pytest.mark.parametrize("nanoseconds", [True, False])
+def test_index_and_summary(tmp_path, nanoseconds):
+    path = writePcap(tmp_path / "in.pcap", PACKETS, nanoseconds)
+    with pcapFile.PcapFile(path) as pcap:
+        timestamps, offsets, lengths = pcap.index()
+        assert timestamps.tolist() == [timestamp for timestamp, data in PACKETS]
+        assert lengths.tolist() == [60, 61, 63]
+        assert [bytes(pcap.buffer[offset:offset + 1]) for offset in offsets.tolist()] == [b"a", b"b", b"c"]
+    assert pcapFile.summary(path) == (3, 184, 0.002)
+
+
+def test_big_endian_file_and_truncated_last_packet(tmp_path):
+    path = tmp_path / "big.pcap"
+    with open(path, "wb") as file:
+        file.write(struct.pack(">IHHiIII", pcapFile.MAGIC_MICROSECONDS, 2, 4, 0, 0, 65535, 1))
+        file.write(struct.pack(">IIII", 5, 250, 4, 4) + b"abcd")
+        file.write(struct.pack(">IIII", 6, 0, 10, 10) + b"short")  # captured length beyond end of file
+    assert readPcap(path) == [(5000250000, b"abcd")]
+
+
+def test_not_pcap_files_are_rejected(tmp_path):
+    (tmp_path / "empty.pcap").write_bytes(b"")
+    (tmp_path / "pcapng.pcap").write_bytes(struct.pack("<I", pcapFile.MAGIC_PCAPNG) + bytes(28))
+    for name in ("empty.pcap", "pcapng.pcap"):
+        with pytest.raises(ValueError):
+            pcapFile.PcapFile(str(tmp_path / name))
+
+
+def test_concatenate_shifts_every_file_after_previous_one(tmp_path):
+    first = writePcap(tmp_path / "first.pcap", PACKETS)
+    second = writePcap(tmp_path / "second.pcap", [(50, b"x" * 60), (150, b"y" * 60)])
+    output = str(tmp_path / "merged.pcap")
+
+    assert pcapFile.concatenate([first, second, first], output, gap=1000) == 8
+    packets = readPcap(output)
+    assert [data[:1] for timestamp, data in packets] == [b"a", b"b", b"c", b"x", b"y", b"a", b"b", b"c"]
+    timestamps = [timestamp for timestamp, data in packets]
+    assert timestamps[:3] == [timestamp for timestamp, data in PACKETS]
+    assert timestamps[3:5] == [1002001000, 1002001100]
+    assert timestamps[5:] == [1002002100, 1002502100, 1004002100]
+
+
+def test_concatenate_rejects_different_link_types(tmp_path):
+    ethernet = writePcap(tmp_path / "ethernet.pcap", PACKETS)
+    raw = writePcap(tmp_path / "raw.pcap", PACKETS, linktype=101)
+    with pytest.raises(ValueError):
+        pcapFile.concatenate([ethernet, raw], str(tmp_path / "merged.pcap"))
+
+
+@pytest.mark.parametrize("nanoseconds", [True, False])
+def test_retime_changes_only_timestamps(tmp_path, nanoseconds):
+    # odd lengths - record headers are not aligned to 4 bytes
+    path = writePcap(tmp_path / "in.pcap", PACKETS, nanoseconds)
+    pcapFile.retime(path, lambda offsets: offsets * 2)
+    packets = readPcap(path)
+    assert [timestamp for timestamp, data in packets] == [1000000000, 1001000000, 1004000000]
+    assert [data for timestamp, data in packets] == [data for timestamp, data in PACKETS]
+
+
+def test_retime_aligned_headers(tmp_path):
+    path = writePcap(tmp_path / "in.pcap", [(index * 1000, bytes(64)) for index in range(5)])
+    pcapFile.retime(path, lambda offsets: np.sqrt(offsets).astype(np.int64))
+    assert [timestamp for timestamp, data in readPcap(path)] == [0, 31, 44, 54, 63]
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from tools import pcapFile
+from tools.replayRate import ReplayRate, Schedule, achievedRate
+
+
+def captureAt(rate, seconds):  # capture ns replayed after seconds - integral of multiplier of ramp
+    during = min(seconds, rate.duration)
+    capture = rate.start * during + (rate.end - rate.start) * during ** 2 / (2 * rate.duration)
+    return (capture + max(0.0, seconds - rate.duration) * rate.end) * 1e9
+
+
+@pytest.mark.parametrize("start, end", [(1.0, 3.0), (4.0, 0.5), (2.0, 2.0)])
+def test_ramp_is_integral_of_multiplier(start, end):
+    rate = ReplayRate("ramp", start=start, end=end, duration=10.0)
+    seconds = np.array([0.0, 0.5, 2.5, 5.0, 9.99, 10.0, 12.0, 30.0])
+    captures = np.array([captureAt(rate, second) for second in seconds])
+    assert np.allclose(rate.realOffset(captures, 0, 0), seconds * 1e9, rtol=1e-9, atol=1.0)
+    assert np.allclose(rate.timeline(captures.astype(np.int64)), seconds * 1e9, atol=2.0)
+
+
+def test_ramp_multiplier():
+    rate = ReplayRate("ramp", start=1.0, end=3.0, duration=10.0)
+    assert [rate.multiplierAt(seconds) for seconds in (0, 5, 10, 20)] == [1.0, 2.0, 3.0, 3.0]
+    assert rate.tcpreplayArgs() == []
+    assert rate.tcpreplayArgs(5.0) == ["--multiplier=2"]
+    assert str(rate) == "x1 -> x3 in 10 s"
+    assert rate.expectedPps(100, 6400, 10.0) == 30.0
+
+
+def test_constant_rates():
+    assert ReplayRate("multiplier", 2.0).realOffset(1000, 5, 500) == 500
+    assert ReplayRate("pps", 100).realOffset(0, 5, 500) == 5e7
+    assert ReplayRate("mbps", 8).realOffset(0, 5, 1000) == 1e6
+    assert ReplayRate("topspeed").realOffset(1000, 5, 500) == 0
+    assert ReplayRate("pps", 100).tcpreplayArgs() == ["--pps=100"]
+    assert ReplayRate("mbps", 2.5).tcpreplayArgs() == ["--mbps=2.5"]
+    assert ReplayRate("topspeed").tcpreplayArgs() == ["--topspeed"]
+    assert ReplayRate("mbps", 8).expectedPps(10, 10000, 1.0) == 1000.0
+
+
+@pytest.mark.parametrize("arguments", [{"mode": "ramps"}, {"mode": "pps", "value": 0},
+                                       {"mode": "ramp", "start": 1.0, "end": 2.0, "duration": 0.0}])
+def test_invalid_rates(arguments):
+    with pytest.raises(ValueError):
+        ReplayRate(**arguments)
+
+
+def test_schedule_drift_of_looped_file(tmp_path):
+    path = str(tmp_path / "in.pcap")
+    with pcapFile.PcapWriter(path, nanoseconds=True) as writer:
+        for timestamp in (0, 1000000000, 2000000000):
+            writer.write(timestamp, bytes(60))
+    schedule = Schedule(path, ReplayRate("multiplier", 2.0))
+    assert schedule.period == 1e9
+    assert schedule.drift(1, 0.0) == 0.0  # second packet planned at 0.5 s
+    assert schedule.drift(2, 1.25) == 0.25e9
+    assert schedule.drift(4, 1.75) == 0.25e9  # second loop starts right after the last packet (at 1 s)
+    assert Schedule(path, ReplayRate("topspeed")).drift(2, 1.0) is None
+
+
+def test_achieved_rate():
+    assert achievedRate(100, 125000, 2.0) == {"packets": 100, "bytes": 125000, "seconds": 2.0, "pps": 50.0,
+                                              "mbps": 0.5}
+    assert achievedRate(0, 0, 0.0)["pps"] == 0.0
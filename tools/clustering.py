@@ -1,32 +1,117 @@
+import time
+import queue
+import multiprocessing
+
 import numpy as np
 
+from scipy.optimize import linear_sum_assignment
 from sklearn.cluster import KMeans, SpectralClustering, DBSCAN, OPTICS, AffinityPropagation, Birch
-from sklearn.neighbors import NearestNeighbors
-from sklearn.metrics import calinski_harabasz_score
+from sklearn.neighbors import NearestNeighbors, kneighbors_graph
+from sklearn.metrics import calinski_harabasz_score, silhouette_score
 from kneed import KneeLocator
 
+try:
+    import pyamg  # optional - faster eigensolver for sparse spectral clustering
+except ImportError:
+    pyamg = None
+
 from tools import messages
 
-class ClusteringResult():
-    def __init__(self, path, features):
-        self.pcapPath = path
-        self.pcapFeatures = features
-        self.cluster = None
-        self.cllusterBeforeNormalization = None
-        self.hostPair = None
+FORKSERVER_CONTEXT = None  # multiprocessing context of "Automatic" mode (see forkserverContext)
+
+class ClusteringResult():  # view of one file in ClusteringLabels - created on demand, nothing is copied
+    def __init__(self, labels, index):
+        self.labels = labels
+        self.index = index
+
+    @property
+    def pcapPath(self):
+        return self.labels.paths[self.index]
+
+    @property
+    def pcapFeatures(self):
+        return dict(zip(self.labels.featureNames, self.labels.featureTable[self.index].tolist()))
+
+    @property
+    def cluster(self):
+        return int(self.labels.clusters[self.index])
+
+    @property
+    def clusterBeforeNormalization(self):
+        return int(self.labels.rawLabels[self.index])
+
+    @property
+    def hostPair(self):
+        return self.labels.hostPairs[int(self.labels.hostPairIndex[self.index])]
+
+
+class ClusteringLabels():  # results of one clustering run - label arrays refer to paths and feature table shared by all runs
+    def __init__(self, mode, paths, featureNames, featureTable, rawLabels, clusters, hostPairIndex, hostPairs):
+        self.mode = mode
+        self.paths = paths  # list of pcap paths (shared)
+        self.featureNames = featureNames  # list of feature names - columns of feature table (shared)
+        self.featureTable = featureTable  # np.float64 array - files x features (shared)
+        self.rawLabels = rawLabels  # np.int32 array - cluster of each file before normalization
+        self.clusters = clusters  # np.int32 array - cluster of each file after normalization
+        self.hostPairIndex = hostPairIndex  # np.int32 array - number of host pair (key in hostPairs) of each file
+        self.hostPairs = hostPairs  # dict { number : (host1, host2) }
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        return ClusteringResult(self, index)
+
+    def __iter__(self):
+        for index in range(len(self.paths)):
+            yield ClusteringResult(self, index)
 
 
 class SupportCluster():  # support classs for equal distribiution of packets (when algorithm found more clusters than required)
     def __init__(self, label):
         self.label = label
-        self.size = 0  # size - number of packets
+        self.size = 0  # size - weight of cluster (number of packets by default, see ClusteringEngine.balanceWeight)
 
 
 class ClusteringEngine():
     def __init__(self):
-        self.results = []  # list of ClusteringResult objects
+        self.results = None  # ClusteringLabels object of last run
+        self.paths = []  # list of pcap paths - rows of feature table
+        self.featureNames = []  # list of feature names - columns of feature table
+        self.featureTable = None  # np.float64 array - files x features
+        self.rawLabels = None  # np.int32 array - cluster of each file before normalization
+        self.clusters = None  # np.int32 array - cluster of each file after normalization
         self.clustersSize = []   # list of SupportCluster objects
         self.hostPairs = {}  # dict { number/cluster : (host1, host2) }
+        self.normalizationMap = {}  # dict { cluster before normalization : cluster after normalization }
+        self.cache = None  # clusteringCache.ClusteringCache object (optional)
+        self.lastFromCache = False
+        self.preprocessor = None  # preprocessing.FeaturePreprocessor object (optional)
+        self.preparedData = None  # feature matrix after preprocessing - computed once, reused by every mode
+        self.timings = {}  # dict { stage name : time in seconds } of last run
+        self.preprocessingTimings = {}  # dict { stage name : time in seconds } of preprocessing
+        self.details = {}  # dict { name : value } - additional information about last run (e.g. memory used)
+        self.parameters = {  # parameters of algorithms (number of clusters is taken from host pairs)
+            "OPTICS": {"min_samples": 2},
+            "Affinity propagation": {"random_state": 5},
+            "Birch": {"n_clusters": 5},
+            "Sparse spectral clustering": {"n_neighbors": 10,
+                                           "eigen_solver": None,  # None - "amg" if pyamg is installed, else "lobpcg"
+                                           "memory_limit": 256 * 1024 * 1024},  # bytes for affinity graph
+            "Automatic": {"candidates": ("K-means", "Birch", "Sparse spectral clustering", "DBSCAN",
+                                         "OPTICS", "Affinity propagation", "Spectral clustering"),  # cheapest first
+                          "budget": 60.0,  # seconds for all candidates
+                          # seconds for one candidate by mode (dense affinity matrix modes are slower)
+                          "timeout": {"default": 20.0, "Spectral clustering": 30.0, "Affinity propagation": 30.0},
+                          "silhouette_sample": 2000}  # number of files used to compute silhouette score
+        }
+        self.leaderboard = []  # list of dicts - candidates checked in last "Automatic" run, best first
+        self.pcapsProfiles = {}  # dict { "pcap_path" : dict{traffic_profile} } - see featureExtraction.py
+        self.pathCapacities = {}  # dict { number of host pair : {"bandwidth": Mbit/s or None, "delay": ms, "path": list} }
+        self.pairLoads = []  # list of dicts - load of every host pair after assignment
+        self.balanceWeight = "packets"  # "packets", "bytes", "mean_rate", "peak_rate" or "combined" - what is balanced between groups
+        self.combinedWeights = {"packets": 0.2, "bytes": 0.4, "peak_rate": 0.4}  # shares of "combined" weight
+        self.groupLoads = []  # list of dicts - load of every group (cluster after normalization)
 
     def getResults(self):
         if self.results is None:
@@ -35,16 +120,71 @@ class ClusteringEngine():
             return self.results
 
     def updateFeatures(self, pcapsFeatures):
-        self.results.clear()
-        for key, value in pcapsFeatures.items():  # dictionary { "pcap_path" : dict{pcap_features} } - features listed in featureExtraction.py
-            result = ClusteringResult(path=key, features=value)
-            self.results.append(result)
+        # dictionary { "pcap_path" : dict{pcap_features} } - features listed in featureExtraction.py
+        self.results = None
+        self.rawLabels = None
+        self.clusters = None
+        self.paths = list(pcapsFeatures.keys())
+        self.featureNames = list(next(iter(pcapsFeatures.values())).keys()) if pcapsFeatures else []
+        self.featureTable = np.array([[features[name] for name in self.featureNames]
+                                      for features in pcapsFeatures.values()], dtype=np.float64)
+        self.preparedData = None
 
     def updateHostPairs(self, hostPairs):
         self.hostPairs = hostPairs
 
+    def updateCache(self, cache):
+        self.cache = cache
+
+    def updateProfiles(self, pcapsProfiles):
+        self.pcapsProfiles = pcapsProfiles
+
+    def updatePathCapacities(self, pathCapacities):
+        self.pathCapacities = pathCapacities
+
+    def updatePreprocessor(self, preprocessor):
+        self.preprocessor = preprocessor
+        self.preparedData = None
+
+    def getTimings(self):
+        return self.timings
+
+    def getPreprocessingTimings(self):
+        return self.preprocessingTimings
+
+    def getDetails(self):
+        return self.details
+
+    def getLeaderboard(self):
+        return self.leaderboard
+
+    def getPairLoads(self):
+        return self.pairLoads
+
+    def getGroupLoads(self):
+        return self.groupLoads
+
+    def updateBalanceWeight(self, weight, combined_weights=None):
+        if weight not in ("packets", "bytes", "mean_rate", "peak_rate", "combined"):
+            raise ValueError("Unknown balance weight \"" + str(weight) + "\".")
+        self.balanceWeight = weight
+        if combined_weights is not None:
+            self.combinedWeights = dict(combined_weights)
+
+    def prepareData(self):  # feature matrix is built (and preprocessed) once and reused by every mode
+        if self.preparedData is not None:
+            return self.preparedData
+
+        data = self.featureTable
+        self.preprocessingTimings.clear()
+        if self.preprocessor is not None:
+            data = self.preprocessor.fitTransform(data, self.featureNames)
+            self.preprocessingTimings.update(self.preprocessor.timings)
+        self.preparedData = data
+        return data
+
     def start(self, mode="K-means", restart=False):
-        if not self.results:
+        if not self.paths:
             messages.error("No \".pcap\" files given to engine.")
             return None
 
@@ -52,18 +192,176 @@ class ClusteringEngine():
             messages.error("No host pairs given to engine.")
         cluster_number = len(self.hostPairs)
 
-        if self.results[0].cluster and not restart:  # if self.results[0].cluster is not None ...
+        if self.results is not None and not restart:
             return self.results
 
-        data = []
-
-        for result in self.results:
-            feature_value_list = []
-            for feature_value in result.pcapFeatures.values():
-                feature_value_list.append(feature_value)
-            data.append(feature_value_list)
+        self.timings = {}
+        self.details = {}
+        data = self.prepareData()
+        mode = self.__modeName(mode)
+
+        self.lastFromCache = False
+        key = None
+        if self.cache is not None:
+            parameters = dict(self.parameters.get(mode, {}))
+            parameters["balance_weight"] = self.balanceWeight  # balancing result is cached as well
+            if self.balanceWeight == "combined":
+                parameters["combined_weights"] = tuple(sorted(self.combinedWeights.items()))
+            # balancing depends on weights of files (e.g. on traffic profiles) - they are a part of key
+            key = self.cache.makeKey(data, mode, parameters, cluster_number, self.__fileWeights(self.balanceWeight))
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.__applyCached(entry)
+                self.lastFromCache = True
+                return self.__makeResults(mode)
+
+        start_time = time.time()
+        if mode == "Automatic":
+            clustering_labels = self.__automatic(data, cluster_number)
+        else:
+            clustering_labels = self.fitLabels(mode, data, cluster_number)
+        if clustering_labels is None:
+            return None
+        self.timings["fit"] = time.time() - start_time
+
+        self.rawLabels = np.asarray(clustering_labels, dtype=np.int32)
+        labels, inverse = np.unique(self.rawLabels, return_inverse=True)
+        sizes = np.bincount(inverse, weights=self.__fileWeights(self.balanceWeight), minlength=len(labels))
+        self.clustersSize = []
+        for label, size in zip(labels.tolist(), sizes.tolist()):
+            cluster = SupportCluster(label)
+            cluster.size = size
+            self.clustersSize.append(cluster)
+
+        start_time = time.time()
+        self.__checkResults(cluster_number)
+        self.timings["balancing"] = time.time() - start_time
+
+        if key is not None:
+            self.cache.put(key, self.rawLabels, self.clusters, self.normalizationMap, self.details,
+                           self.leaderboard if mode == "Automatic" else None)
+        return self.__makeResults(mode)
+
+    def __fileWeights(self, weight):
+        # Weight of every file used in balancing. Files of group are replayed one after another (as in __groupRates),
+        # so rates are weighted by duration of files (bits sent at the rate) - sum of weights of group divided by its
+        # duration is its rate. Without profiles rates are not known - estimated bytes are balanced instead.
+        packets = self.featureTable[:, self.featureNames.index("packet_count")]
+        if weight == "packets":
+            return packets
+        if weight == "bytes" or (weight in ("mean_rate", "peak_rate") and not self.pcapsProfiles):
+            if self.pcapsProfiles:
+                return self.__profileColumn("bytes")
+            return packets * self.featureTable[:, self.featureNames.index("Avg_packet_length")]  # no profiles - estimate
+        if weight in ("mean_rate", "peak_rate"):
+            return self.__profileColumn(weight) * self.__profileColumn("duration")
+        if weight == "combined":
+            combined = np.zeros(len(self.paths))
+            for name, share in self.combinedWeights.items():
+                values = self.__fileWeights(name)
+                total = np.sum(values)
+                if total > 0:
+                    combined += share * values / total
+            return combined
+        raise ValueError("Unknown balance weight \"" + str(weight) + "\".")
+
+    def __computeGroupLoads(self):
+        groups = len(self.hostPairs)
+        self.groupLoads = []
+        if len(self.clusters) == 0 or self.clusters.min() < 0 or self.clusters.max() >= groups:
+            return
+
+        loads = {name: np.bincount(self.clusters, weights=self.__fileWeights(name), minlength=groups)
+                 for name in ("packets", "bytes")}
+        loads["mean_rate"], loads["peak_rate"] = self.__groupRates(groups)[1:]
+        balanced = np.bincount(self.clusters, weights=self.__fileWeights(self.balanceWeight), minlength=groups)
+        files = np.bincount(self.clusters, minlength=groups)
+        for group in range(groups):
+            self.groupLoads.append({
+                "group": group,
+                "files": int(files[group]),
+                "packets": int(loads["packets"][group]),
+                "bytes": int(loads["bytes"][group]),
+                "mean_rate": float(loads["mean_rate"][group]),
+                "peak_rate": float(loads["peak_rate"][group]),
+                "weight": float(balanced[group])
+            })
+        if self.balanceWeight in ("mean_rate", "peak_rate", "combined") and not self.pcapsProfiles:
+            self.details["balance weight"] = self.balanceWeight + " (bytes instead of rates - no traffic profiles)"
+        if np.mean(balanced) > 0:
+            self.details["imbalance (" + self.balanceWeight + ")"] = "%.2f" % (np.max(balanced) / np.mean(balanced))
+
+    def __makeResults(self, mode):
+        self.__computeGroupLoads()
+        start_time = time.time()
+        host_pair_index = self.__assignHostPairs()
+        self.timings["assignment"] = time.time() - start_time
+        self.results = ClusteringLabels(mode, self.paths, self.featureNames, self.featureTable,
+                                        self.rawLabels, self.clusters, host_pair_index, self.hostPairs)
+        return self.results
 
-        if mode == 1 or mode == "K-means":
+    def __profileColumn(self, name):
+        return np.array([self.pcapsProfiles.get(path, {}).get(name, 0.0) for path in self.paths], dtype=np.float64)
+
+    def __groupRates(self, groups):
+        # (bytes, mean bitrate, peak bitrate) of every group - files of group are replayed one after another
+        bytes_sent = np.bincount(self.clusters, weights=self.__profileColumn("bytes"), minlength=groups)
+        duration = np.bincount(self.clusters, weights=self.__profileColumn("duration"), minlength=groups)
+        mean_rate = np.divide(bytes_sent * 8, duration, out=np.zeros(groups), where=duration > 0)
+        peak_rate = np.zeros(groups)
+        np.maximum.at(peak_rate, self.clusters, self.__profileColumn("peak_rate"))
+        return bytes_sent, mean_rate, peak_rate
+
+    def __assignHostPairs(self):
+        # Groups (clusters after normalization) are assigned to host pairs, so that every group fits into
+        # capacity of path between its hosts. Cost of assignment is utilization of path bottleneck by group
+        # (higher of mean and peak bitrate), with high penalty for exceeding capacity. Solved with Hungarian algorithm.
+        pairs = np.array(sorted(self.hostPairs.keys()), dtype=np.int32)
+        groups = len(pairs)
+        self.pairLoads = []
+        if not groups or len(self.clusters) == 0 or self.clusters.min() < 0 or self.clusters.max() >= groups:
+            return self.clusters
+
+        bytes_sent, mean_rate, peak_rate = self.__groupRates(groups)
+        demand = np.maximum(mean_rate, peak_rate)
+
+        capacity = np.full(groups, np.inf)
+        delay = np.zeros(groups)
+        for column, pair in enumerate(pairs.tolist()):
+            path = self.pathCapacities.get(pair, {})
+            if path.get("bandwidth"):
+                capacity[column] = path["bandwidth"] * 1000000
+            delay[column] = path.get("delay", 0.0)
+
+        if self.pcapsProfiles and not np.all(np.isinf(capacity)):
+            utilization = demand[:, np.newaxis] / capacity[np.newaxis, :]
+            cost = utilization + 1000 * np.maximum(utilization - 1, 0) + delay[np.newaxis, :] * 1e-6  # delay - only tie-breaker
+            group_rows, pair_columns = linear_sum_assignment(cost)
+            assignment = np.empty(groups, dtype=np.int32)
+            assignment[group_rows] = pairs[pair_columns]
+        else:
+            assignment = pairs  # nothing known about traffic or topology - group i goes to i-th host pair
+
+        pair_column = {pair: column for column, pair in enumerate(pairs.tolist())}
+        for group in range(groups):
+            column = pair_column[int(assignment[group])]
+            utilization = demand[group] / capacity[column]
+            self.pairLoads.append({
+                "pair": self.hostPairs[int(assignment[group])],
+                "cluster": group,
+                "bytes": int(bytes_sent[group]),
+                "mean_rate": float(mean_rate[group]),
+                "peak_rate": float(peak_rate[group]),
+                "bandwidth": None if np.isinf(capacity[column]) else float(capacity[column]),
+                "delay": float(delay[column]),
+                "utilization": float(utilization)
+            })
+        if not np.all(np.isinf(capacity)):
+            self.details["max path utilization"] = "%.1f %%" % (100 * max(load["utilization"] for load in self.pairLoads))
+        return assignment[self.clusters]
+
+    def fitLabels(self, mode, data, cluster_number):
+        if mode == "K-means":
             kmeans = KMeans(n_clusters=cluster_number)
             ready = False
             while not ready:
@@ -73,62 +371,160 @@ class ClusteringEngine():
                 except ValueError as error:
                     print("Value error: " + str(error))
                     print(data)
-                    data.reshape(1, -1)  # ValueError: Expected 2D array, got 1D array instead:
+                    data = data.reshape(1, -1)  # ValueError: Expected 2D array, got 1D array instead:
                     # array=[].
                     # Reshape your data either using array.reshape(-1, 1) if your data has a single feature or array.reshape(1, -1) if it contains a single sample.
 
             clustering_labels = kmeans.predict(data)
-        elif mode == 2 or mode == "Spectral clustering":
+        elif mode == "Spectral clustering":
             spectral = SpectralClustering(n_clusters=cluster_number)
             clustering_labels = spectral.fit_predict(data)
-        elif mode == 3 or mode == "DBSCAN":
+        elif mode == "Sparse spectral clustering":
+            clustering_labels = self.__sparseSpectral(data, cluster_number)
+        elif mode == "DBSCAN":
+            start_time = time.time()
             eps = self.__estimateEps(data)
+            self.timings["eps estimation"] = time.time() - start_time
+            start_time = time.time()
             samples = self.__estimateSamples(data, eps)
+            self.timings["min_samples estimation"] = time.time() - start_time
 
             dbscan = DBSCAN(eps=eps, min_samples=samples)
             clustering_labels = dbscan.fit_predict(data)
             if -1 in clustering_labels:   # change noise label from -1 to 0
                 clustering_labels = [ x + 1 for x in clustering_labels]
-        elif mode == 4 or mode == "OPTICS":
-            optics = OPTICS(min_samples=2)
+        elif mode == "OPTICS":
+            optics = OPTICS(**self.parameters["OPTICS"])
             clustering_labels = optics.fit_predict(data)
             if -1 in clustering_labels:  # change noise label from -1 to 0
                 clustering_labels = [ x + 1 for x in clustering_labels]
-        elif mode == 5 or mode == "Affinity propagation":
-            affinity = AffinityPropagation(random_state=5)
+        elif mode == "Affinity propagation":
+            affinity = AffinityPropagation(**self.parameters["Affinity propagation"])
             clustering_labels = affinity.fit_predict(data)
-        elif mode == 6 or mode == "Birch":
-            brc = Birch(n_clusters=5)
+        elif mode == "Birch":
+            brc = Birch(**self.parameters["Birch"])
             clustering_labels = brc.fit_predict(data)
         else:
-            messages.error("Unknown clustering algorithm \"" + mode + "\".")
+            messages.error("Unknown clustering algorithm \"" + str(mode) + "\".")
             return None
-
-        self.clustersSize.clear()
-        for i in range(len(clustering_labels)):
-            self.results[i].cluster = clustering_labels[i]
-            found = False
-            for cluster in self.clustersSize:
-                if cluster.label == clustering_labels[i]:
-                    cluster.size += self.results[i].pcapFeatures["packet_count"]
-                    found = True
-            if not found:
-                cluster = SupportCluster(clustering_labels[i])
-                cluster.size += self.results[i].pcapFeatures["packet_count"]
-                self.clustersSize.append(cluster)
-
-        self.__checkResults(cluster_number)
-        return self.results
+        return clustering_labels
+
+    def __modeName(self, mode):
+        names = {1: "K-means", 2: "Spectral clustering", 3: "DBSCAN", 4: "OPTICS", 5: "Affinity propagation", 6: "Birch",
+                 7: "Sparse spectral clustering", 8: "Automatic"}
+        return names.get(mode, mode)
+
+    def __automatic(self, data, cluster_number):
+        # Every candidate is fitted in separate process, so it can be terminated when it exceeds its timeout.
+        # Candidates are scored with silhouette (computed on sample) and Calinski-Harabasz index (computed on all data).
+        parameters = self.parameters["Automatic"]
+        budget_start = time.time()
+        self.leaderboard = []
+        best_labels = None
+
+        for candidate in parameters["candidates"]:
+            entry = {"mode": candidate, "fit_time": None, "clusters": None,
+                     "silhouette": None, "calinski_harabasz": None, "status": "ok"}
+            self.leaderboard.append(entry)
+
+            remaining = parameters["budget"] - (time.time() - budget_start)
+            if remaining <= 0:
+                entry["status"] = "skipped (budget exceeded)"
+                continue
+
+            start_time = time.time()
+            timeout = parameters["timeout"].get(candidate, parameters["timeout"]["default"])
+            labels, status = self.__fitWithTimeout(candidate, data, cluster_number, min(timeout, remaining))
+            entry["fit_time"] = time.time() - start_time
+            if labels is None:
+                entry["status"] = status
+                continue
+
+            labels = np.asarray(labels)
+            entry["clusters"] = len(np.unique(labels))
+            if not 2 <= entry["clusters"] < len(labels):
+                entry["status"] = "not scored (" + str(entry["clusters"]) + " clusters)"
+                continue
+
+            sample_size = min(parameters["silhouette_sample"], len(labels))
+            entry["silhouette"] = float(silhouette_score(data, labels, sample_size=sample_size, random_state=5))
+            entry["calinski_harabasz"] = float(calinski_harabasz_score(data, labels))
+            entry["labels"] = labels
+
+        scored = [entry for entry in self.leaderboard if entry["silhouette"] is not None]
+        scored.sort(key=lambda x: (x["silhouette"], x["calinski_harabasz"]), reverse=True)
+        not_scored = [entry for entry in self.leaderboard if entry["silhouette"] is None]
+        self.leaderboard = scored + not_scored
+
+        if scored:
+            best_labels = scored[0]["labels"]
+            self.details["selected"] = scored[0]["mode"]
+        else:
+            best_labels = self.fitLabels("K-means", data, cluster_number)  # nothing usable found in budget
+            self.details["selected"] = "K-means (no candidate scored)"
+        for entry in scored:
+            del entry["labels"]
+        self.details["budget used"] = "%.2f sec." % (time.time() - budget_start)
+        return best_labels
+
+    def __fitWithTimeout(self, mode, data, cluster_number, timeout):
+        context = forkserverContext()
+        results = context.Queue()
+        process = context.Process(target=fitInProcess, args=(self.parameters, mode, data, cluster_number, results),
+                                  daemon=True)
+        start_time = time.time()
+        process.start()
+
+        output = None
+        while output is None:
+            try:
+                output = results.get(timeout=0.1)
+            except queue.Empty:
+                if not process.is_alive():
+                    try:
+                        output = results.get(timeout=0.5)  # process could finish just after last check
+                    except queue.Empty:
+                        pass
+                    break
+                if time.time() - start_time > timeout:
+                    break
+
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+        if output is None:
+            if time.time() - start_time > timeout:
+                return None, "timeout (" + "%.1f" % timeout + " sec.)"
+            return None, "failed (process exited with code " + str(process.exitcode) + ")"
+        labels, error = output
+        if labels is None:
+            return None, "failed (" + error + ")"
+        return labels, "ok"
+
+    def __applyCached(self, entry):
+        self.normalizationMap = dict(entry.mapping)
+        self.rawLabels = entry.labels
+        self.clusters = entry.clusters
+        self.details = dict(entry.details)
+        if entry.leaderboard is not None:
+            self.leaderboard = [dict(candidate) for candidate in entry.leaderboard]
 
     def __checkResults(self, cluster_number):
         if len(self.clustersSize) < cluster_number:
+            # fewer clusters than host pairs - K-means run instead, state of this run is kept (inner run resets it,
+            # balancing details are computed again for results of K-means)
+            timings, details, from_cache = self.timings, self.details, self.lastFromCache
+            details["fallback"] = "K-means (%d clusters for %d host pairs)" % (len(self.clustersSize), cluster_number)
             self.start(mode="K-means", restart=True)
+            for stage, stage_time in self.timings.items():
+                timings["fallback K-means " + stage] = stage_time
+            self.timings, self.details, self.lastFromCache = timings, details, from_cache
         elif len(self.clustersSize) == cluster_number:
-            for result in self.results:
-                result.clusterBeforeNormalization = result.cluster
-                result.hostPair = self.hostPairs[result.cluster]
+            self.normalizationMap = {cluster.label: cluster.label for cluster in self.clustersSize}
+            self.clusters = self.rawLabels.copy()
         else:
-            #   Algorithm to combine files into groups of similar size (packet number)
+            #   Algorithm to combine files into groups of similar size (weight chosen in self.balanceWeight)
             # Find the target group size. This is the sum of all sizes divided by n.
             # Create a list of sizes.
             # Sort the files decreasing in size.
@@ -172,11 +568,40 @@ class ClusteringEngine():
             for i in range(len(cluster_groups)):
                 for cluster in cluster_groups[i]:
                     old_to_new_map[cluster.label] = i
+            self.normalizationMap = old_to_new_map
+
+            old_labels = np.array(sorted(old_to_new_map.keys()), dtype=np.int32)
+            new_labels = np.array([old_to_new_map[label] for label in old_labels.tolist()], dtype=np.int32)
+            self.clusters = new_labels[np.searchsorted(old_labels, self.rawLabels)]
+
+    def __sparseSpectral(self, data, cluster_number):
+        # Dense RBF affinity needs n^2 memory - instead symmetric k-nearest-neighbors graph is used (at most 2k entries per file),
+        # and eigenproblem is solved with solver for sparse matrices (lobpcg or amg).
+        parameters = self.parameters["Sparse spectral clustering"]
+        n_samples = data.shape[0]
+        if n_samples <= cluster_number:
+            return list(range(n_samples))
+
+        bytes_per_entry = np.dtype(np.float64).itemsize + np.dtype(np.int32).itemsize  # value + column index
+        max_neighbors = int(parameters["memory_limit"] / (2 * n_samples * bytes_per_entry))
+        n_neighbors = max(1, min(parameters["n_neighbors"], n_samples - 1, max_neighbors))
 
-            for result in self.results:
-                result.clusterBeforeNormalization = result.cluster
-                result.cluster = old_to_new_map[result.cluster]
-                result.hostPair = self.hostPairs[result.cluster]
+        graph = kneighbors_graph(data, n_neighbors=n_neighbors, mode="connectivity", include_self=False)
+        affinity = (0.5 * (graph + graph.T)).tocsr()
+        memory = affinity.data.nbytes + affinity.indices.nbytes + affinity.indptr.nbytes
+
+        solver = parameters["eigen_solver"]
+        if solver is None:
+            solver = "amg" if pyamg is not None else "lobpcg"
+
+        self.details["neighbors"] = n_neighbors
+        self.details["eigen solver"] = solver
+        self.details["affinity memory"] = "%.2f MB" % (memory / (1024 * 1024))
+        self.details["dense affinity memory"] = "%.2f MB" % (n_samples * n_samples * 8 / (1024 * 1024))
+
+        spectral = SpectralClustering(n_clusters=cluster_number, affinity="precomputed",
+                                      eigen_solver=solver, random_state=5)
+        return spectral.fit_predict(affinity)
 
     def __estimateEps(self, data):
         neigh = NearestNeighbors(n_neighbors=2)
@@ -205,7 +630,7 @@ class ClusteringEngine():
         centers = list(range(2, 30))
 
         max_score = 0
-        samples = 0
+        samples = centers[0]  # used when no value gives valid score (e.g. every point in one cluster)
         for center in centers:
             score = self.__getScore(data, eps, center)
             scores.append(score)
@@ -214,3 +639,25 @@ class ClusteringEngine():
                 samples = center
 
         return samples
+
+
+def forkserverContext():
+    # forkserver - candidates of "Automatic" mode are forked from a clean server process (forked copy of GUI process
+    # with Qt and BLAS/OpenMP threads can deadlock), which imports clustering once instead of once per candidate
+    # (spawn). Preload is set once, when the context is first used (before the server is started).
+    global FORKSERVER_CONTEXT
+    if FORKSERVER_CONTEXT is None:
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["tools.clustering"])
+        FORKSERVER_CONTEXT = context
+    return FORKSERVER_CONTEXT
+
+
+def fitInProcess(parameters, mode, data, cluster_number, results):  # target of processes started by "Automatic" mode
+    try:
+        engine = ClusteringEngine()
+        engine.parameters = parameters
+        labels = engine.fitLabels(mode, data, cluster_number)
+        results.put((np.asarray(labels, dtype=np.int32), None))
+    except Exception as e:
+        results.put((None, type(e).__name__ + ": " + str(e)))
@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+#   Benchmark of clustering engine on synthetic feature matrices (same columns as features of real pcaps).
+# Usage (from repository root):
+#   python3 -m tools.clusteringBenchmark --sizes 100 1000 10000 --output bench.json
+#   python3 -m tools.clusteringBenchmark --compare old_bench.json new_bench.json
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+
+import numpy as np
+import sklearn
+
+from tools import clustering, preprocessing
+from tools.featureExtraction import emptyFeatures
+
+MODES = ["K-means", "Spectral clustering", "Sparse spectral clustering", "DBSCAN",
+         "OPTICS", "Affinity propagation", "Birch", "Automatic"]
+DATASETS = ["blobs", "heavy-tailed", "duplicates"]
+# algorithms with O(n^2) memory or time - skipped above this number of files unless --no-limits is given
+# ("Automatic" tries them as candidates - its peak memory does not include their processes)
+SIZE_LIMITS = {"Spectral clustering": 10000, "Affinity propagation": 5000, "OPTICS": 20000, "DBSCAN": 50000,
+               "Automatic": 10000}
+
+
+def generateFeatures(size, dataset="blobs", centers=8, seed=5):
+    # returns dict { "pcap_path" : dict{pcap_features} } - the same structure as FeatureExtractor.getAll()
+    rng = np.random.default_rng(seed)
+    names = list(emptyFeatures().keys())
+    counters = [name for name in names if name in preprocessing.COUNT_FEATURES]
+
+    labels = rng.integers(0, centers, size)
+    if dataset == "heavy-tailed":
+        packet_count = np.floor(rng.pareto(1.2, size) * 100) + 1  # few files with millions of packets
+    else:
+        packet_count = np.floor(10 ** rng.uniform(1, 4, centers))[labels] * rng.uniform(0.8, 1.2, size)
+    packet_count = np.maximum(packet_count, 1)
+
+    table = np.zeros((size, len(names)))
+    ratios = rng.dirichlet(np.ones(len(counters) - 1), centers)  # share of packets with given flag/protocol/port
+    for column, name in enumerate(names):
+        if name == "packet_count":
+            table[:, column] = packet_count
+        elif name in counters:
+            ratio = ratios[labels, counters.index(name) - 1] * len(counters) / 4
+            table[:, column] = np.floor(packet_count * np.clip(ratio + rng.normal(0, 0.02, size), 0, 1))
+
+    table[:, names.index("Avg_delta_time")] = rng.exponential(rng.uniform(0.001, 1, centers)[labels])
+    table[:, names.index("Avg_packet_length")] = np.clip(rng.normal(rng.uniform(60, 1500, centers)[labels], 50), 60, 1514)
+    table[:, names.index("Avg_TCP_payload_length")] = np.clip(table[:, names.index("Avg_packet_length")] - 54, 0, None)
+
+    if dataset == "duplicates":  # half of files are exact copies of other files
+        copies = rng.integers(0, size // 2 + 1, size - size // 2)
+        table[size // 2:] = table[copies]
+
+    return {"synthetic/" + dataset + "/" + str(i) + ".pcap": dict(zip(names, row))
+            for i, row in enumerate(table.tolist())}
+
+
+def runMode(features, mode, pairs, preprocess):
+    engine = clustering.ClusteringEngine()
+    engine.updateFeatures(features)
+    engine.updateHostPairs({i: ("h" + str(2 * i + 1), "h" + str(2 * i + 2)) for i in range(pairs)})
+    if preprocess:
+        engine.updatePreprocessor(preprocessing.FeaturePreprocessor())
+
+    tracemalloc.start()
+    start_time = time.time()
+    try:
+        engine.prepareData()
+        results = engine.start(mode=mode, restart=True)
+        status = "ok"
+    except Exception as e:
+        results = None
+        status = "failed (" + type(e).__name__ + ": " + str(e) + ")"
+    total_time = time.time() - start_time
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timings = {"preprocessing: " + stage: stage_time for stage, stage_time in engine.getPreprocessingTimings().items()}
+    timings.update(engine.getTimings())
+    entry = {
+        "status": status,
+        "total_time": total_time,
+        "timings": timings,
+        "peak_memory_bytes": peak_memory,
+        "clusters_found": len(engine.normalizationMap) if results is not None else None,
+        "details": {name: str(value) for name, value in engine.getDetails().items()}
+    }
+    if mode == "Automatic":
+        entry["candidates"] = [{"mode": candidate["mode"], "status": candidate["status"],
+                                "fit_time": candidate["fit_time"], "silhouette": candidate["silhouette"]}
+                               for candidate in engine.getLeaderboard()]
+    return entry
+
+
+def currentCommit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(sizes, datasets, modes, pairs=4, preprocess=True, limits=True):
+    report = {
+        "commit": currentCommit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "sklearn": sklearn.__version__,
+        "pairs": pairs,
+        "preprocessing": preprocess,
+        "results": []
+    }
+    for size in sizes:
+        for dataset in datasets:
+            features = generateFeatures(size, dataset)
+            for mode in modes:
+                entry = {"size": size, "dataset": dataset, "mode": mode}
+                if limits and size > SIZE_LIMITS.get(mode, size):
+                    entry["status"] = "skipped (more than " + str(SIZE_LIMITS[mode]) + " files)"
+                else:
+                    entry.update(runMode(features, mode, pairs, preprocess))
+                report["results"].append(entry)
+                print(formatEntry(entry))
+                sys.stdout.flush()
+    return report
+
+
+def formatEntry(entry):
+    text = "%8d  %-13s %-27s " % (entry["size"], entry["dataset"], entry["mode"])
+    if entry["status"] != "ok":
+        return text + entry["status"]
+    return text + "%9.3f sec. %9.1f MB  %s" % (entry["total_time"], entry["peak_memory_bytes"] / (1024 * 1024),
+                                              ", ".join(stage + ": %.3f" % t for stage, t in entry["timings"].items()))
+
+
+def compare(old_path, new_path):
+    with open(old_path) as file:
+        old = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+
+    old_results = {(e["size"], e["dataset"], e["mode"]): e for e in old["results"] if e["status"] == "ok"}
+    print("old: " + str(old.get("commit")) + "\nnew: " + str(new.get("commit")))
+    for entry in new["results"]:
+        key = (entry["size"], entry["dataset"], entry["mode"])
+        if entry["status"] != "ok" or key not in old_results:
+            continue
+        previous = old_results[key]
+        print("%8d  %-13s %-27s time x%.2f  memory x%.2f" % (
+            entry["size"], entry["dataset"], entry["mode"],
+            entry["total_time"] / max(previous["total_time"], 1e-9),
+            entry["peak_memory_bytes"] / max(previous["peak_memory_bytes"], 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of clustering engine on synthetic feature matrices.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="numbers of files (rows of feature matrix), e.g. 100 1000 10000 100000 1000000")
+    parser.add_argument("--datasets", nargs="+", default=DATASETS, choices=DATASETS)
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--pairs", type=int, default=4, help="number of host pairs (clusters after balancing)")
+    parser.add_argument("--raw", action="store_true", help="do not preprocess features")
+    parser.add_argument("--no-limits", action="store_true", help="run O(n^2) algorithms for every size")
+    parser.add_argument("--output", default=os.path.join(tempfile.gettempdir(), "clustering_bench.json"),
+                        help="path of JSON report (default - in temporary directory)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two reports and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = benchmark(args.sizes, args.datasets, args.modes, args.pairs, not args.raw, not args.no_limits)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print("Report written to " + args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+class CachedClustering():
+    def __init__(self, labels, clusters, mapping, details=None, leaderboard=None):
+        self.labels = labels  # np.int32 array - cluster of each file before normalization
+        self.clusters = clusters  # np.int32 array - cluster of each file after normalization (host pair number)
+        self.mapping = mapping  # dict { cluster before normalization : cluster after normalization }
+        self.details = details if details is not None else {}  # details of run (ClusteringEngine.getDetails)
+        self.leaderboard = leaderboard  # candidates of "Automatic" run (ClusteringEngine.getLeaderboard), None - other mode
+
+
+class ClusteringCache():
+    # Results of clustering are kept in memory (LRU) and optionally in directory on disk,
+    # so clustering the same feature matrix again (e.g. after "Retry") does not refit algorithm.
+    def __init__(self, max_entries=32, directory=None, max_disk_entries=256):
+        self.maxEntries = max_entries
+        self.directory = directory
+        self.maxDiskEntries = max_disk_entries
+        self.entries = OrderedDict()  # { key : CachedClustering }  <- most recently used at the end
+        self.hits = 0
+        self.misses = 0
+
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def makeKey(self, data, mode, parameters, cluster_number, weights=None):
+        # weights - weight of every file used in balancing (result after balancing depends on them)
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        digest = hashlib.sha256()
+        digest.update(str(data.shape).encode())
+        digest.update(data.tobytes())
+        digest.update(str(mode).encode())
+        if parameters:
+            digest.update(repr(sorted(parameters.items())).encode())
+        digest.update(str(cluster_number).encode())
+        if weights is not None:
+            digest.update(b"weights")
+            digest.update(np.ascontiguousarray(weights, dtype=np.float64).tobytes())
+        return digest.hexdigest()
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        entry = self.__load(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.__remember(key, entry)
+        return entry
+
+    def put(self, key, labels, clusters, mapping, details=None, leaderboard=None):
+        entry = CachedClustering(np.asarray(labels, dtype=np.int32),
+                                 np.asarray(clusters, dtype=np.int32),
+                                 dict(mapping), dict(details or {}),
+                                 [dict(candidate) for candidate in leaderboard] if leaderboard is not None else None)
+        self.__remember(key, entry)
+        self.__save(key, entry)
+        return entry
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)  # least recently used
+
+    def __path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def __load(self, key):
+        if self.directory is None:
+            return None
+        path = self.__path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path) as stored:
+                mapping = dict(zip(stored["mapping_keys"].tolist(), stored["mapping_values"].tolist()))
+                # details and leaderboard as JSON (entries saved before they were kept have none)
+                report = json.loads(str(stored["report"])) if "report" in stored.files else {}
+                entry = CachedClustering(stored["labels"], stored["clusters"], mapping,
+                                         report.get("details"), report.get("leaderboard"))
+        except (OSError, ValueError, KeyError):
+            return None
+        os.utime(path)  # mark as recently used
+        return entry
+
+    def __save(self, key, entry):
+        if self.directory is None:
+            return
+        mapping_keys = np.array(list(entry.mapping.keys()), dtype=np.int64)
+        mapping_values = np.array(list(entry.mapping.values()), dtype=np.int64)
+        report = json.dumps({"details": entry.details, "leaderboard": entry.leaderboard}, default=float)
+        try:
+            with open(self.__path(key), "wb") as file:
+                np.savez(file, labels=entry.labels, clusters=entry.clusters,
+                         mapping_keys=mapping_keys, mapping_values=mapping_values, report=np.array(report))
+        except OSError:
+            return
+
+        files = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".npz")]
+        if len(files) > self.maxDiskEntries:
+            files.sort(key=os.path.getmtime)
+            for path in files[:len(files) - self.maxDiskEntries]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
@@ -1,15 +1,67 @@
 import shutil
 
+import numpy as np
 from scapy.all import *
 from scapy.layers.http import *
 
 from tools import messages
 
+def emptyFeatures():  # features extracted from every pcap (columns of feature table used in clustering)
+    return {
+        # number of packets in pcap
+        "packet_count" : 0,
+        # TCP flags
+        "FIN" : 0,
+        "SYN" : 0,
+        "RST" : 0,
+        "PSH" : 0,
+        "ACK" : 0,
+        "URG" : 0,
+        "ECE" : 0,
+        "CWR" : 0,
+        "NS" : 0,
+        # protocols
+        "TCP" : 0,
+        "UDP": 0,
+        "ICMP": 0,
+        "DNS" : 0,
+        "HTTP": 0,
+        # TCP / UDP ports
+        "port_21" : 0,     #  FTP
+        "port_22" : 0,     #  SSH
+        "port_23" : 0,     #  Telnet
+        "port_25" : 0,     #  SMTP
+        "port_53" : 0,     #  DNS
+        "port_80" : 0,     #  HTTP
+        "port_110" : 0,    #  POP3
+        "port_111" : 0,    #  ONC RPC
+        "port_135" : 0,    #  Microsoft EPMAP (RPC)
+        "port_139" : 0,    #  NetBIOS Session Service
+        "port_143" : 0,    #  IMAP
+        "port_443" : 0,    #  HTTPS
+        "port_445" : 0,    #  Microsoft-DS
+        "port_993" : 0,    #  IMAPS
+        "port_995" : 0,    #  POP3S
+        "port_1723" : 0,   #  PPTP
+        "port_3306" : 0,   #  MySQL
+        "port_3389" : 0,   #  Microsoft Windows Based Terminal (WBT)
+        "port_5900" : 0,   #  VNC
+        "port_8080" : 0,   #  HTTP (proxy)
+        # general parameters (average)
+        "Avg_delta_time" : 0.0,
+        "Avg_packet_length": 0.0,
+        "Avg_TCP_payload_length": 0.0
+    }
+
+
 class FeatureExtractor():
 
-    def __init__(self):
+    def __init__(self, rate_window=1.0, rate_bin=0.1):
         self.pcapsFeatures = {}  # dictionary { "pcap_path" : dict{pcap_features} } - features listed in self.extract()
+        self.pcapsProfiles = {}  # dictionary { "pcap_path" : dict{traffic_profile} } - not used as clustering features
         self.directoryList = []  # list of created directories with split pcaps (for cleaning later)
+        self.rateWindow = rate_window  # seconds - sliding window for peak bitrate
+        self.rateBin = rate_bin  # seconds - resolution of sliding window
 
     def getAll(self):
         return self.pcapsFeatures
@@ -17,6 +69,9 @@ class FeatureExtractor():
     def getAllPaths(self):
         return list(self.pcapsFeatures.keys())
 
+    def getProfiles(self):
+        return self.pcapsProfiles
+
     def getDirectories(self):
         return self.directoryList
 
@@ -63,59 +118,24 @@ class FeatureExtractor():
         if pcap_path in self.pcapsFeatures:
             return self.pcapsFeatures[pcap_path]
 
-        features = {
-            # number of packets in pcap
-            "packet_count" : 0,
-            # TCP flags
-            "FIN" : 0,
-            "SYN" : 0,
-            "RST" : 0,
-            "PSH" : 0,
-            "ACK" : 0,
-            "URG" : 0,
-            "ECE" : 0,
-            "CWR" : 0,
-            "NS" : 0,
-            # protocols
-            "TCP" : 0,
-            "UDP": 0,
-            "ICMP": 0,
-            "DNS" : 0,
-            "HTTP": 0,
-            # TCP / UDP ports
-            "port_21" : 0,     #  FTP
-            "port_22" : 0,     #  SSH
-            "port_23" : 0,     #  Telnet
-            "port_25" : 0,     #  SMTP
-            "port_53" : 0,     #  DNS
-            "port_80" : 0,     #  HTTP
-            "port_110" : 0,    #  POP3
-            "port_111" : 0,    #  ONC RPC
-            "port_135" : 0,    #  Microsoft EPMAP (RPC)
-            "port_139" : 0,    #  NetBIOS Session Service
-            "port_143" : 0,    #  IMAP
-            "port_443" : 0,    #  HTTPS
-            "port_445" : 0,    #  Microsoft-DS
-            "port_993" : 0,    #  IMAPS
-            "port_995" : 0,    #  POP3S
-            "port_1723" : 0,   #  PPTP
-            "port_3306" : 0,   #  MySQL
-            "port_3389" : 0,   #  Microsoft Windows Based Terminal (WBT)
-            "port_5900" : 0,   #  VNC
-            "port_8080" : 0,   #  HTTP (proxy)
-            # general parameters (average)
-            "Avg_delta_time" : 0.0,
-            "Avg_packet_length": 0.0,
-            "Avg_TCP_payload_length": 0.0
+        features = emptyFeatures()
+        profile = {
+            "bytes" : 0,
+            "duration" : 0.0,     # seconds
+            "mean_rate" : 0.0,    # bits per second
+            "peak_rate" : 0.0     # bits per second, highest in sliding window (self.rateWindow)
         }
 
-        self.__extractWithScapy(features, pcap_path, packet_limit)
+        self.__extractWithScapy(features, pcap_path, packet_limit, profile)
 
         self.pcapsFeatures[pcap_path] = features
+        self.pcapsProfiles[pcap_path] = profile
         return features
 
-    def __extractWithScapy(self, features, pcap_path, packet_limit = 0):
+    def __extractWithScapy(self, features, pcap_path, packet_limit = 0, profile = None):
         pkts = PcapReader(pcap_path)
+        rate_bins = {}  # { number of bin : bytes }  <- bins of self.rateBin seconds
+        first_time = None
 
         # dictionary - faster than list and creating name each time
         port_map = {
@@ -220,9 +240,17 @@ class FeatureExtractor():
 
             features["Avg_packet_length"] += len(pkt)
 
+            if first_time is None:
+                first_time = float(pkt.time)
+            rate_bin = int((float(pkt.time) - first_time) / self.rateBin)
+            rate_bins[rate_bin] = rate_bins.get(rate_bin, 0) + len(pkt)
+
             if 0 < packet_limit == features["packet_count"]:
                 break
 
+        if profile is not None and rate_bins:
+            self.__fillProfile(profile, rate_bins, float(previous_time) - first_time)
+
         if (features["packet_count"] - 1) != 0:
             features["Avg_delta_time"] = float(features["Avg_delta_time"] / (features["packet_count"] - 1))
         if features["packet_count"] != 0:
@@ -231,6 +259,24 @@ class FeatureExtractor():
             features["Avg_TCP_payload_length"] = features["Avg_TCP_payload_length"] / features["TCP"]
 
 
+    def __fillProfile(self, profile, rate_bins, duration):
+        bins = np.zeros(max(rate_bins) + 1)
+        bins[list(rate_bins.keys())] = list(rate_bins.values())
+        window = max(1, int(round(self.rateWindow / self.rateBin)))  # number of bins in sliding window
+        if len(bins) > window:
+            cumulative = np.concatenate(([0.0], np.cumsum(bins)))
+            peak_bytes = np.max(cumulative[window:] - cumulative[:-window])
+        else:
+            peak_bytes = np.sum(bins)
+
+        profile["bytes"] = int(np.sum(bins))
+        profile["duration"] = duration
+        profile["peak_rate"] = float(peak_bytes * 8 / self.rateWindow)
+        if duration > 0:
+            profile["mean_rate"] = profile["bytes"] * 8 / duration
+        else:
+            profile["mean_rate"] = profile["peak_rate"]
+
     def __splitWithScapy(self, pcap_path, flows = False, file_limit = 100):
         files_map = {}   #  { tuple(src_IP, src_port, dst_IP, dst_port) : pcap_path}   -> if flows=False then only IP
 
@@ -306,6 +352,7 @@ class FeatureExtractor():
     def clear(self):
         self.splitClean()
         self.pcapsFeatures.clear()
+        self.pcapsProfiles.clear()
         self.directoryList.clear()
 
     def splitClean(self):
@@ -0,0 +1,74 @@
+import subprocess
+
+try:
+    from pyroute2 import IPRoute, NetNS  # optional - replay interfaces set up over netlink instead of shell commands
+except ImportError:
+    IPRoute = None
+    NetNS = None
+
+ETH_P_ALL = 0x0003
+ETH_P_8942 = 0x8942  # frames of this type arriving to replay veth are dropped (not mirrored)
+INGRESS_HANDLE = 0xffff0000
+MTU = 65535  # for tcpreplay to not crash on too big packets
+
+
+def available():
+    return IPRoute is not None
+
+
+def setupHost(host_name, pid, number, network_interface):
+    # Replay interfaces of one host with netlink requests - no process is started except iptables:
+    #   root namespace: veth pair <host>-veth0 / <host>-out0, 4.4.<number>.2/24 and MTU on outside end,
+    #                   inside end moved to namespace of host (pid)
+    #   host namespace: 4.4.<number>.1/24 on inside end, ingress qdisc with filters which drop frames of type 0x8942
+    #                   and mirror all other frames to network_interface
+    # Requests of every namespace are sent over one netlink socket (one session per namespace, no socket is opened
+    # per operation). Returns tuple (inside_intf, outside_intf), raises RuntimeError (or netlink error) on failure.
+    inside_intf = host_name + "-veth0"
+    outside_intf = host_name + "-out0"
+    with IPRoute() as ipr:
+        for intf in (inside_intf, outside_intf):
+            if ipr.link_lookup(ifname=intf):
+                raise RuntimeError("interface " + intf + " does already exist")
+        ipr.link("add", ifname=inside_intf, kind="veth", peer=outside_intf)
+        try:
+            outside = ipr.link_lookup(ifname=outside_intf)[0]
+            ipr.addr("add", index=outside, address="4.4." + str(number) + ".2", prefixlen=24)
+            ipr.link("set", index=outside, mtu=MTU, state="up")
+            ipr.link("set", index=ipr.link_lookup(ifname=inside_intf)[0], net_ns_pid=pid)
+        except Exception:
+            ipr.link("del", index=ipr.link_lookup(ifname=outside_intf)[0])
+            raise
+
+    try:
+        with NetNS("/proc/" + str(pid) + "/ns/net") as ns:
+            inside = ns.link_lookup(ifname=inside_intf)[0]
+            mirror_to = ns.link_lookup(ifname=network_interface)
+            if not mirror_to:
+                raise RuntimeError("interface " + network_interface + " not found in " + host_name)
+            ns.addr("add", index=inside, address="4.4." + str(number) + ".1", prefixlen=24)
+            ns.link("set", index=inside, state="up")
+            ns.tc("add", "ingress", inside, INGRESS_HANDLE)
+            ns.tc("add-filter", "u32", inside, parent=INGRESS_HANDLE, protocol=ETH_P_8942, prio=1,
+                  keys=["0x0/0x0+0"], action={"kind": "gact", "action": "drop"})
+            ns.tc("add-filter", "u32", inside, parent=INGRESS_HANDLE, protocol=ETH_P_ALL, prio=2,
+                  keys=["0x0/0x0+0"], action={"kind": "mirred", "direction": "egress", "action": "mirror",
+                                               "ifindex": mirror_to[0]})
+
+        # NAT has no netlink interface - iptables is run in namespace of host
+        result = subprocess.run(["mnexec", "-a", str(pid), "iptables", "-t", "nat", "-A", "POSTROUTING",
+                                 "-o", network_interface, "-j", "MASQUERADE"],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+        if result.returncode != 0:
+            raise RuntimeError("iptables failed in " + host_name + ": " + result.stderr.strip())
+    except Exception:
+        removeVeth(outside_intf)  # nothing is left half-configured (e.g. for shell fallback)
+        raise
+    return inside_intf, outside_intf
+
+
+def removeVeth(intf):  # removes both ends of veth pair (if it exists)
+    with IPRoute() as ipr:
+        indexes = ipr.link_lookup(ifname=intf)
+        if indexes:
+            ipr.link("del", index=indexes[0])
@@ -0,0 +1,67 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class SkippedJob(Exception):
+    pass
+
+
+class JobGraph():
+    # Jobs with dependencies run on bounded pool of worker threads (jobs are expected to wait for subprocesses or I/O).
+    # A job starts when all jobs it depends on are finished, jobs depending on a failed job are skipped.
+    def __init__(self):
+        self.jobs = {}  # dict { key : (function, args) }
+        self.dependencies = {}  # dict { key : set of keys }
+
+    def add(self, key, function, *args, after=()):
+        self.jobs[key] = (function, args)
+        self.dependencies[key] = set(after)
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def run(self, workers=None, finished=None):
+        # finished(key, result, error) is called from the calling thread after every job (error is None on success)
+        # returns (dict { key : result }, dict { key : exception }) - skipped jobs have SkippedJob exception
+        results = {}
+        errors = {}
+        waiting = {key: set(dependencies) for key, dependencies in self.dependencies.items()}
+        dependents = {}
+        for key, dependencies in self.dependencies.items():
+            for dependency in dependencies:
+                dependents.setdefault(dependency, []).append(key)
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+            running = {}
+            while True:
+                for key in [key for key, dependencies in waiting.items() if not dependencies]:
+                    del waiting[key]
+                    function, args = self.jobs[key]
+                    running[executor.submit(function, *args)] = key
+                if not running:
+                    break
+
+                done, pending = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    try:
+                        results[key] = future.result()
+                    except Exception as e:
+                        errors[key] = e
+                    if finished is not None:
+                        finished(key, results.get(key), errors.get(key))
+                    if key in errors:
+                        self.__skip(key, waiting, dependents, errors, finished)
+                    else:
+                        for dependent in dependents.get(key, []):
+                            waiting[dependent].discard(key)
+        return results, errors
+
+    def __skip(self, failed_key, waiting, dependents, errors, finished):
+        for dependent in dependents.get(failed_key, []):
+            if dependent in waiting:
+                del waiting[dependent]
+                errors[dependent] = SkippedJob("skipped - " + str(failed_key) + " failed")
+                if finished is not None:
+                    finished(dependent, None, errors[dependent])
+                self.__skip(dependent, waiting, dependents, errors, finished)
@@ -0,0 +1,406 @@
+import os
+import time
+import heapq
+import select
+import socket
+import struct
+import itertools
+import threading
+
+import numpy as np
+
+from tools import pcapFile, replayRate, nativeReplay, nativeRewrite
+
+ETHERTYPE_IPV4 = 0x0800
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+TCP_OPTION_END = 0
+TCP_OPTION_NOP = 1
+TCP_OPTION_SACK = 5
+TCP_OPTION_TIMESTAMP = 8
+SEQUENCE_MASK = 0xffffffff
+LOOP_SEQUENCE_SHIFT = 0x40000000  # client sequence numbers move with every loop - new SYN is accepted in TIME_WAIT
+RESPONSE_TIMEOUT = 1.0  # s - longest wait for response of live peer, then flow is given up
+FLOW_STATES = ("complete", "refused", "reset", "timeout")  # final states of closed-loop flows
+
+
+def parseTcp(frame):
+    # (source ip, source port, destination ip, destination port, sequence, ack, flags, payload length, ihl,
+    # total length) of IPv4 TCP frame, None for other frames (and for fragments)
+    if len(frame) < 34 or struct.unpack_from(">H", frame, 12)[0] != ETHERTYPE_IPV4 or frame[14] >> 4 != 4:
+        return None
+    ihl = (frame[14] & 0x0f) * 4
+    total_length, flags_offset = struct.unpack_from(">H2xH", frame, 16)
+    if frame[23] != nativeRewrite.PROTOCOL_TCP or flags_offset & 0x3fff or len(frame) < 14 + ihl + 20:
+        return None
+    tcp = 14 + ihl
+    source_port, destination_port, sequence, ack, offset, flags = struct.unpack_from(">HHIIBB", frame, tcp)
+    payload = total_length - ihl - (offset >> 4) * 4
+    return frame[26:30], source_port, frame[30:34], destination_port, sequence, ack, flags, payload, ihl, total_length
+
+
+def rewriteClientFrame(frame, parsed, sequence_shift, ack):
+    # Copy of client frame with sequence moved by sequence_shift, ack number replaced (None - kept) and SACK and
+    # timestamp options replaced by NOPs - they refer to captured peer, so live peer would reject them.
+    ihl, total_length = parsed[8], parsed[9]
+    tcp = 14 + ihl
+    frame = bytearray(frame)
+    struct.pack_into(">I", frame, tcp + 4, (parsed[4] + sequence_shift) & SEQUENCE_MASK)
+    if ack is not None:
+        struct.pack_into(">I", frame, tcp + 8, ack & SEQUENCE_MASK)
+    position = tcp + 20
+    end = min(tcp + (frame[tcp + 12] >> 4) * 4, len(frame))
+    while position < end:
+        kind = frame[position]
+        if kind == TCP_OPTION_END:
+            break
+        if kind == TCP_OPTION_NOP:
+            position += 1
+            continue
+        length = frame[position + 1] if position + 1 < end else 0
+        if length < 2:
+            break
+        if kind in (TCP_OPTION_SACK, TCP_OPTION_TIMESTAMP):
+            frame[position:position + length] = bytes([TCP_OPTION_NOP]) * length
+        position += length
+    struct.pack_into(">H", frame, tcp + 16, 0)
+    segment = bytes(frame[tcp:14 + total_length])
+    pseudo_header = bytes(frame[26:34]) + bytes([0, nativeRewrite.PROTOCOL_TCP]) + struct.pack(">H", len(segment))
+    struct.pack_into(">H", frame, tcp + 16, nativeRewrite.internetChecksum(pseudo_header + segment))
+    return bytes(frame)
+
+
+class FlowPlan():
+    # TCP conversation of capture which starts with SYN - only packets of client (sender of SYN) are replayed,
+    # live peer answers them instead of captured server packets.
+    def __init__(self, client, server):
+        self.client = client  # (ip bytes, port)
+        self.server = server
+        self.packets = []  # indexes of client packets in file
+        self.acks = []  # captured ack numbers of client packets (None - no ACK flag)
+        self.serverIsn = None  # captured initial sequence number of server
+        self.serverEnd = None  # captured sequence number after the last server packet
+        self.required = []  # server progress (bytes, SYN and FIN) which must be received before client packet is sent
+        self.final = 0  # server progress of the whole captured conversation
+
+    def finish(self):
+        if self.serverIsn is None:  # capture without SYN-ACK - first ack of client acknowledges it
+            first_ack = next((ack for ack in self.acks if ack is not None), None)
+            self.serverIsn = (first_ack - 1) & SEQUENCE_MASK if first_ack is not None else 0
+        self.required = [(ack - self.serverIsn) & SEQUENCE_MASK if ack is not None else 0 for ack in self.acks]
+        self.final = max(self.required, default=0)
+        if self.serverEnd is not None:
+            self.final = max(self.final, (self.serverEnd - self.serverIsn) & SEQUENCE_MASK)
+
+
+class FilePlan():
+    # Packets of one file split into closed-loop TCP flows and packets replayed open-loop (UDP, ICMP, TCP flows
+    # whose handshake was not captured). Parsed once and reused in every loop while file does not change.
+    def __init__(self, pcap, offsets, lengths):
+        self.parsed = []  # parsed headers (parseTcp) of every packet
+        self.flows = []
+        self.openLoop = []  # indexes of packets sent at their planned time
+        flows = {}  # { (client ip, client port, server ip, server port) : FlowPlan } - the last flow of tuple
+        for i, (offset, length) in enumerate(zip(offsets.tolist(), lengths.tolist())):
+            parsed = parseTcp(pcap.buffer[offset:offset + length])
+            self.parsed.append(parsed)
+            if parsed is None:
+                self.openLoop.append(i)
+                continue
+            source_ip, source_port, destination_ip, destination_port, sequence, ack, flags, payload = parsed[:8]
+            key = (source_ip, source_port, destination_ip, destination_port)
+            reverse = (destination_ip, destination_port, source_ip, source_port)
+            if flags & (TCP_SYN | TCP_ACK) == TCP_SYN and \
+                    (key not in flows or any(ack is not None for ack in flows[key].acks)):  # not retransmitted SYN
+                flows[key] = FlowPlan(key[:2], key[2:])
+                self.flows.append(flows[key])
+            if key in flows:
+                flows[key].packets.append(i)
+                flows[key].acks.append(ack if flags & TCP_ACK else None)
+            elif reverse in flows:  # captured server packet - live peer sends its own
+                flow = flows[reverse]
+                if flags & TCP_SYN:
+                    flow.serverIsn = sequence
+                end = (sequence + payload + (1 if flags & (TCP_SYN | nativeRewrite.TCP_FIN) else 0)) & SEQUENCE_MASK
+                if flow.serverEnd is None or (end - flow.serverEnd) & SEQUENCE_MASK < 0x80000000:
+                    flow.serverEnd = end
+            else:
+                self.openLoop.append(i)
+        for flow in self.flows:
+            flow.finish()
+
+
+class LiveFlow():
+    # State of closed-loop flow during one replay of its file - progress of live peer is updated by receiving
+    # thread of LiveReplayer (under its condition).
+    def __init__(self, plan):
+        self.plan = plan
+        self.next = 0  # position of the next client packet in plan.packets
+        self.liveIsn = None  # initial sequence number of live peer (from its SYN-ACK)
+        self.progress = 0  # bytes (and SYN, FIN) received from live peer
+        self.state = "running"
+        self.shift = 0  # ns - flow is late against plan by waiting for responses of live peer
+        self.sent = None  # monotonic ns when SYN was sent
+        self.handshake = None  # ns between SYN and SYN-ACK of live peer
+        self.waited = []  # ns of every wait for response
+        self.waitStart = None
+        self.waitDeadline = None
+        self.finished = None  # monotonic ns when flow reached its final state
+
+    def ready(self):  # response which the next client packet (or the end of flow) acknowledges was received
+        required = self.plan.required[self.next] if self.next < len(self.plan.packets) else self.plan.final
+        return required == 0 or (self.liveIsn is not None and self.progress >= required)
+
+    def response(self, sequence, flags, payload, now):  # packet of live peer
+        if flags & TCP_RST:
+            self.state = "reset" if self.liveIsn is not None else "refused"
+            return
+        if flags & TCP_SYN and flags & TCP_ACK:
+            if self.liveIsn is None:
+                self.liveIsn = sequence
+                self.handshake = now - self.sent if self.sent is not None else None
+            self.progress = max(self.progress, 1)
+            return
+        if self.liveIsn is not None:
+            end = (sequence - self.liveIsn + payload + (1 if flags & nativeRewrite.TCP_FIN else 0)) & SEQUENCE_MASK
+            if end < 0x80000000:  # not an old packet from before live ISN
+                self.progress = max(self.progress, end)
+
+    def result(self):
+        return {"client": socket.inet_ntoa(self.plan.client[0]) + ":" + str(self.plan.client[1]),
+                "server": socket.inet_ntoa(self.plan.server[0]) + ":" + str(self.plan.server[1]),
+                "state": self.state, "packets": self.next,
+                "handshake_ms": self.handshake / 1e6 if self.handshake is not None else None,
+                "response_ms": sum(self.waited) / len(self.waited) / 1e6 if self.waited else None,
+                "duration_ms": (self.finished - self.sent) / 1e6 if self.sent is not None else None}
+
+
+class LiveReplayer():
+    # Closed-loop replay of scenario (in the style of tcpliveplay): TCP conversations whose handshake was captured
+    # are replayed only from the client side against TCP stack of the other host - every client packet waits
+    # (at most response_timeout seconds) until live peer sent what the packet acknowledges, its ack number is moved
+    # to the sequence space of live peer and flow is delayed by the wait. Responses are read from switch interfaces
+    # connected to hosts (scenario.switchIntf1/2). Other packets (UDP, ICMP, TCP without captured handshake) are
+    # replayed open-loop at their planned time, as by nativeReplay.NativeReplayer.
+    # Every flow ends as "complete" (live peer sent everything captured server sent), "refused" (RST to SYN),
+    # "reset" or "timeout" - results of flows of the last pass over every file are in flowResults.
+    def __init__(self, scenario, rate=None, loop=True, store=None, response_timeout=RESPONSE_TIMEOUT):
+        self.scenario = scenario
+        self.rate = rate if rate is not None else replayRate.ReplayRate()
+        self.loop = loop
+        self.store = store
+        self.responseTimeout = int(response_timeout * 1e9)
+        self._isRunning = False
+        self.condition = threading.Condition()
+        self.active = {}  # { (server ip, server port, client ip, client port) : LiveFlow } - flows expecting responses
+        self.plans = {}  # { (path, size, mtime) : FilePlan }
+        self.statistics = {"packets": 0, "bytes": 0, "errors": 0, "late_ns": 0, "max_late_ns": 0}
+        self.flowResults = {}  # { path : list of flow results (LiveFlow.result) } of the last pass over file
+        self.flowTotals = {state: 0 for state in FLOW_STATES}  # final states of all replayed flows
+        self.handshakes = [0, 0]  # [sum of handshake ns, count]
+        self.startTime = None
+        self.sockets = ()
+
+    def isRunning(self):
+        return self._isRunning
+
+    def achievedRate(self):
+        if self.startTime is None:
+            return replayRate.achievedRate(0, 0, 0)
+        return replayRate.achievedRate(self.statistics["packets"], self.statistics["bytes"],
+                                       (time.monotonic_ns() - self.startTime) / 1e9)
+
+    def telemetry(self):  # as NativeReplayer.telemetry and flows, completed_flows, completion_ratio, flow_latency_ms
+        telemetry = self.achievedRate()
+        flows = sum(self.flowTotals.values())
+        telemetry.update(drift_ms=self.statistics["late_ns"] / 1e6, max_drift_ms=self.statistics["max_late_ns"] / 1e6,
+                         errors=self.statistics["errors"] + sum(packet_socket.errors for packet_socket in self.sockets),
+                         flows=flows, completed_flows=self.flowTotals["complete"],
+                         completion_ratio=self.flowTotals["complete"] / flows if flows else None,
+                         flow_latency_ms=self.handshakes[0] / self.handshakes[1] / 1e6 if self.handshakes[1] else None)
+        return telemetry
+
+    def start(self):
+        self._isRunning = True
+        mac1 = nativeReplay.scenarioMacs(self.scenario)
+        sockets = (nativeReplay.PacketSocket(self.scenario.intf1), nativeReplay.PacketSocket(self.scenario.intf2))
+        self.sockets = sockets
+        listeners = []
+        receiver = None
+        try:
+            for intf in {self.scenario.switchIntf1, self.scenario.switchIntf2} - {None}:
+                listener = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(nativeReplay.ETH_P_ALL))
+                listener.bind((intf, 0))
+                listeners.append(listener)
+            if listeners:
+                receiver = threading.Thread(target=self.__receive, args=(listeners,), name="live replay receiver",
+                                            daemon=True)
+                receiver.start()
+
+            self.startTime = time.monotonic_ns()
+            position = [0, 0, 0]  # capture time (ns), packets and bytes replayed before the next file
+            for iteration in itertools.count():
+                for pcap, cache in list(self.scenario.traffic):
+                    self.__replayFile(pcap, mac1, sockets, position, bool(listeners),
+                                      iteration * LOOP_SEQUENCE_SHIFT)
+                    if not self._isRunning:
+                        break
+                if not self._isRunning or not self.loop or not self.scenario.traffic:
+                    break
+        finally:
+            self._isRunning = False
+            if receiver is not None:
+                receiver.join()
+            for listener in listeners:
+                listener.close()
+            self.sockets = ()
+            for packet_socket in sockets:
+                self.statistics["errors"] += packet_socket.errors
+                packet_socket.close()
+
+    def __receive(self, listeners):
+        while self._isRunning:
+            readable, unused, unused = select.select(listeners, [], [], 0.1)
+            for listener in readable:
+                try:
+                    parsed = parseTcp(listener.recv(65535))
+                except OSError:
+                    continue
+                if parsed is None:
+                    continue
+                with self.condition:
+                    flow = self.active.get(parsed[:4])
+                    if flow is not None:
+                        flow.response(parsed[4], parsed[6], parsed[7], time.monotonic_ns())
+                        self.condition.notify()
+
+    def __plan(self, path, pcap, offsets, lengths):
+        status = os.stat(path)
+        key = (path, status.st_size, status.st_mtime_ns)
+        if key not in self.plans:
+            self.plans = {plan_key: plan for plan_key, plan in self.plans.items() if plan_key[0] != path}
+            self.plans[key] = FilePlan(pcap, offsets, lengths)
+        return self.plans[key]
+
+    def __replayFile(self, path, mac1, sockets, position, closed_loop, sequence_shift):
+        with self.store.open(path) if self.store is not None else pcapFile.PcapFile(path) as pcap:
+            timestamps, offsets, lengths = pcap.index()
+            if len(timestamps) == 0:
+                return
+            capture, packets, sent_bytes = position
+            bytes_before = sent_bytes + np.cumsum(lengths, dtype=np.int64) - lengths
+            real_offsets = self.rate.realOffset(capture + (timestamps - timestamps[0]),
+                                                packets + np.arange(len(timestamps), dtype=np.int64), bytes_before)
+            deadlines = (self.startTime + np.asarray(real_offsets).astype(np.int64)).tolist()
+            position[0] = capture + int(timestamps[-1] - timestamps[0]) + 1000000
+            position[1] = packets + len(timestamps)
+            position[2] = sent_bytes + int(lengths.sum())
+
+            plan = self.__plan(path, pcap, offsets, lengths) if closed_loop else None
+            directions = nativeReplay.sendDirections(pcap, offsets, lengths, mac1).tolist()
+            offsets = offsets.tolist()
+            lengths = lengths.tolist()
+
+            # open-loop packets are one sender which never waits, every closed-loop flow is another one
+            flows = [LiveFlow(flow_plan) for flow_plan in plan.flows] if plan is not None else []
+            open_loop = plan.openLoop if plan is not None else range(len(offsets))  # not changed - plan is cached
+            next_open = 0  # index into open_loop of the next open-loop packet
+            order = itertools.count()
+            queue = [(deadlines[flow.plan.packets[0]], next(order), flow) for flow in flows]
+            if open_loop:
+                queue.append((deadlines[open_loop[0]], next(order), 0))
+            heapq.heapify(queue)
+            waiting = []
+            try:
+                while self._isRunning and (queue or waiting):
+                    with self.condition:
+                        now = time.monotonic_ns()
+                        for flow in list(waiting):
+                            if flow.state == "running" and not flow.ready():
+                                if now < flow.waitDeadline:
+                                    continue
+                                flow.state = "timeout"
+                            waiting.remove(flow)
+                            self.__advance(flow, now, deadlines, queue, waiting, order)
+                        if not queue or queue[0][0] - now > nativeReplay.SPIN_THRESHOLD:
+                            if queue or waiting:
+                                wake = min(([queue[0][0]] if queue else []) + [flow.waitDeadline for flow in waiting])
+                                self.condition.wait(min(max(wake - now - nativeReplay.SPIN_THRESHOLD, 0),
+                                                        nativeReplay.MAX_SLEEP) / 1e9)
+                            continue
+                    deadline, unused, sender = heapq.heappop(queue)
+                    if not nativeReplay.waitUntil(deadline, self.isRunning):
+                        break
+                    self.statistics["late_ns"] = time.monotonic_ns() - deadline
+                    self.statistics["max_late_ns"] = max(self.statistics["max_late_ns"], self.statistics["late_ns"])
+                    if sender == 0:
+                        i = open_loop[next_open]
+                        next_open += 1
+                        self.__send(sockets[directions[i]], pcap.buffer[offsets[i]:offsets[i] + lengths[i]])
+                        if next_open < len(open_loop):
+                            heapq.heappush(queue, (deadlines[open_loop[next_open]], next(order), 0))
+                        continue
+                    self.__sendClientPacket(sender, pcap, plan, offsets, lengths, directions, sockets, sequence_shift)
+                    with self.condition:
+                        self.__advance(sender, time.monotonic_ns(), deadlines, queue, waiting, order)
+            finally:
+                with self.condition:
+                    for flow in flows:
+                        self.active.pop(flow.plan.server + flow.plan.client, None)
+                if flows and self._isRunning:
+                    self.flowResults[path] = [flow.result() for flow in flows]
+
+    def __sendClientPacket(self, flow, pcap, plan, offsets, lengths, directions, sockets, sequence_shift):
+        i = flow.plan.packets[flow.next]
+        frame = pcap.buffer[offsets[i]:offsets[i] + lengths[i]]
+        with self.condition:
+            if flow.next == 0:  # SYN - responses of live peer are expected from now on
+                self.active[flow.plan.server + flow.plan.client] = flow
+                flow.sent = time.monotonic_ns()
+            ack = (flow.liveIsn + flow.plan.required[flow.next]) if flow.plan.acks[flow.next] is not None and \
+                flow.liveIsn is not None else None
+        self.__send(sockets[directions[i]], rewriteClientFrame(frame, plan.parsed[i], sequence_shift, ack))
+        flow.next += 1
+
+    def __advance(self, flow, now, deadlines, queue, waiting, order):
+        # flow after its packet was sent or its wait ended (called under condition) - it finishes, waits for response
+        # of live peer or its next packet is planned (later by time spent waiting)
+        if flow.state != "running":
+            self.__flowFinished(flow, now)
+            return
+        if not flow.ready():
+            flow.waitStart = now
+            flow.waitDeadline = now + self.responseTimeout
+            waiting.append(flow)
+            return
+        planned = deadlines[flow.plan.packets[flow.next]] + flow.shift if flow.next < len(flow.plan.packets) else None
+        if flow.waitStart is not None:
+            flow.waited.append(now - flow.waitStart)
+            flow.waitStart = None
+            if planned is not None and now > planned:
+                flow.shift += now - planned
+                planned = now
+        if planned is None:
+            flow.state = "complete"
+            self.__flowFinished(flow, now)
+            return
+        heapq.heappush(queue, (planned, next(order), flow))
+
+    def __send(self, packet_socket, frame):
+        sent, sent_bytes = packet_socket.send([frame])
+        self.statistics["packets"] += sent
+        self.statistics["bytes"] += sent_bytes
+
+    def __flowFinished(self, flow, now):  # called under condition
+        flow.finished = now
+        self.active.pop(flow.plan.server + flow.plan.client, None)
+        self.flowTotals[flow.state] += 1
+        if flow.handshake is not None:
+            self.handshakes[0] += flow.handshake
+            self.handshakes[1] += 1
+
+    def stop(self):
+        self._isRunning = False
+        with self.condition:
+            self.condition.notify_all()
@@ -0,0 +1,340 @@
+import mmap
+import time
+import struct
+import socket
+import ctypes
+import ctypes.util
+
+import numpy as np
+
+from tools import pcapFile, replayRate, nativeRewrite
+
+ETH_P_ALL = 0x0003
+# PACKET_MMAP (linux/if_packet.h)
+SOL_PACKET = 263
+PACKET_VERSION = 10
+PACKET_TX_RING = 13
+PACKET_QDISC_BYPASS = 20
+TPACKET_V2 = 1
+# struct tpacket2_hdr: status, len, snaplen, mac, net, sec, nsec, vlan tci, vlan tpid, padding - only first fields are set for TX
+TPACKET2_STATUS = struct.Struct("I")
+TPACKET2_STATUS_LENGTH = struct.Struct("III")
+TPACKET2_DATA_OFFSET = 32  # TPACKET_ALIGN(sizeof(struct tpacket2_hdr)) - frame data of TX ring slot starts here
+TP_STATUS_AVAILABLE = 0
+TP_STATUS_SEND_REQUEST = 1
+TP_STATUS_WRONG_FORMAT = 4
+SPIN_THRESHOLD = 200000  # ns - shorter waits are done by busy-waiting (sleep is not precise enough)
+MAX_SLEEP = 100000000  # ns - longest single sleep, so stop() is noticed quickly
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p),
+                ("iov_len", ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(iovec)),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr),
+                ("msg_len", ctypes.c_uint)]
+
+
+try:
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    _sendmmsg = libc.sendmmsg
+    _sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    _sendmmsg.restype = ctypes.c_int
+except (OSError, AttributeError, TypeError):  # no glibc (or too old one) - packets are sent one by one
+    _sendmmsg = None
+
+
+def waitUntil(deadline, is_running=None):
+    # Hybrid waiting for monotonic time in ns: sleep for most of the time, busy-wait for the last SPIN_THRESHOLD ns.
+    while True:
+        remaining = deadline - time.monotonic_ns()
+        if remaining <= 0:
+            return True
+        if is_running is not None and not is_running():
+            return False
+        if remaining > SPIN_THRESHOLD:
+            time.sleep(min(remaining - SPIN_THRESHOLD, MAX_SLEEP) / 1e9)
+
+
+def sendDirections(pcap, offsets, lengths, mac1):
+    # numpy array - 0 for packets sent from mac1 (to intf1), 1 for other packets (to intf2)
+    # mac1 - bytes of one MAC or of several MACs one after another (e.g. with MACs of clones, see scenarioMacs)
+    data = np.frombuffer(pcap.buffer, dtype=np.uint8)
+    directions = np.ones(len(offsets), dtype=np.int8)
+    complete = lengths >= 12  # frames with whole ethernet addresses
+    sources = data[offsets[complete, None] + np.arange(6, 12)]
+    macs = np.frombuffer(mac1, dtype=np.uint8).reshape(-1, 6)
+    directions[complete] = np.where((sources[:, None, :] == macs).all(axis=2).any(axis=1), 0, 1)
+    return directions
+
+
+def scenarioMacs(scenario):  # bytes of MACs sent to intf1 - mac1 of scenario and MACs of its clones
+    return nativeRewrite.cloneMacs(scenario.mac1, scenario.clones).tobytes()
+
+
+def maxFrameLength(paths):  # the longest captured frame in files (size of TX ring slots)
+    max_length = 1514
+    for path in paths:
+        with pcapFile.PcapFile(path) as pcap:
+            lengths = pcap.index()[2]
+            if len(lengths):
+                max_length = max(max_length, int(lengths.max()))
+    return max_length
+
+
+class PacketSocket():
+    # AF_PACKET socket bound to interface, sends whole ethernet frames (batch with one sendmmsg call)
+    def __init__(self, intf, batch_size=64):
+        self.intf = intf
+        self.socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        self.socket.bind((intf, 0))
+        self.batchSize = batch_size
+        self.iovecs = (iovec * batch_size)()
+        self.messages = (mmsghdr * batch_size)()
+        for i in range(batch_size):
+            self.messages[i].msg_hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+            self.messages[i].msg_hdr.msg_iovlen = 1
+        self.errors = 0
+
+    def send(self, frames):  # returns tuple (number of sent frames, their bytes) - frames which failed are not counted
+        sent = 0
+        sent_bytes = 0
+        for start in range(0, len(frames), self.batchSize):
+            batch_sent, batch_bytes = self.__sendBatch(frames[start:start + self.batchSize])
+            sent += batch_sent
+            sent_bytes += batch_bytes
+        return sent, sent_bytes
+
+    def __sendBatch(self, frames):
+        if _sendmmsg is None:
+            return self.__sendOneByOne(frames)
+
+        buffers = [ctypes.c_char_p(frame) for frame in frames]  # keeps frames referenced until they are sent
+        for i, frame in enumerate(frames):
+            self.iovecs[i].iov_base = ctypes.cast(buffers[i], ctypes.c_void_p)
+            self.iovecs[i].iov_len = len(frame)
+
+        position = 0  # the next frame to be sent
+        sent = 0
+        sent_bytes = 0
+        while position < len(frames):
+            result = _sendmmsg(self.socket.fileno(), ctypes.addressof(self.messages) + position * ctypes.sizeof(mmsghdr),
+                               len(frames) - position, 0)
+            if result > 0:
+                sent += result
+                sent_bytes += sum(len(frame) for frame in frames[position:position + result])
+                position += result
+            elif ctypes.get_errno() in (11, 105):  # EAGAIN, ENOBUFS - queue of interface is full, try again
+                time.sleep(0.0001)
+            else:  # frame can not be sent (e.g. EMSGSIZE) - skip it
+                self.errors += 1
+                position += 1
+        return sent, sent_bytes
+
+    def __sendOneByOne(self, frames):
+        sent = 0
+        sent_bytes = 0
+        for frame in frames:
+            try:
+                self.socket.send(frame)
+            except OSError:
+                self.errors += 1
+                continue
+            sent += 1
+            sent_bytes += len(frame)
+        return sent, sent_bytes
+
+    def close(self):
+        self.socket.close()
+
+
+class TxRing():
+    # AF_PACKET socket with PACKET_TX_RING (TPACKET_V2): frames are copied into slots of ring shared with kernel
+    # and whole batch is sent by one send() call - no syscall per packet.
+    def __init__(self, intf, max_frame_length=65535, ring_size=8 * 1024 * 1024, qdisc_bypass=False):
+        self.intf = intf
+        self.socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        self.socket.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V2)
+        if qdisc_bypass:  # frames skip qdisc (and tc rules) of interface
+            self.socket.setsockopt(SOL_PACKET, PACKET_QDISC_BYPASS, 1)
+
+        # slot size is power of 2 (at least one page), so it divides block (one slot per block)
+        self.frameSize = max(mmap.PAGESIZE, 1 << (TPACKET2_DATA_OFFSET + max_frame_length - 1).bit_length())
+        self.frameCount = max(2, ring_size // self.frameSize)
+        request = struct.pack("IIII", self.frameSize, self.frameCount, self.frameSize, self.frameCount)
+        self.socket.setsockopt(SOL_PACKET, PACKET_TX_RING, request)
+        self.socket.bind((intf, 0))
+        self.ring = mmap.mmap(self.socket.fileno(), self.frameSize * self.frameCount,
+                              mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self.maxLength = self.frameSize - TPACKET2_DATA_OFFSET
+        self.slot = 0
+        self.errors = 0
+
+    def send(self, frames):  # returns tuple (number of frames handed to kernel, their bytes)
+        sent = 0
+        sent_bytes = 0
+        for frame in frames:
+            length = len(frame)
+            if length > self.maxLength:
+                self.errors += 1
+                continue
+            offset = self.slot * self.frameSize
+            status = self.__waitForSlot(offset)
+            if status == TP_STATUS_WRONG_FORMAT:
+                self.errors += 1
+            self.ring[offset + TPACKET2_DATA_OFFSET:offset + TPACKET2_DATA_OFFSET + length] = frame
+            # kernel reads slots only during send() in __flush, so status can be written together with lengths
+            TPACKET2_STATUS_LENGTH.pack_into(self.ring, offset, TP_STATUS_SEND_REQUEST, length, length)
+            self.slot = (self.slot + 1) % self.frameCount
+            sent += 1
+            sent_bytes += length
+        self.__flush()
+        return sent, sent_bytes
+
+    def __waitForSlot(self, offset):
+        while True:
+            status = TPACKET2_STATUS.unpack_from(self.ring, offset)[0]
+            if status in (TP_STATUS_AVAILABLE, TP_STATUS_WRONG_FORMAT):
+                return status
+            self.__flush()  # whole ring is waiting for kernel
+            time.sleep(0.00001)
+
+    def __flush(self):
+        try:
+            self.socket.send(b"", socket.MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            pass  # kernel is still sending - slots are checked again before reuse
+        except OSError:
+            self.errors += 1
+
+    def close(self):
+        self.ring.close()
+        self.socket.close()
+
+
+class NativeReplayer():
+    # Replays rewritten pcaps of scenario directly from this process (no tcpreplay):
+    #   - packets with source MAC of the first host are sent to intf1, other packets to intf2
+    #   - packets closer to each other than batch_window ns are sent together with sendmmsg
+    #   - send times are given by rate (replayRate.ReplayRate, default - original timing)
+    #   - ring True - frames are written into PACKET_TX_RING instead of sendmmsg
+    #   - store (packetStore.PacketStore) - files are read from memory, not from disk in every loop
+    def __init__(self, scenario, rate=None, batch_size=64, batch_window=50000, loop=True, ring=False, store=None):
+        self.scenario = scenario
+        self.store = store
+        self.rate = rate if rate is not None else replayRate.ReplayRate()
+        self.ring = ring
+        self.batchSize = batch_size
+        self.batchWindow = batch_window
+        self.loop = loop
+        self._isRunning = False
+        self.statistics = {"packets": 0, "bytes": 0, "errors": 0, "late_ns": 0, "max_late_ns": 0}
+        self.startTime = None  # monotonic ns when replay started
+        self.sockets = ()  # open sockets (errors are added to statistics when they are closed)
+
+    def isRunning(self):
+        return self._isRunning
+
+    def achievedRate(self):
+        if self.startTime is None:
+            return replayRate.achievedRate(0, 0, 0)
+        return replayRate.achievedRate(self.statistics["packets"], self.statistics["bytes"],
+                                       (time.monotonic_ns() - self.startTime) / 1e9)
+
+    def telemetry(self):  # achieved rate, drift (lateness of last batch against its planned time) and send errors
+        telemetry = self.achievedRate()
+        telemetry.update(drift_ms=self.statistics["late_ns"] / 1e6, max_drift_ms=self.statistics["max_late_ns"] / 1e6,
+                         errors=self.statistics["errors"] + sum(packet_socket.errors for packet_socket in self.sockets))
+        return telemetry
+
+    def start(self):
+        self._isRunning = True
+        mac1 = scenarioMacs(self.scenario)
+        if self.ring:
+            max_length = maxFrameLength(pcap for pcap, cache in self.scenario.traffic)
+            sockets = (TxRing(self.scenario.intf1, max_length), TxRing(self.scenario.intf2, max_length))
+        else:
+            sockets = (PacketSocket(self.scenario.intf1, self.batchSize), PacketSocket(self.scenario.intf2, self.batchSize))
+        self.sockets = sockets
+        try:
+            self.startTime = time.monotonic_ns()
+            position = [0, 0, 0]  # capture time (ns), packets and bytes replayed before the next file
+            while self._isRunning:
+                for pcap, cache in list(self.scenario.traffic):
+                    self.__replayFile(pcap, mac1, sockets, position)
+                    if not self._isRunning:
+                        break
+                if not self.loop or not self.scenario.traffic:
+                    break
+        finally:
+            self.sockets = ()
+            for packet_socket in sockets:
+                self.statistics["errors"] += packet_socket.errors
+                packet_socket.close()
+            self._isRunning = False
+
+    def __replayFile(self, path, mac1, sockets, position):
+        with self.store.open(path) if self.store is not None else pcapFile.PcapFile(path) as pcap:
+            timestamps, offsets, lengths = pcap.index()
+            if len(timestamps) == 0:
+                return
+            # files follow each other on one capture timeline (next file starts 1 ms after last packet),
+            # so rate (e.g. ramp or pps) continues across files and loops
+            capture, packets, sent_bytes = position
+            bytes_before = sent_bytes + np.cumsum(lengths, dtype=np.int64) - lengths
+            real_offsets = self.rate.realOffset(capture + (timestamps - timestamps[0]),
+                                                packets + np.arange(len(timestamps), dtype=np.int64), bytes_before)
+            deadlines = self.startTime + np.asarray(real_offsets).astype(np.int64)
+            position[0] = capture + int(timestamps[-1] - timestamps[0]) + 1000000
+            position[1] = packets + len(timestamps)
+            position[2] = sent_bytes + int(lengths.sum())
+
+            directions = sendDirections(pcap, offsets, lengths, mac1)
+            # ring copies frames straight from pcap buffer, sendmmsg needs bytes objects
+            buffer = memoryview(pcap.buffer) if self.ring else pcap.buffer
+            try:
+                self.__replayPackets(buffer, deadlines, offsets, lengths, directions, sockets)
+            finally:
+                if self.ring:
+                    buffer.release()  # mapped pcap can not be closed while it is exported
+
+    def __replayPackets(self, buffer, deadlines, offsets, lengths, directions, sockets):
+        i = 0
+        count = len(deadlines)
+        offsets = offsets.tolist()  # python ints are much faster to slice with than numpy scalars
+        ends = [offset + length for offset, length in zip(offsets, lengths.tolist())]
+        directions = directions.tolist()
+        while i < count and self._isRunning:
+            # batch of packets which should be sent at almost the same time
+            end = i + 1
+            while end < count and end - i < self.batchSize and deadlines[end] - deadlines[i] <= self.batchWindow:
+                end += 1
+            batches = ([], [])
+            for j in range(i, end):
+                batches[directions[j]].append(buffer[offsets[j]:ends[j]])
+
+            if not waitUntil(int(deadlines[i]), self.isRunning):
+                break
+            self.statistics["late_ns"] = time.monotonic_ns() - int(deadlines[i])
+            self.statistics["max_late_ns"] = max(self.statistics["max_late_ns"], self.statistics["late_ns"])
+            for packet_socket, frames in zip(sockets, batches):
+                if frames:
+                    sent, sent_bytes = packet_socket.send(frames)
+                    self.statistics["packets"] += sent
+                    self.statistics["bytes"] += sent_bytes  # counted only for frames really sent
+            i = end
+
+    def stop(self):
+        self._isRunning = False
@@ -0,0 +1,541 @@
+import os
+import mmap
+import shutil
+import struct
+import ipaddress
+
+import numpy as np
+
+from tools import pcapFile
+
+# tcpprep cache file (tcpreplay cache.h, version 04 - all fields unsigned, network byte order):
+#   magic "tcpprep\0" (8), version "04" (4), number of packets (8), packets per byte (2), comment length (2), comment,
+#   then 2 bits per packet - higher bit: packet is sent, lower bit: sent to primary interface (client -> server)
+CACHE_HEADER = struct.Struct(">8s4sQHH")
+CACHE_MAGIC = b"tcpprep"
+CACHE_VERSION = b"04"
+CACHE_PACKETS_PER_BYTE = 4
+CACHE_COMMENT = b"Generated by tools.nativeRewrite"
+
+ETHERTYPE_IPV4 = 0x0800
+PROTOCOL_TCP = 6
+PROTOCOL_UDP = 17
+BATCH_SIZE = 1 << 20  # packets processed at once (bounds memory used by index arrays)
+TCP_FIN = 0x01
+TCP_PSH = 0x08
+TCP_CWR = 0x80
+IP_DONT_FRAGMENT = 0x4000
+IP_MORE_FRAGMENTS = 0x2000
+FIRST_EPHEMERAL_PORT = 1024  # lower (service) ports are kept in clones
+CLONE_PORT_STEP = 1009  # ephemeral ports of clone k are moved by k * step (prime - clones rarely share ports)
+MAX_CLONES = 0xffff  # clone number is written into 2 bytes of MAC
+AMPLIFY_BATCH_SIZE = 1 << 16  # packets of amplified file written at once
+
+
+def field16(data, positions):  # big-endian 16-bit fields at given positions
+    return (data[positions].astype(np.int64) << 8) | data[positions + 1]
+
+
+def ipWords(ip):  # "10.0.0.1" -> (0x0a00, 0x0001)
+    octets = [int(octet) for octet in ip.split(".")]
+    return (octets[0] << 8) | octets[1], (octets[2] << 8) | octets[3]
+
+
+def macBytes(mac):
+    return np.frombuffer(bytes.fromhex(mac.replace(":", "")), dtype=np.uint8)
+
+
+def updateChecksum(checksum, delta):
+    # RFC 1624 (eqn. 3): HC' = ~(~HC + ~m + m'), delta = sum of ~m + m' over all changed 16-bit words
+    value = (~checksum & 0xffff) + delta
+    for i in range(3):  # delta is sum of at most 8 words - three folds are enough
+        value = (value & 0xffff) + (value >> 16)
+    return ~value & 0xffff
+
+
+class PacketHeaders():
+    # Header fields of batch of ethernet frames parsed with NumPy (positions are offsets in file)
+    def __init__(self, data, offsets, lengths):
+        self.offsets = offsets
+        self.lengths = lengths
+        count = len(offsets)
+        ethernet = lengths >= 14
+        ethertype = np.zeros(count, dtype=np.int64)
+        ethertype[ethernet] = field16(data, offsets[ethernet] + 12)
+
+        self.ipv4 = ethernet & (ethertype == ETHERTYPE_IPV4) & (lengths >= 34)
+        self.ipv4[self.ipv4] = (data[offsets[self.ipv4] + 14] >> 4) == 4
+        ihl = np.zeros(count, dtype=np.int64)
+        ihl[self.ipv4] = (data[offsets[self.ipv4] + 14] & 0x0f).astype(np.int64) * 4
+        self.ipv4 &= (ihl >= 20) & (lengths >= 14 + ihl)
+
+        self.source = np.zeros(count, dtype=np.int64)
+        self.destination = np.zeros(count, dtype=np.int64)
+        self.protocol = np.zeros(count, dtype=np.int64)
+        first_fragment = np.zeros(count, dtype=bool)
+        ip = offsets[self.ipv4] + 14
+        self.source[self.ipv4] = (field16(data, ip + 12) << 16) | field16(data, ip + 14)
+        self.destination[self.ipv4] = (field16(data, ip + 16) << 16) | field16(data, ip + 18)
+        self.protocol[self.ipv4] = data[ip + 9]
+        first_fragment[self.ipv4] = (field16(data, ip + 6) & 0x1fff) == 0
+
+        self.transport = offsets + 14 + ihl  # offset of TCP/UDP header
+        self.tcp = self.ipv4 & first_fragment & (self.protocol == PROTOCOL_TCP) & (lengths >= 14 + ihl + 18)
+        self.udp = self.ipv4 & first_fragment & (self.protocol == PROTOCOL_UDP) & (lengths >= 14 + ihl + 8)
+        ports = self.tcp | self.udp
+        self.sourcePort = np.full(count, -1, dtype=np.int64)
+        self.destinationPort = np.full(count, -1, dtype=np.int64)
+        self.sourcePort[ports] = field16(data, self.transport[ports])
+        self.destinationPort[ports] = field16(data, self.transport[ports] + 2)
+        self.flags = np.zeros(count, dtype=np.int64)
+        self.flags[self.tcp] = data[self.transport[self.tcp] + 13]
+
+
+class DirectionClassifier():
+    # Splits traffic to client (primary) and server (secondary) packets like "tcpprep --auto=bridge": every IP address
+    # gets votes from behaviour of packets it sends - opening TCP connections (SYN) and sending to well-known ports
+    # from ephemeral ones are client votes, SYN+ACK and answers from well-known ports are server votes.
+    # Addresses without votes are clients if they sent a packet before receiving one. Votes are accumulated
+    # over batches, so the whole file is classified before any packet is rewritten.
+    def __init__(self):
+        self.votes = {}  # { ip : sum of votes }
+        self.firstSent = {}  # { ip : number of first packet sent by ip }
+        self.firstReceived = {}  # { ip : number of first packet received by ip }
+
+    def update(self, headers, first_packet):
+        ip = headers.ipv4
+        source = headers.source[ip]
+        destination = headers.destination[ip]
+        flags = headers.flags[ip]
+        tcp = headers.tcp[ip]
+        ports = (headers.tcp | headers.udp)[ip]
+        source_port = headers.sourcePort[ip]
+        destination_port = headers.destinationPort[ip]
+
+        syn = tcp & ((flags & 0x12) == 0x02)
+        syn_ack = tcp & ((flags & 0x12) == 0x12)
+        to_service = ports & (destination_port < 1024) & (source_port >= 1024)
+        from_service = ports & (source_port < 1024) & (destination_port >= 1024)
+        votes = 2 * syn.astype(np.int64) - 2 * syn_ack + to_service - from_service
+
+        addresses, inverse = np.unique(np.concatenate([source, destination]), return_inverse=True)
+        totals = np.zeros(len(addresses), dtype=np.int64)
+        np.add.at(totals, inverse[:len(source)], votes)
+        np.add.at(totals, inverse[len(source):], -votes)
+
+        numbers = first_packet + np.flatnonzero(ip)
+        first_sent = np.full(len(addresses), np.iinfo(np.int64).max)
+        first_received = np.full(len(addresses), np.iinfo(np.int64).max)
+        np.minimum.at(first_sent, inverse[:len(source)], numbers)
+        np.minimum.at(first_received, inverse[len(source):], numbers)
+
+        for address, total, sent, received in zip(addresses.tolist(), totals.tolist(),
+                                                  first_sent.tolist(), first_received.tolist()):
+            self.votes[address] = self.votes.get(address, 0) + total
+            self.firstSent[address] = min(self.firstSent.get(address, sent), sent)
+            self.firstReceived[address] = min(self.firstReceived.get(address, received), received)
+
+    def isClient(self, address):
+        votes = self.votes.get(address, 0)
+        if votes != 0:
+            return votes > 0
+        return self.firstSent.get(address, 0) < self.firstReceived.get(address, 0)
+
+    def clientPackets(self, headers):  # bool array - True for packets sent by client (non-IP packets are server ones)
+        clients = np.zeros(len(headers.offsets), dtype=bool)
+        sources = headers.source[headers.ipv4]
+        addresses, inverse = np.unique(sources, return_inverse=True)
+        client_addresses = np.array([self.isClient(address) for address in addresses.tolist()], dtype=bool)
+        clients[headers.ipv4] = client_addresses[inverse] if len(addresses) else False
+        return clients
+
+
+def rewriteBatch(data, headers, clients, ip1, ip2, mac1, mac2):
+    # client packets: mac1 -> mac2, ip1 -> ip2, server packets: mac2 -> mac1, ip2 -> ip1 (as tcprewrite
+    # --endpoints=ip1:ip2 --enet-smac=mac1,mac2 --enet-dmac=mac2,mac1)
+    ethernet = headers.lengths >= 14
+    for selection, source_mac, destination_mac in ((clients & ethernet, mac1, mac2), (~clients & ethernet, mac2, mac1)):
+        offsets = headers.offsets[selection]
+        data[offsets[:, None] + np.arange(6)] = destination_mac
+        data[offsets[:, None] + np.arange(6, 12)] = source_mac
+
+    ip = headers.ipv4
+    if not ip.any():
+        return
+    words1 = ipWords(ip1)
+    words2 = ipWords(ip2)
+    client = clients[ip]
+    new_words = np.empty((int(ip.sum()), 4), dtype=np.int64)
+    for column in range(2):
+        new_words[:, column] = np.where(client, words1[column], words2[column])  # source
+        new_words[:, column + 2] = np.where(client, words2[column], words1[column])  # destination
+
+    header = headers.offsets[ip] + 14
+    positions = header[:, None] + np.array([12, 14, 16, 18])
+    old_words = (data[positions].astype(np.int64) << 8) | data[positions + 1]
+    delta = ((~old_words & 0xffff) + new_words).sum(axis=1)
+
+    data[positions] = (new_words >> 8).astype(np.uint8)
+    data[positions + 1] = (new_words & 0xff).astype(np.uint8)
+    writeChecksums(data, header + 10, delta, allow_zero=True)
+
+    # TCP and UDP checksums include pseudo header with both addresses - the same difference
+    delta_all = np.zeros(len(headers.offsets), dtype=np.int64)
+    delta_all[ip] = delta
+    writeChecksums(data, headers.transport[headers.tcp] + 16, delta_all[headers.tcp], allow_zero=True)
+    udp_checksums = headers.transport[headers.udp] + 6
+    with_checksum = field16(data, udp_checksums) != 0  # zero - checksum not computed by sender
+    writeChecksums(data, udp_checksums[with_checksum], delta_all[headers.udp][with_checksum], allow_zero=False)
+
+
+def writeChecksums(data, positions, delta, allow_zero):
+    checksums = updateChecksum(field16(data, positions), delta)
+    if not allow_zero:
+        checksums[checksums == 0] = 0xffff  # UDP: zero means "no checksum"
+    data[positions] = (checksums >> 8).astype(np.uint8)
+    data[positions + 1] = (checksums & 0xff).astype(np.uint8)
+
+
+def internetChecksum(data):  # RFC 1071 checksum of bytes
+    if len(data) % 2:
+        data += b"\0"
+    total = int(np.frombuffer(data, dtype=">u2").sum(dtype=np.int64))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+def ipv4Header(header, total_length, identification, flags_offset):  # copy of header with new fields and checksum
+    header = bytearray(header)
+    struct.pack_into(">HHH", header, 2, total_length, identification & 0xffff, flags_offset)
+    struct.pack_into(">H", header, 10, 0)
+    struct.pack_into(">H", header, 10, internetChecksum(bytes(header)))
+    return bytes(header)
+
+
+def segmentTcp(frame, ihl, total_length, mtu):
+    # TCP packet bigger than MTU (e.g. captured before TSO/after GRO) split like TSO does it: every segment has copy
+    # of headers (with options), sequence number moved by payload before it, FIN and PSH only in the last segment,
+    # CWR only in the first one. Returns list of frames (the original one if it can not be split).
+    ip_header = frame[14:14 + ihl]
+    tcp_offset = 14 + ihl
+    tcp_length = (frame[tcp_offset + 12] >> 4) * 4
+    mss = mtu - ihl - tcp_length
+    if tcp_length < 20 or mss <= 0 or tcp_offset + tcp_length > 14 + total_length:
+        return [frame]
+    tcp_header = frame[tcp_offset:tcp_offset + tcp_length]
+    payload = frame[tcp_offset + tcp_length:14 + total_length]
+    identification, = struct.unpack_from(">H", ip_header, 4)
+    flags_offset, = struct.unpack_from(">H", ip_header, 6)
+    sequence, = struct.unpack_from(">I", tcp_header, 4)
+    flags = tcp_header[13]
+    pseudo_header = ip_header[12:20] + bytes([0, PROTOCOL_TCP])
+
+    frames = []
+    for start in range(0, len(payload), mss):
+        chunk = payload[start:start + mss]
+        segment_flags = flags if start + mss >= len(payload) else flags & ~(TCP_FIN | TCP_PSH)
+        if start > 0:
+            segment_flags &= ~TCP_CWR
+        header = bytearray(tcp_header)
+        struct.pack_into(">I", header, 4, (sequence + start) & 0xffffffff)
+        header[13] = segment_flags
+        struct.pack_into(">H", header, 16, 0)
+        checksum = internetChecksum(pseudo_header + struct.pack(">H", len(header) + len(chunk)) + bytes(header) + chunk)
+        struct.pack_into(">H", header, 16, checksum)
+        frames.append(frame[:14] + ipv4Header(ip_header, ihl + len(header) + len(chunk), identification + len(frames),
+                                              flags_offset) + bytes(header) + chunk)
+    return frames
+
+
+def fragmentIpv4(frame, ihl, total_length, mtu):
+    # IP packet (not TCP) bigger than MTU split into fragments (RFC 791) - payload in multiples of 8 bytes,
+    # header (with options) copied to every fragment, "don't fragment" flag is cleared.
+    # Returns list of frames (the original one if it can not be split).
+    size = (mtu - ihl) // 8 * 8
+    if size <= 0:
+        return [frame]
+    ip_header = frame[14:14 + ihl]
+    payload = frame[14 + ihl:14 + total_length]
+    identification, = struct.unpack_from(">H", ip_header, 4)
+    flags_offset, = struct.unpack_from(">H", ip_header, 6)
+    offset = (flags_offset & 0x1fff) * 8  # packet can already be a fragment
+    more_fragments = flags_offset & IP_MORE_FRAGMENTS
+    reserved = flags_offset & ~(IP_DONT_FRAGMENT | IP_MORE_FRAGMENTS | 0x1fff)
+
+    frames = []
+    for start in range(0, len(payload), size):
+        chunk = payload[start:start + size]
+        more = more_fragments if start + size >= len(payload) else IP_MORE_FRAGMENTS
+        frames.append(frame[:14] + ipv4Header(ip_header, ihl + len(chunk), identification,
+                                              reserved | more | ((offset + start) // 8)) + chunk)
+    return frames
+
+
+def splitPacket(frame, mtu):  # list of frames with IP packets not longer than mtu
+    ihl = (frame[14] & 0x0f) * 4
+    total_length, = struct.unpack_from(">H", frame, 16)
+    flags_offset, = struct.unpack_from(">H", frame, 20)
+    if frame[23] == PROTOCOL_TCP and flags_offset & (IP_MORE_FRAGMENTS | 0x1fff) == 0:
+        return segmentTcp(frame, ihl, total_length, mtu)
+    return fragmentIpv4(frame, ihl, total_length, mtu)
+
+
+def segmentPcap(input_path, output_path, mtu, clients=None):
+    # IPv4 packets longer than mtu (IP packet without ethernet header) are split - TCP into MSS-sized segments,
+    # other protocols into fragments. Oversized packets are found in batches with NumPy, runs of packets between
+    # them are copied as whole blocks. Segments keep timestamp of original packet.
+    # output_path can be the same as input_path. Returns tuple (number of packets, clients - bool array of client
+    # packets expanded to segments, or None if clients were not given).
+    with pcapFile.PcapFile(input_path) as pcap:
+        timestamps, offsets, lengths = pcap.index()
+        lengths = lengths.astype(np.int64)
+        data = np.frombuffer(pcap.buffer, dtype=np.uint8)
+        oversized = np.zeros(len(offsets), dtype=bool)
+        for start in range(0, len(offsets), BATCH_SIZE):
+            end = start + BATCH_SIZE
+            headers = PacketHeaders(data, offsets[start:end], lengths[start:end])
+            total_length = np.zeros(len(headers.offsets), dtype=np.int64)
+            total_length[headers.ipv4] = field16(data, headers.offsets[headers.ipv4] + 16)
+            # truncated packets (captured length shorter than IP packet) can not be split
+            oversized[start:end] = headers.ipv4 & (total_length > mtu) & (lengths[start:end] >= 14 + total_length)
+        del data
+
+        numbers = np.flatnonzero(oversized).tolist()
+        if not numbers:
+            if output_path != input_path:
+                shutil.copyfile(input_path, output_path)
+            return len(offsets), clients
+
+        counts = np.ones(len(offsets), dtype=np.int64)
+        temporary_path = output_path + ".segmenting"
+        with open(temporary_path, "wb") as output:
+            output.write(pcap.buffer[:pcapFile.GLOBAL_HEADER_LENGTH])
+            header_length = pcapFile.RECORD_HEADER_LENGTH
+            next_packet = 0  # the first packet which was not written yet
+            for number in numbers:
+                offset = int(offsets[number])
+                if number > next_packet:  # records before oversized packet copied as one block (with their headers)
+                    output.write(pcap.buffer[int(offsets[next_packet]) - header_length:offset - header_length])
+                seconds, subseconds, captured, original = pcap.recordHeader.unpack_from(pcap.buffer, offset - header_length)
+                frames = splitPacket(pcap.buffer[offset:offset + captured], mtu)
+                for frame in frames:
+                    output.write(pcap.recordHeader.pack(seconds, subseconds, len(frame), len(frame)))
+                    output.write(frame)
+                counts[number] = len(frames)
+                next_packet = number + 1
+            if next_packet < len(offsets):
+                output.write(pcap.buffer[int(offsets[next_packet]) - header_length:int(offsets[-1] + lengths[-1])])
+    os.replace(temporary_path, output_path)
+    return int(counts.sum()), np.repeat(clients, counts) if clients is not None else None
+
+
+def writeCache(path, clients):
+    count = len(clients)
+    codes = np.zeros(-(-count // CACHE_PACKETS_PER_BYTE) * CACHE_PACKETS_PER_BYTE, dtype=np.uint8)
+    codes[:count] = 2 | clients.astype(np.uint8)  # every packet is sent
+    codes = codes.reshape(-1, CACHE_PACKETS_PER_BYTE)
+    packed = codes[:, 0] | (codes[:, 1] << 2) | (codes[:, 2] << 4) | (codes[:, 3] << 6)
+    with open(path, "wb") as file:
+        file.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, count, CACHE_PACKETS_PER_BYTE, len(CACHE_COMMENT)))
+        file.write(CACHE_COMMENT)
+        file.write(packed.astype(np.uint8).tobytes())
+
+
+def writeMacCache(pcap_path, cache_path, mac1, clones=0):
+    # cache of rewritten file - packets from mac1 (or from its clones, see amplifyPcap) are client packets
+    with pcapFile.PcapFile(pcap_path) as pcap:
+        timestamps, offsets, lengths = pcap.index()
+        data = np.frombuffer(pcap.buffer, dtype=np.uint8)
+        clients = np.zeros(len(offsets), dtype=bool)
+        complete = lengths >= 12
+        sources = data[offsets[complete, None] + np.arange(6, 12)]
+        clients[complete] = (sources[:, None, :] == cloneMacs(mac1, clones)).all(axis=2).any(axis=1)
+        del data
+    writeCache(cache_path, clients)
+
+
+def cloneMacs(mac, clones):  # array (clones + 1, 6) - mac and MACs of its clones 1..clones (see cloneBatch)
+    macs = np.tile(macBytes(mac), (clones + 1, 1))
+    numbers = np.arange(1, clones + 1)
+    macs[1:, 0] = 0x02
+    macs[1:, 1] = numbers >> 8
+    macs[1:, 2] = numbers & 0xff
+    return macs
+
+
+class AddressSpace():
+    # Addresses of clones inside network of topology (e.g. "10.0.0.0/8"): clone k of address a is a + k * stride,
+    # stride is bigger than offset of every host, so clones never take addresses of hosts (or of other clones).
+    def __init__(self, ip_base, stride):
+        network = ipaddress.ip_network(ip_base, strict=False)
+        self.network = int(network.network_address)
+        self.mask = int(network.netmask)
+        self.size = network.num_addresses
+        self.stride = stride
+
+    def check(self, clones):  # raises ValueError if clones of all hosts do not fit into network
+        if clones * self.stride + self.stride - 1 >= self.size - 1:  # broadcast address is not used
+            raise ValueError("Network of %d addresses is too small for %d clones of hosts." % (self.size, clones))
+
+    def cloneAddresses(self, addresses, clones):  # NumPy arrays of IPv4 addresses (as integers) and clone numbers
+        inside = (addresses & self.mask) == self.network
+        return np.where(inside, addresses + clones * self.stride, addresses)
+
+
+def cloneBatch(data, headers, clones, address_space, clients):
+    # Packets of batch turned into packets of their clones (clones - array with clone number of every packet,
+    # 0 - packet is kept): unicast MACs -> 02:kk:kk:<last 3 bytes of MAC>, IPv4 addresses of topology network moved
+    # by address_space, ephemeral TCP/UDP port of client (source port of client packets - clients, bool array as
+    # from DirectionClassifier, destination port of server ones) moved by k * CLONE_PORT_STEP, ports of services
+    # are kept. Checksums are updated incrementally.
+    cloned = clones > 0
+    for start in (0, 6):  # destination and source MAC
+        mac = headers.offsets + start
+        selection = cloned & (headers.lengths >= 14)
+        selection[selection] = (data[mac[selection]] & 1) == 0  # group addresses (broadcast) are kept
+        data[mac[selection]] = 0x02
+        data[mac[selection] + 1] = (clones[selection] >> 8).astype(np.uint8)
+        data[mac[selection] + 2] = (clones[selection] & 0xff).astype(np.uint8)
+
+    ip = headers.ipv4 & cloned
+    if not ip.any():
+        return
+    header = headers.offsets[ip] + 14
+    positions = header[:, None] + np.array([12, 14, 16, 18])
+    old_words = field16(data, positions)
+    addresses = np.stack([(old_words[:, 0] << 16) | old_words[:, 1], (old_words[:, 2] << 16) | old_words[:, 3]], axis=1)
+    addresses = address_space.cloneAddresses(addresses, clones[ip][:, None])
+    new_words = np.stack([addresses[:, 0] >> 16, addresses[:, 0] & 0xffff,
+                          addresses[:, 1] >> 16, addresses[:, 1] & 0xffff], axis=1)
+    delta = ((~old_words & 0xffff) + new_words).sum(axis=1)
+    data[positions] = (new_words >> 8).astype(np.uint8)
+    data[positions + 1] = (new_words & 0xff).astype(np.uint8)
+    writeChecksums(data, header + 10, delta, allow_zero=True)
+
+    # pseudo header of TCP and UDP checksums contains addresses, ports are in transport header itself
+    delta_all = np.zeros(len(headers.offsets), dtype=np.int64)
+    delta_all[ip] = delta
+    ports = (headers.tcp | headers.udp) & cloned
+    port_positions = headers.transport[ports][:, None] + np.array([0, 2])
+    old_ports = field16(data, port_positions)
+    client_port = np.arange(2) == np.where(clients[ports], 0, 1)[:, None]
+    ephemeral = client_port & (old_ports >= FIRST_EPHEMERAL_PORT)
+    new_ports = np.where(ephemeral, FIRST_EPHEMERAL_PORT + (old_ports - FIRST_EPHEMERAL_PORT + clones[ports][:, None]
+                                                             * CLONE_PORT_STEP) % (0x10000 - FIRST_EPHEMERAL_PORT),
+                         old_ports)
+    data[port_positions] = (new_ports >> 8).astype(np.uint8)
+    data[port_positions + 1] = (new_ports & 0xff).astype(np.uint8)
+    delta_all[ports] += ((~old_ports & 0xffff) + new_ports).sum(axis=1)
+
+    writeChecksums(data, headers.transport[headers.tcp & cloned] + 16, delta_all[headers.tcp & cloned],
+                   allow_zero=True)
+    udp = headers.udp & cloned
+    udp_checksums = headers.transport[udp] + 6
+    with_checksum = field16(data, udp_checksums) != 0
+    writeChecksums(data, udp_checksums[with_checksum], delta_all[udp][with_checksum], allow_zero=False)
+
+
+def amplifyPcap(input_path, output_path, clones, offset, address_space):
+    # Traffic of file together with its clones 1..clones (see cloneBatch), clone k shifted by k * offset ns, all
+    # packets written in order of their timestamps. Clones are merged as clones + 1 sorted streams (k-way merge by
+    # time windows), so memory is bounded by size of input and batch, not by number of clones. Returns number of packets.
+    if not 0 <= clones <= MAX_CLONES:
+        raise ValueError("Number of clones must be between 0 and %d." % MAX_CLONES)
+    if offset < 0:
+        raise ValueError("Time offset of clones can not be negative.")
+    address_space.check(clones)
+    temporary_path = output_path + ".amplifying"
+    with pcapFile.PcapFile(input_path) as pcap:
+        if pcap.linktype != pcapFile.LINKTYPE_ETHERNET:
+            raise ValueError("File \"" + input_path + "\" does not contain ethernet frames.")
+        timestamps, offsets, lengths = pcap.index()
+        lengths = lengths.astype(np.int64)
+        count = len(offsets)
+        data = np.frombuffer(pcap.buffer, dtype=np.uint8)
+        classifier = DirectionClassifier()  # whole file is classified first (as in rewritePcap)
+        for start in range(0, count, BATCH_SIZE):
+            end = start + BATCH_SIZE
+            classifier.update(PacketHeaders(data, offsets[start:end], lengths[start:end]), start)
+        clients = np.zeros(count, dtype=bool)
+        for start in range(0, count, BATCH_SIZE):
+            end = start + BATCH_SIZE
+            clients[start:end] = classifier.clientPackets(PacketHeaders(data, offsets[start:end], lengths[start:end]))
+
+        time_order = np.argsort(timestamps, kind="stable")  # every clone is this stream shifted by k * offset
+        sorted_timestamps = timestamps[time_order]
+        shifts = np.arange(clones + 1, dtype=np.int64) * offset
+        cursors = np.zeros(clones + 1, dtype=np.int64)  # next packet (in time_order) of every clone
+        step = max(1, AMPLIFY_BATCH_SIZE // (clones + 1))
+        subsecond_unit = 1 if pcap.nanoseconds else 1000
+        word = np.dtype(pcap.endian + "u4")
+        with open(temporary_path, "wb") as output:
+            output.write(pcap.buffer[:pcapFile.GLOBAL_HEADER_LENGTH])
+            while (cursors < count).any():
+                # window ends at time which every unfinished clone reaches within step packets - no batch is
+                # bigger than AMPLIFY_BATCH_SIZE and at least one clone moves by step packets
+                active = cursors < count
+                window_end = (sorted_timestamps[np.minimum(cursors + step, count) - 1] + shifts)[active].min()
+                ends = np.searchsorted(sorted_timestamps, window_end - shifts, side="right")
+                chosen_clones = np.repeat(np.arange(clones + 1), ends - cursors)
+                chosen = np.concatenate([time_order[cursor:end] for cursor, end in zip(cursors, ends)])
+                cursors = ends
+                new_timestamps = timestamps[chosen] + shifts[chosen_clones]
+                merged = np.argsort(new_timestamps, kind="stable")  # clone-major - earlier clone first at equal times
+                packets, chosen_clones, new_timestamps = chosen[merged], chosen_clones[merged], new_timestamps[merged]
+
+                record_lengths = lengths[packets] + pcapFile.RECORD_HEADER_LENGTH
+                record_offsets = np.cumsum(record_lengths) - record_lengths  # records in batch
+                positions = np.repeat(offsets[packets] - pcapFile.RECORD_HEADER_LENGTH - record_offsets,
+                                      record_lengths) + np.arange(int(record_lengths.sum()))
+                batch = data[positions]
+                # seconds and subseconds (first two words of record header) of shifted clones
+                seconds, subseconds = np.divmod(new_timestamps, 1000000000)
+                times = np.stack([seconds, subseconds // subsecond_unit], axis=1).astype(word)
+                batch[record_offsets[:, None] + np.arange(8)] = times.view(np.uint8).reshape(-1, 8)
+                headers = PacketHeaders(batch, record_offsets + pcapFile.RECORD_HEADER_LENGTH, lengths[packets])
+                cloneBatch(batch, headers, chosen_clones, address_space, clients[packets])
+                output.write(batch.tobytes())
+        del data
+    os.replace(temporary_path, output_path)
+    return count * (clones + 1)
+
+
+def rewritePcap(input_path, output_path, cache_path, ip1, ip2, mac1, mac2, mtu=None):
+    # One pass replacement of "tcpprep --auto=bridge" + "tcprewrite --endpoints --enet-smac --enet-dmac":
+    # input is copied to output and patched in place through mmap, checksums are updated incrementally
+    # (checksums which were wrong in the input stay wrong). Packets longer than mtu are split (see segmentPcap).
+    # Returns number of packets.
+    with pcapFile.PcapFile(input_path) as pcap:
+        if pcap.linktype != pcapFile.LINKTYPE_ETHERNET:
+            raise ValueError("File \"" + input_path + "\" does not contain ethernet frames.")
+        timestamps, offsets, lengths = pcap.index()
+        offsets = offsets.copy()
+        lengths = lengths.astype(np.int64)
+        data = np.frombuffer(pcap.buffer, dtype=np.uint8)
+        classifier = DirectionClassifier()
+        for start in range(0, len(offsets), BATCH_SIZE):
+            end = start + BATCH_SIZE
+            classifier.update(PacketHeaders(data, offsets[start:end], lengths[start:end]), start)
+        del data
+
+    shutil.copyfile(input_path, output_path)
+    mac1 = macBytes(mac1)
+    mac2 = macBytes(mac2)
+    clients = np.zeros(len(offsets), dtype=bool)
+    with open(output_path, "r+b") as file:
+        if len(offsets):
+            with mmap.mmap(file.fileno(), 0) as buffer:
+                data = np.frombuffer(buffer, dtype=np.uint8)
+                for start in range(0, len(offsets), BATCH_SIZE):
+                    end = start + BATCH_SIZE
+                    headers = PacketHeaders(data, offsets[start:end], lengths[start:end])
+                    clients[start:end] = classifier.clientPackets(headers)
+                    rewriteBatch(data, headers, clients[start:end], ip1, ip2, mac1, mac2)
+                del data
+                buffer.flush()
+    count = len(offsets)
+    if mtu is not None:
+        count, clients = segmentPcap(output_path, output_path, mtu, clients)
+    writeCache(cache_path, clients)
+    return count
@@ -0,0 +1,98 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from tools import pcapFile
+
+
+class StoredPcap():
+    # Packets of one pcap loaded into memory: data of all packets one after another in one bytes buffer (no record
+    # headers) and NumPy arrays of timestamps, offsets and lengths. Has the same interface as pcapFile.PcapFile
+    # used by replay (buffer, index(), context manager) - closing only tells the store it is no longer used.
+    def __init__(self, path):
+        self.path = path
+        with pcapFile.PcapFile(path) as pcap:
+            timestamps, offsets, lengths = pcap.index()
+            self.linktype = pcap.linktype
+            self.buffer = b"".join(pcap.buffer[offset:offset + length]
+                                   for offset, length in zip(offsets.tolist(), lengths.tolist()))
+        self.__index = (timestamps, np.cumsum(lengths, dtype=np.int64) - lengths, lengths)
+        self.size = len(self.buffer) + sum(array.nbytes for array in self.__index)
+        self.users = 0
+        self.store = None
+
+    def index(self):
+        return self.__index
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.store is not None:
+            self.store.release(self)
+
+
+class PacketStore():
+    # Rewritten pcaps shared by all replayers, loaded into memory once - every loop of replay reads packets from
+    # memory instead of disk. Total size is limited by max_bytes, least recently used files which are not being
+    # replayed are evicted first. File which does not fit is replayed from disk (mapped pcapFile.PcapFile).
+    def __init__(self, max_bytes=1024 ** 3):
+        self.maxBytes = max_bytes
+        self.entries = OrderedDict()  # { (path, size, mtime) : StoredPcap } in order of use (last - most recent)
+        self.usedBytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def open(self, path):  # StoredPcap or pcapFile.PcapFile - close it when replay of file ends
+        status = os.stat(path)
+        key = (os.path.abspath(path), status.st_size, status.st_mtime_ns)
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                return self.__use(key)
+            self.misses += 1
+            if not self.__makeRoom(status.st_size):  # file size is upper bound of stored size
+                return pcapFile.PcapFile(path)
+
+        stored = StoredPcap(path)  # loaded without lock - other files can be used meanwhile
+        stored.store = self
+        with self.lock:
+            if key in self.entries:  # loaded by another replayer at the same time
+                return self.__use(key)
+            if not self.__makeRoom(stored.size):
+                stored.store = None
+                return stored  # used once and freed
+            self.entries[key] = stored
+            self.usedBytes += stored.size
+            return self.__use(key)
+
+    def __use(self, key):
+        self.entries.move_to_end(key)
+        stored = self.entries[key]
+        stored.users += 1
+        return stored
+
+    def __makeRoom(self, size):  # evicts unused files until size fits into budget, False if it can not fit
+        if size > self.maxBytes:
+            return False
+        for key in list(self.entries):
+            if self.usedBytes + size <= self.maxBytes:
+                break
+            if self.entries[key].users == 0:
+                self.usedBytes -= self.entries.pop(key).size
+        return self.usedBytes + size <= self.maxBytes
+
+    def release(self, stored):
+        with self.lock:
+            stored.users -= 1
+
+    def clear(self):  # files being replayed stay in memory until they are closed
+        with self.lock:
+            for key in [key for key, stored in self.entries.items() if stored.users == 0]:
+                self.usedBytes -= self.entries.pop(key).size
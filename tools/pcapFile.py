@@ -0,0 +1,200 @@
+import mmap
+import struct
+
+import numpy as np
+
+# libpcap file format (https://wiki.wireshark.org/Development/LibpcapFileFormat)
+#   global header: magic (4), version major (2), version minor (2), thiszone (4), sigfigs (4), snaplen (4), linktype (4)
+#   record header: seconds (4), microseconds or nanoseconds (4), captured length (4), original length (4)
+MAGIC_MICROSECONDS = 0xa1b2c3d4
+MAGIC_NANOSECONDS = 0xa1b23c4d
+MAGIC_PCAPNG = 0x0a0d0d0a
+GLOBAL_HEADER_LENGTH = 24
+RECORD_HEADER_LENGTH = 16
+LINKTYPE_ETHERNET = 1
+
+
+class PcapFile():
+    # Read-only view of pcap file mapped into memory. Timestamps are integer nanoseconds (exact for both variants).
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file can not be mapped
+            self.file.close()
+            raise ValueError("File \"" + path + "\" is empty.")
+
+        if len(self.buffer) < GLOBAL_HEADER_LENGTH:
+            self.close()
+            raise ValueError("File \"" + path + "\" is too short to be a pcap file.")
+
+        magic = struct.unpack("<I", self.buffer[:4])[0]
+        if magic in (MAGIC_MICROSECONDS, MAGIC_NANOSECONDS):
+            self.endian = "<"
+        elif struct.unpack(">I", self.buffer[:4])[0] in (MAGIC_MICROSECONDS, MAGIC_NANOSECONDS):
+            self.endian = ">"
+            magic = struct.unpack(">I", self.buffer[:4])[0]
+        else:
+            self.close()
+            if magic == MAGIC_PCAPNG:
+                raise ValueError("File \"" + path + "\" is in pcapng format - convert it to pcap (e.g. with editcap -F pcap).")
+            raise ValueError("File \"" + path + "\" is not a pcap file.")
+
+        self.nanoseconds = magic == MAGIC_NANOSECONDS
+        self.snaplen, self.linktype = struct.unpack(self.endian + "II", self.buffer[16:24])
+        self.recordHeader = struct.Struct(self.endian + "IIII")
+        self.__index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if getattr(self, "buffer", None) is not None:
+            self.buffer.close()
+            self.buffer = None
+        self.file.close()
+
+    def records(self):  # generator of (timestamp in ns, offset of packet data, captured length, original length)
+        offset = GLOBAL_HEADER_LENGTH
+        size = len(self.buffer)
+        fraction = 1 if self.nanoseconds else 1000
+        unpack = self.recordHeader.unpack_from
+        while offset + RECORD_HEADER_LENGTH <= size:
+            seconds, subseconds, captured, original = unpack(self.buffer, offset)
+            offset += RECORD_HEADER_LENGTH
+            if offset + captured > size:  # truncated last packet
+                break
+            yield seconds * 1000000000 + subseconds * fraction, offset, captured, original
+            offset += captured
+
+    def packets(self):  # generator of (timestamp in ns, packet data as bytes)
+        for timestamp, offset, captured, original in self.records():
+            yield timestamp, self.buffer[offset:offset + captured]
+
+    def index(self):
+        # numpy arrays (timestamps in ns, offsets of packet data, captured lengths) - computed once
+        if self.__index is None:
+            # record headers form a chain (each one gives position of the next one), so this loop can not be
+            # vectorized - it only collects header fields, timestamps are computed by NumPy afterwards
+            seconds = []
+            subseconds = []
+            offsets = []
+            lengths = []
+            offset = GLOBAL_HEADER_LENGTH
+            size = len(self.buffer)
+            unpack = self.recordHeader.unpack_from
+            while offset + RECORD_HEADER_LENGTH <= size:
+                second, subsecond, captured, original = unpack(self.buffer, offset)
+                offset += RECORD_HEADER_LENGTH
+                if offset + captured > size:  # truncated last packet
+                    break
+                seconds.append(second)
+                subseconds.append(subsecond)
+                offsets.append(offset)
+                lengths.append(captured)
+                offset += captured
+            timestamps = np.array(seconds, dtype=np.int64) * 1000000000 \
+                + np.array(subseconds, dtype=np.int64) * (1 if self.nanoseconds else 1000)
+            self.__index = (timestamps, np.array(offsets, dtype=np.int64), np.array(lengths, dtype=np.int32))
+        return self.__index
+
+
+class PcapWriter():
+    def __init__(self, path, linktype=LINKTYPE_ETHERNET, snaplen=262144, nanoseconds=False):
+        self.path = path
+        self.nanoseconds = nanoseconds
+        self.file = open(path, "wb")
+        self.recordHeader = struct.Struct("<IIII")
+        magic = MAGIC_NANOSECONDS if nanoseconds else MAGIC_MICROSECONDS
+        self.file.write(struct.pack("<IHHiIII", magic, 2, 4, 0, 0, snaplen, linktype))
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, timestamp, data, original_length=None):  # timestamp in ns
+        seconds, subseconds = divmod(int(timestamp), 1000000000)
+        if not self.nanoseconds:
+            subseconds //= 1000
+        length = len(data)
+        self.file.write(self.recordHeader.pack(seconds, subseconds, length,
+                                               length if original_length is None else max(original_length, length)))
+        self.file.write(data)
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+def summary(path):  # tuple (packets, bytes of packet data, seconds from the first to the last packet)
+    with PcapFile(path) as pcap:
+        timestamps, offsets, lengths = pcap.index()
+    seconds = float(timestamps[-1] - timestamps[0]) / 1e9 if len(timestamps) > 1 else 0.0
+    return len(lengths), int(lengths.sum()), seconds
+
+
+def retime(path, function):
+    # Changes timestamps of all packets in place - function gets NumPy array of offsets from the first packet (ns)
+    # and returns new offsets. Only record headers are written, packet data stay untouched.
+    with PcapFile(path) as pcap:
+        timestamps, offsets, lengths = pcap.index()
+        endian, nanoseconds = pcap.endian, pcap.nanoseconds
+    if len(timestamps) == 0:
+        return
+    new_timestamps = timestamps[0] + np.asarray(function(timestamps - timestamps[0]), dtype=np.int64)
+    seconds, subseconds = np.divmod(new_timestamps, 1000000000)
+    if not nanoseconds:
+        subseconds //= 1000
+
+    with open(path, "r+b") as file:
+        buffer = mmap.mmap(file.fileno(), 0)
+        try:
+            # seconds and subseconds are the first two 32-bit words of record header
+            headers = offsets - RECORD_HEADER_LENGTH
+            if np.all(headers % 4 == 0):
+                words = np.ndarray((len(buffer) // 4,), np.dtype(endian + "u4"), buffer)
+                words[headers // 4] = seconds
+                words[headers // 4 + 1] = subseconds
+                del words  # mapping can not be closed while it is exported
+            else:  # odd packet lengths - headers are not aligned
+                header = struct.Struct(endian + "II")
+                for offset, second, subsecond in zip(headers.tolist(), seconds.tolist(), subseconds.tolist()):
+                    header.pack_into(buffer, offset, second, subsecond)
+            buffer.flush()
+        finally:
+            buffer.close()
+
+
+def concatenate(paths, output_path, gap=1000000):
+    # Writes packets of all files one after another into one file. Timestamps of every next file are shifted,
+    # so it starts "gap" ns after the last packet of previous file - replaying result is the same as replaying files in order.
+    # Returns number of written packets.
+    writer = None
+    linktype = None
+    last_written = None  # timestamp of last written packet
+    try:
+        for path in paths:
+            with PcapFile(path) as pcap:
+                if writer is None:
+                    writer = PcapWriter(output_path, pcap.linktype, pcap.snaplen, pcap.nanoseconds)
+                    linktype = pcap.linktype
+                elif pcap.linktype != linktype:
+                    raise ValueError("File \"" + path + "\" has different link type than previous files.")
+
+                shift = None
+                for timestamp, offset, captured, original in pcap.records():
+                    if shift is None:
+                        shift = 0 if last_written is None else last_written + gap - timestamp
+                    writer.write(timestamp + shift, pcap.buffer[offset:offset + captured], original)
+                    last_written = timestamp + shift
+    finally:
+        if writer is not None:
+            writer.close()
+    return writer.count if writer is not None else 0
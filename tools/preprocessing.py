@@ -0,0 +1,73 @@
+import time
+
+import numpy as np
+
+from sklearn.preprocessing import RobustScaler
+from sklearn.decomposition import PCA
+from sklearn.random_projection import GaussianRandomProjection
+
+# counters of tools/featureExtraction.py (log transformed) - other features (averages) are already on a small scale
+COUNT_FEATURES = ("packet_count",
+                  "FIN", "SYN", "RST", "PSH", "ACK", "URG", "ECE", "CWR", "NS",
+                  "TCP", "UDP", "ICMP", "DNS", "HTTP",
+                  "port_21", "port_22", "port_23", "port_25", "port_53", "port_80", "port_110", "port_111", "port_135",
+                  "port_139", "port_143", "port_443", "port_445", "port_993", "port_995", "port_1723", "port_3306",
+                  "port_3389", "port_5900", "port_8080")
+
+class FeaturePreprocessor():
+    # Prepares feature matrix for distance-based clustering algorithms:
+    #   1. log transform of count features (packet_count, flags, protocols, ports)
+    #   2. robust scaling (median and interquartile range - not sensitive to outliers)
+    #   3. dimensionality reduction (PCA or Gaussian random projection)
+    # Fitted once per feature matrix and reused by every clustering mode.
+    def __init__(self, log_transform=True, scaling=True, reduction="PCA", components=10, random_state=5,
+                 count_features=COUNT_FEATURES):
+        self.logTransform = log_transform
+        self.countFeatures = tuple(count_features)  # names of features log transformed (if log_transform)
+        self.scaling = scaling
+        self.reduction = reduction  # "PCA", "Random projection" or None
+        self.components = components
+        self.randomState = random_state
+        self.timings = {}  # dict { stage name : time in seconds }
+
+    def getParameters(self):
+        return {
+            "log_transform": self.logTransform,
+            "scaling": self.scaling,
+            "reduction": self.reduction,
+            "components": self.components,
+            "random_state": self.randomState,
+            "count_features": self.countFeatures
+        }
+
+    def fitTransform(self, data, feature_names):
+        self.timings.clear()
+        data = np.array(data, dtype=np.float64)
+        if data.ndim != 2 or data.shape[0] == 0:
+            return data
+
+        if self.logTransform:
+            start_time = time.time()
+            count_columns = [i for i in range(len(feature_names)) if feature_names[i] in self.countFeatures]
+            data[:, count_columns] = np.log1p(np.clip(data[:, count_columns], 0, None))
+            self.timings["log transform"] = time.time() - start_time
+
+        if self.scaling:
+            start_time = time.time()
+            data = RobustScaler().fit_transform(data)
+            self.timings["scaling"] = time.time() - start_time
+
+        components = min(self.components, data.shape[0], data.shape[1])
+        if self.reduction == "PCA" and components < data.shape[1]:
+            start_time = time.time()
+            data = PCA(n_components=components, random_state=self.randomState).fit_transform(data)
+            self.timings["PCA"] = time.time() - start_time
+        elif self.reduction == "Random projection" and components < data.shape[1]:
+            start_time = time.time()
+            projection = GaussianRandomProjection(n_components=components, random_state=self.randomState)
+            data = projection.fit_transform(data)
+            self.timings["random projection"] = time.time() - start_time
+        elif self.reduction not in (None, "PCA", "Random projection"):
+            raise ValueError("Unknown dimensionality reduction method \"" + str(self.reduction) + "\".")
+
+        return data
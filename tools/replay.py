@@ -1,8 +1,15 @@
 import os
+import re
+import math
+import ipaddress
 import time
 import signal
 import shutil
-from subprocess import Popen
+import asyncio
+import threading
+import subprocess
+from subprocess import DEVNULL, PIPE
+from concurrent.futures import ThreadPoolExecutor
 
 from mininet.log import info, error
 from mininet.util import quietRun
@@ -10,6 +17,14 @@ from mininet.link import Intf
 
 from PyQt5 import QtCore
 
+from tools import pcapFile, nativeReplay, nativeRewrite, liveReplay, rewriteCache, replayScheduler, replayRate, packetStore, \
+    hostPlumbing, replayWarmup
+from tools.jobGraph import JobGraph, SkippedJob
+
+TCPREPLAY_ACTUAL = re.compile(r"Actual: (\d+) packets \((\d+) bytes\) sent in ([\d.]+) seconds")
+TCPREPLAY_FAILED = re.compile(r"Failed packets:\s+(\d+)")
+MERGE_GAP = 1000000  # ns between merged files (pcapFile.concatenate)
+
 
 
 def checkIntf(intf):
@@ -46,8 +61,15 @@ def addVeth(node, ip, subnet):
 
     return intfNode, intfOut
 
+def runTool(args):
+    result = subprocess.run(args, stdout=DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        message = result.stderr.strip().splitlines()
+        raise RuntimeError(args[0] + " failed" + (": " + message[-1] if message else " (exit code " + str(result.returncode) + ")"))
+
+
 class ReplayScenario():
-    def __init__(self, intf1, ip1, mac1, intf2, ip2, mac2):
+    def __init__(self, intf1, ip1, mac1, intf2, ip2, mac2, rewrite_cache=None, rewriter="tcprewrite", mtu=None):
         self.intf1 = intf1
         self.ip1 = ip1
         self.mac1 = mac1
@@ -55,102 +77,498 @@ class ReplayScenario():
         self.ip2 = ip2
         self.mac2 = mac2
         self.traffic = []  # list of tuples  (pcap_path, cache_path)   <- for tcpreplay
+        self.prepared = []  # rewritten files (tuples as in traffic) - traffic contains their amplified versions
+        # { rewritten path : pcapFile.summary } of prepared files - expected load of replay (tools/replayWorkers.py),
+        # read while file is prepared (not when replay starts)
+        self.summaries = {}
+        self.merged = None  # tuple (traffic, merged_pcap_path, merged_cache_path) - all traffic in one file
+        self.ramped = None  # tuple ((traffic, rate), ramp_pcap_path, ramp_cache_path) - merged traffic with rate ramp
+        self.rewriteCache = rewrite_cache  # tools.rewriteCache.RewriteCache or None - files written next to original
+        self.rewriter = rewriter  # "tcprewrite" - tcpprep and tcprewrite, "native" - tools/nativeRewrite.py
+        self.mtu = mtu  # longer IP packets are split after rewriting (nativeRewrite.segmentPcap), None - not split
+        # switch interfaces (root namespace) linked to hosts - responses of live peers are read there ("live" mode)
+        self.switchIntf1 = None
+        self.switchIntf2 = None
+        # amplification - traffic replayed together with clones 1..clones (nativeRewrite.amplifyPcap), clone k later
+        # by k * cloneOffset ns, addresses of clones given by addressSpace (nativeRewrite.AddressSpace)
+        self.clones = 0
+        self.cloneOffset = 0
+        self.addressSpace = None
 
     def appendPcap(self, original_path):
-        name = original_path.split('.')[0]
-        rewritten_path = name + "_rewritten.pcap"
-        cache_path = name + ".cache"
-        os.system('tcpprep --auto=bridge --pcap=\"' + original_path + '\" --cachefile=\"' + cache_path + '\"')
+        if self.rewriter == "native":
+            self.addTraffic(self.nativeRewritePcap(original_path))
+        else:
+            cache_path = self.prepPcap(original_path)
+            self.addTraffic(self.rewritePcap(original_path, cache_path))
+
+    def addTraffic(self, prepared, loaded=None):
+        # prepared - tuple (rewritten_path, cache_path), pinned in cache by preparation,
+        # loaded - result of loadTraffic(prepared) if it was already called (e.g. by job of ReplayEngine.prepareAll)
+        summary, amplified = loaded if loaded is not None else self.loadTraffic(prepared)
+        self.summaries[prepared[0]] = summary
+        self.prepared.append(prepared)
+        self.traffic.append(amplified)
+
+    def loadTraffic(self, prepared):  # returns tuple (pcapFile.summary, amplified traffic) of prepared file
+        summary = self.summaries.get(prepared[0])
+        if summary is None:
+            summary = pcapFile.summary(prepared[0])
+        return summary, self.amplifyTraffic(prepared)
+
+    def amplify(self, clones, offset=0, address_space=None):
+        # offset - ns between clones, address_space - nativeRewrite.AddressSpace (clones=0 - original traffic only)
+        self.clones = clones
+        self.cloneOffset = int(offset)
+        self.addressSpace = address_space
+        self.traffic = [self.amplifyTraffic(prepared) for prepared in self.prepared]
+
+    def amplifyTraffic(self, prepared):  # returns tuple (amplified_path, cache_path), written only if it does not exist
+        if self.clones == 0:
+            return prepared
+        rewritten_path = prepared[0]
+        space = self.addressSpace
+        variant = "clones%d_%dns_%d" % (self.clones, self.cloneOffset, space.stride)
+        if self.rewriteCache is None:
+            stem = os.path.splitext(rewritten_path)[0] + "_" + variant
+            amplified_path, cache_path = stem + ".pcap", stem + ".cache"
+            if not os.path.exists(cache_path) or os.path.getmtime(cache_path) < os.path.getmtime(rewritten_path):
+                self.__writeAmplified(rewritten_path, amplified_path, cache_path)
+            return amplified_path, cache_path
+
+        # in cache - content-addressed (evicted and pinned as other prepared files)
+        amplified_path, cache_path = self.rewriteCache.amplifyPaths(
+            rewritten_path, variant + "_%x/%x_%s" % (space.network, space.mask, self.mac1.lower()))
+        if self.rewriteCache.lookup(amplified_path) and self.rewriteCache.lookup(cache_path):
+            return amplified_path, cache_path
+        temporary_amplified = self.rewriteCache.temporaryPath(amplified_path)
+        temporary_cache = self.rewriteCache.temporaryPath(cache_path)
+        self.__writeAmplified(rewritten_path, temporary_amplified, temporary_cache)
+        self.rewriteCache.store(temporary_cache, cache_path)
+        self.rewriteCache.store(temporary_amplified, amplified_path)
+        return amplified_path, cache_path
+
+    def __writeAmplified(self, rewritten_path, amplified_path, cache_path):
+        nativeRewrite.amplifyPcap(rewritten_path, amplified_path, self.clones, self.cloneOffset, self.addressSpace)
+        # clones of hosts have other addresses - client packets are told by MACs
+        nativeRewrite.writeMacCache(amplified_path, cache_path, self.mac1, self.clones)
+
+    # preparation of one file is split into two jobs (see ReplayEngine.prepareAll), both raise RuntimeError on failure
+    def cachePath(self, original_path):
+        native = self.rewriter == "native"
+        if self.rewriteCache is not None:
+            return self.rewriteCache.prepPath(original_path, "native" + self.__mtuSuffix() if native else "tcpprep")
+        return original_path.split('.')[0] + ("_native" + self.__mtuSuffix() + ".cache" if native else ".cache")
+
+    def rewrittenPath(self, original_path):
+        native = self.rewriter == "native"
+        if self.rewriteCache is not None:
+            return self.rewriteCache.rewritePath(original_path, self.ip1, self.ip2, self.mac1, self.mac2,
+                                                 ("native" if native else "tcprewrite") + self.__mtuSuffix())
+        # host pair in name - the same file prepared for different host pairs is not overwritten
+        return original_path.split('.')[0] + "_" + self.ip1 + "_" + self.ip2 + ("_native" if native else "") + \
+            self.__mtuSuffix() + "_rewritten.pcap"
+
+    def segmentedCachePath(self, rewritten_path):  # tcprewrite + splitting - cache of rewritten file (of host pair)
+        return os.path.splitext(rewritten_path)[0] + ".cache"
+
+    def __mtuSuffix(self):
+        return "_mtu" + str(self.mtu) if self.mtu is not None else ""
+
+    def prepPcap(self, original_path):  # tcpprep - splits traffic to client and server, returns path of cache
+        cache_path = self.cachePath(original_path)
+        if self.rewriteCache is not None and self.rewriteCache.lookup(cache_path):
+            return cache_path
+        output_path = self.rewriteCache.temporaryPath(cache_path) if self.rewriteCache is not None else cache_path
+        runTool(['tcpprep', '--auto=bridge', '--pcap=' + original_path, '--cachefile=' + output_path])
+        if self.rewriteCache is not None:
+            self.rewriteCache.store(output_path, cache_path)
+        return cache_path
+
+    def rewritePcap(self, original_path, cache_path):  # tcprewrite - returns tuple (rewritten_path, cache_path)
+        rewritten_path = self.rewrittenPath(original_path)
+        # packets are split after rewriting - tcpprep cache of original file does not fit, cache of result is written
+        replay_cache_path = self.segmentedCachePath(rewritten_path) if self.mtu is not None else cache_path
+        if self.rewriteCache is not None and self.rewriteCache.lookup(rewritten_path) \
+                and (self.mtu is None or self.rewriteCache.lookup(replay_cache_path)):
+            return rewritten_path, replay_cache_path
+        output_path = self.rewriteCache.temporaryPath(rewritten_path) if self.rewriteCache is not None else rewritten_path
         endpoints = self.ip1 + ":" + self.ip2
         mac_1 = self.mac1 + "," + self.mac2
         mac_2 = self.mac2 + "," + self.mac1
-        os.system('tcprewrite --fixcsum --endpoints=' + endpoints + ' --cachefile=\"' + cache_path
-                  + '\" --enet-dmac=' + mac_2 + ' --enet-smac=' + mac_1
-                  + ' --infile=\"' + original_path + '\" --outfile=\"' + rewritten_path + '\"')
-        self.traffic.append((rewritten_path, cache_path))
+        runTool(['tcprewrite', '--fixcsum', '--endpoints=' + endpoints, '--cachefile=' + cache_path,
+                 '--enet-dmac=' + mac_2, '--enet-smac=' + mac_1,
+                 '--infile=' + original_path, '--outfile=' + output_path])
+        if self.mtu is not None:
+            output_cache_path = replay_cache_path
+            if self.rewriteCache is not None:
+                output_cache_path = self.rewriteCache.temporaryPath(replay_cache_path)
+            nativeRewrite.segmentPcap(output_path, output_path, self.mtu)
+            nativeRewrite.writeMacCache(output_path, output_cache_path, self.mac1)
+            if self.rewriteCache is not None:
+                self.rewriteCache.store(output_cache_path, replay_cache_path)
+        if self.rewriteCache is not None:
+            self.rewriteCache.store(output_path, rewritten_path)
+        return rewritten_path, replay_cache_path
+
+    def nativeRewritePcap(self, original_path):  # prep and rewrite in one pass, returns tuple (rewritten_path, cache_path)
+        rewritten_path = self.rewrittenPath(original_path)
+        cache_path = self.cachePath(original_path)
+        if self.rewriteCache is None:
+            nativeRewrite.rewritePcap(original_path, rewritten_path, cache_path, self.ip1, self.ip2, self.mac1, self.mac2,
+                                      self.mtu)
+            return rewritten_path, cache_path
+
+        if self.rewriteCache.lookup(rewritten_path) and self.rewriteCache.lookup(cache_path):
+            return rewritten_path, cache_path
+        temporary_rewritten = self.rewriteCache.temporaryPath(rewritten_path)
+        temporary_cache = self.rewriteCache.temporaryPath(cache_path)
+        try:
+            nativeRewrite.rewritePcap(original_path, temporary_rewritten, temporary_cache,
+                                      self.ip1, self.ip2, self.mac1, self.mac2, self.mtu)
+        except Exception:
+            for path in (temporary_rewritten, temporary_cache):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        self.rewriteCache.store(temporary_cache, cache_path)
+        self.rewriteCache.store(temporary_rewritten, rewritten_path)
+        return rewritten_path, cache_path
+
+    def mergeTraffic(self):
+        # All rewritten files of scenario are written one after another into one file (with its own tcpprep cache),
+        # so one long-lived tcpreplay process can loop over them. Done again only when list of files changes.
+        traffic = tuple(self.traffic)
+        if self.merged is not None and self.merged[0] == traffic:
+            return self.merged[1], self.merged[2]
+
+        merged_path, cache_path = self.mergedPaths(os.path.dirname(traffic[0][0]))
+        pcapFile.concatenate([pcap for pcap, cache in traffic], merged_path, MERGE_GAP)
+        # after rewriting, client (primary) traffic is the one sent from mac1 (or from MACs of its clones)
+        nativeRewrite.writeMacCache(merged_path, cache_path, self.mac1, self.clones)
+        self.merged = (traffic, merged_path, cache_path)
+        return merged_path, cache_path
+
+    def rampTraffic(self, rate):
+        # Rate ramp (replayRate.ReplayRate) for tcpreplay, which has no ramp - merged traffic is repeated until it
+        # covers capture time replayed during the ramp and the ramp is written into timestamps. File is replayed once,
+        # then merged file is looped at the end multiplier. Done again only when list of files or rate changes.
+        merged_path, merged_cache = self.mergeTraffic()
+        key = (self.merged[0], str(rate))
+        if self.ramped is not None and self.ramped[0] == key:
+            return self.ramped[1], self.ramped[2]
+
+        with pcapFile.PcapFile(merged_path) as pcap:
+            timestamps = pcap.index()[0]
+        period = int(timestamps[-1] - timestamps[0]) + MERGE_GAP if len(timestamps) else MERGE_GAP
+        ramp_capture = (rate.start + rate.end) / 2 * rate.duration * 1e9  # as in ReplayRate.realOffset
+        ramp_path, cache_path = self.mergedPaths(os.path.dirname(merged_path), "_ramp")
+        pcapFile.concatenate([merged_path] * max(1, math.ceil(ramp_capture / period)), ramp_path, MERGE_GAP)
+        pcapFile.retime(ramp_path, rate.timeline)
+        nativeRewrite.writeMacCache(ramp_path, cache_path, self.mac1, self.clones)
+        self.ramped = (key, ramp_path, cache_path)
+        return ramp_path, cache_path
+
+    def mergedPaths(self, directory, suffix=""):  # (merged_pcap_path, merged_cache_path) of scenario in directory
+        stem = os.path.join(directory, "scenario_" + self.intf1 + "_" + self.intf2 + suffix)
+        return stem + ".pcap", stem + ".cache"
+
+    def removeMerged(self):
+        # merged files are written next to the first file of traffic (possibly by worker process, which has its own
+        # copy of scenario) - every directory of traffic is checked
+        for directory in {os.path.dirname(pcap) for pcap, cache in self.traffic}:
+            for path in self.mergedPaths(directory) + self.mergedPaths(directory, "_ramp"):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.merged = None
+        self.ramped = None
 
 class ReplayEngine(QtCore.QObject):
-    replayersStartSignal = QtCore.pyqtSignal()
-    replayersStopSignal = QtCore.pyqtSignal()
 
-    def __init__(self, network):
+    def __init__(self, network, mode="persistent", rewrite_cache=None, rewriter="tcprewrite", packet_store=None,
+                 mtu=1500, workers=None):
         super(ReplayEngine, self).__init__()
         self.network = network
+        self.rewriter = rewriter  # "tcprewrite" or "native" (see ReplayScenario)
+        self.mtu = mtu  # longer captured IP packets (e.g. from GRO/TSO) are split into segments/fragments, None - kept
+        self.rewriteCache = rewrite_cache if rewrite_cache is not None else rewriteCache.RewriteCache()
+        # "persistent" - one tcpreplay process per scenario, "per-file" - new process for every file,
+        # "native" - packets sent from this process through AF_PACKET sockets (tools/nativeReplay.py),
+        # "ring" - as "native", but through memory-mapped PACKET_TX_RING,
+        # "global" - packets of all scenarios sent on one timeline (tools/replayScheduler.py)
+        # "live" - TCP conversations replayed closed-loop from client side against live hosts, other packets as in
+        #          "native" mode (tools/liveReplay.py)
+        self.mode = mode
         self.trafficScenarios = []
         self.ipIntfMap = {}  # dictionary to map IP from pcap to emulated network
-        self.threads = []
-        self.replayerThreads = []
+        self.amplification = (0, 0, None)  # (clones, ns between clones, nativeRewrite.AddressSpace) of all scenarios
+        self.warmupReport = None  # report of the last warm-up (replayWarmup.warmUp)
+        self.flowSwitches = set()  # switches with proactive flows of warm-up (removed by clean)
+        self.arpEntries = {}  # { host : list of (ip, dev) } - static ARP entries of warm-up (removed by clean)
+        self.resetRules = set()  # (host, peer ip) with iptables rule dropping stray RSTs of "live" mode
+        self.hostSetupTimes = {}  # { host name : (seconds, "netlink" or "shell") } - setup of replay interfaces
+        # rewritten files kept in memory for "native", "ring" and "global" modes (tcpreplay preloads files itself)
+        self.packetStore = packet_store if packet_store is not None else packetStore.PacketStore()
+        # workers - tools.replayWorkers.ReplayWorkerPool (scenarios replayed in pinned processes with their own
+        # packet stores) or None - scenarios replayed by threads of this process
+        self.workers = workers
+        self.supervisor = workers if workers is not None else ReplaySupervisor(self.packetStore)
+
+    def useWorkers(self, workers):
+        # replay is moved to workers (tools.replayWorkers.ReplayWorkerPool) or back to threads of this process
+        # (None) - only while nothing is replayed
+        self.supervisor.close()
+        self.workers = workers
+        self.supervisor = workers if workers is not None else ReplaySupervisor(self.packetStore)
 
     def prepare(self, traffic_path, host1, host2):
+        scenario, created = self.findScenario(host1, host2)
+        scenario.appendPcap(traffic_path)
+        if not created:
+            self.supervisor.scenarioChanged(scenario)
+        return scenario
+
+    def prepareAll(self, traffic, workers=None, progress=None):
+        # traffic - list of tuples (traffic_path, host1, host2)
+        # Files are prepared in parallel on bounded pool of workers (job graph: tcpprep -> tcprewrite for every file,
+        # or one native rewrite job, then summary and amplification of rewritten file - ReplayScenario.loadTraffic).
+        # progress(done, total, traffic_path, error message or None) is called after every file.
+        # Returns dict { traffic_path : error message } of files which could not be prepared.
+        self.prepareHosts([host for traffic_path, host1, host2 in traffic for host in (host1, host2)], workers)
+        scenarios = [self.findScenario(host1, host2)[0] for traffic_path, host1, host2 in traffic]
+
+        graph = JobGraph()
+        prepared = {}  # { i : (rewritten_path, cache_path) } - results of rewrite jobs, read by load jobs
+
+        def rewrite(i, function, *args):
+            prepared[i] = function(*args)
+
+        def load(scenario, i):
+            return scenario.loadTraffic(prepared[i])
+
+        for i, (scenario, (traffic_path, host1, host2)) in enumerate(zip(scenarios, traffic)):
+            if self.rewriter == "native":
+                graph.add(("rewrite", i), rewrite, i, scenario.nativeRewritePcap, traffic_path)
+            else:
+                graph.add(("tcpprep", i), scenario.prepPcap, traffic_path)
+                graph.add(("rewrite", i), rewrite, i, scenario.rewritePcap, traffic_path,
+                          scenario.cachePath(traffic_path), after=[("tcpprep", i)])
+            # summary and amplification of rewritten file (errors are failures of the file, as errors of rewrite)
+            graph.add(("load", i), load, scenario, i, after=[("rewrite", i)])
+
+        failures = {}
+        done = [0]
+
+        def finished(key, result, error):
+            stage, i = key
+            if (error is None and stage != "load") or isinstance(error, SkippedJob):
+                return  # file is not finished yet or was already reported by failed job it depends on
+            done[0] += 1
+            if error is not None:
+                failures[traffic[i][0]] = str(error)
+            if progress is not None:
+                progress(done[0], len(traffic), traffic[i][0], None if error is None else str(error))
+
+        results, errors = graph.run(workers, finished)
+
+        # files are added to scenarios in the original order (independent of order in which jobs finished)
+        changed = set()
+        for i, scenario in enumerate(scenarios):
+            if ("load", i) in results:
+                scenario.addTraffic(prepared[i], results[("load", i)])
+                changed.add(scenario)
+        for scenario in changed:
+            self.supervisor.scenarioChanged(scenario)
+        return failures
+
+    def findScenario(self, host1, host2):  # returns tuple (scenario of host pair, True if it was created)
         veth1, ip1, mac1 = self.prepareHost(host1)
         veth2, ip2, mac2 = self.prepareHost(host2)
 
         for scenario in self.trafficScenarios:
             if (scenario.intf1 == veth1 and scenario.intf2 == veth2) or (scenario.intf1 == veth2 and scenario.intf2 == veth1):
-                scenario.appendPcap(traffic_path)
-                return scenario
+                return scenario, False
 
         # scenario not found - create new one
-        scenario = ReplayScenario(veth1, ip1, mac1, veth2, ip2, mac2)
-        scenario.appendPcap(traffic_path)
+        scenario = ReplayScenario(veth1, ip1, mac1, veth2, ip2, mac2, self.rewriteCache, self.rewriter, self.mtu)
+        scenario.switchIntf1 = self.switchIntf(host1)
+        scenario.switchIntf2 = self.switchIntf(host2)
+        scenario.amplify(*self.amplification)
         self.trafficScenarios.append(scenario)
-        return scenario
+        return scenario, True
+
+    def amplify(self, clones, offset=0.0):
+        # Every scenario is replayed together with clones 1..clones of its traffic, clone k later by k * offset
+        # seconds. Clones get addresses of topology network above addresses of all hosts, MACs 02:kk:kk:xx:xx:xx
+        # and other client ports (nativeRewrite.cloneBatch), so they are new flows for controller. clones=0 - only
+        # the original traffic. Amplified files are written now and replay of running scenarios is restarted.
+        # Raises ValueError if clones do not fit into network.
+        network = ipaddress.ip_network(self.network.ipBase, strict=False)
+        highest = max([int(ipaddress.ip_address(host.IP())) - int(network.network_address)
+                       for host in self.network.hosts if ipaddress.ip_address(host.IP()) in network] + [1])
+        address_space = nativeRewrite.AddressSpace(self.network.ipBase, 1 << highest.bit_length())
+        address_space.check(clones)
+        self.amplification = (clones, int(offset * 1e9), address_space)
+        for scenario in self.trafficScenarios:
+            scenario.amplify(*self.amplification)
+            self.supervisor.scenarioChanged(scenario)
 
-    def start(self, *chosen_scenarios):
-        scenarios = []
+    def chosenScenarios(self, chosen_scenarios):  # scenarios of numbers (all scenarios if no number is given)
         if len(chosen_scenarios) == 0:
-            scenarios = self.trafficScenarios
-        else:
-            for number in chosen_scenarios:
-                scenarios.append(self.trafficScenarios[number - 1])
-
-        for scenario in scenarios:
-            thread = QtCore.QThread()
-            thread.start()
-            replayer = ScenarioReplayer(scenario)
-            replayer.moveToThread(thread)
-            self.replayerThreads.append((thread, replayer))
-
-            self.replayersStartSignal.connect(replayer.start)
-            self.replayersStopSignal.connect(replayer.stop)
-            self.replayerThreads.append((thread, replayer))
-
-        self.replayersStartSignal.emit()
+            return self.trafficScenarios
+        return [self.trafficScenarios[number - 1] for number in chosen_scenarios]
+
+    def warmUp(self, *chosen_scenarios, proactive_flows=False, timeout=5.0):
+        # Optional phase before start: static ARP entries on hosts of scenarios, proactive flows between them
+        # (proactive_flows, added through ovs-ofctl) and waiting (at most timeout seconds) until pings between them
+        # pass - the first packets of replay do not wait for ARP and packet-ins. Returns report (replayWarmup.warmUp),
+        # kept in warmupReport - time of warm-up is not a part of replay.
+        hosts = {host.IP(): host for host in self.network.hosts}
+        pairs = [(hosts[scenario.ip1], hosts[scenario.ip2]) for scenario in self.chosenScenarios(chosen_scenarios)
+                 if scenario.ip1 in hosts and scenario.ip2 in hosts]
+        self.warmupReport = replayWarmup.warmUp(self.network, pairs, proactive_flows, timeout)
+        self.flowSwitches.update(self.warmupReport["flows"])
+        for host, entries in self.warmupReport["arp"].items():
+            self.arpEntries[host] = list(dict.fromkeys(self.arpEntries.get(host, []) + entries))
+        report = self.warmupReport
+        info('*** Replay warm-up of %d host pairs took %.2f s (ARP: %d entries in %.2f s, flows: %d in %.2f s, '
+             'data plane: %d/%d pairs ready in %.2f s)\n'
+             % (report["pairs"], report["seconds"], report["arp_entries"], report["arp_seconds"],
+                sum(report["flows"].values()), report["flows_seconds"], report["ready"], report["pairs"],
+                report["ready_seconds"]))
+        return report
+
+    def start(self, *chosen_scenarios, rate=None, rates=None):
+        # rate - replayRate.ReplayRate of all scenarios (default - original timing),
+        # rates - dict { scenario number : ReplayRate } for scenarios with their own rate
+        # (in "global" mode all scenarios share one timeline, so only rate is used)
+        scenarios = self.chosenScenarios(chosen_scenarios)
+        rate = rate if rate is not None else replayRate.ReplayRate()
+        scenario_rates = {scenario: rate for scenario in scenarios}
+        for number, scenario_rate in (rates or {}).items():
+            if self.trafficScenarios[number - 1] in scenario_rates:
+                scenario_rates[self.trafficScenarios[number - 1]] = scenario_rate
+        if self.mode == "global" and rates:
+            info('*** Replay mode "global" uses one rate for all scenarios - per-scenario rates are ignored\n')
+        if self.mode == "live":
+            self.__dropStrayResets(scenarios)
+        self.supervisor.start(scenarios, self.mode, scenario_rates, rate)
+
+    def telemetry(self):
+        # list of dicts (scenario - number, intf1, intf2, rate - requested rate, packets, bytes, seconds, pps, mbps -
+        # achieved rate, drift_ms, max_drift_ms - lateness against planned send times, errors) of running scenarios
+        # ("global" mode - values of the whole timeline for every scenario in it, "live" mode - also flows,
+        # completed_flows, completion_ratio and flow_latency_ms - mean handshake time of live peers, switch_intf1,
+        # switch_intf2 - switch ends of links of hosts)
+        telemetry = self.supervisor.telemetry()
+        return [dict(telemetry[scenario], scenario=number, intf1=scenario.intf1, intf2=scenario.intf2,
+                     switch_intf1=scenario.switchIntf1, switch_intf2=scenario.switchIntf2)
+                for number, scenario in enumerate(self.trafficScenarios, 1) if scenario in telemetry]
+
+    def workerLayout(self):
+        # list of dicts (worker, pid, cpus, realtime, error, scenarios - numbers, pps - expected load) of replay
+        # workers, empty without worker pool
+        if self.workers is None:
+            return []
+        return [dict(worker, scenarios=[self.trafficScenarios.index(scenario) + 1 for scenario in worker["scenarios"]])
+                for worker in self.workers.layout()]
 
     def stop(self):
-        self.replayersStopSignal.emit()
-        for thread, replayer in self.replayerThreads:
-            replayer.stop()
-            thread.quit()
-            thread.wait()
-        self.replayerThreads.clear()
+        self.supervisor.stop()
+        for host, peer_ip in self.resetRules:
+            host.cmd("iptables -D OUTPUT -p tcp -d " + peer_ip + " --tcp-flags RST,ACK RST -j DROP")
+        self.resetRules = set()
+
+    def __dropStrayResets(self, scenarios):
+        # In "live" mode host of replayed client receives responses of live peer to connections it did not open and
+        # its stack answers them with RST (without ACK flag) - such RSTs are dropped, so they do not end connections
+        # at live peer. Refusals and aborts of live peer (RST with ACK) still pass.
+        hosts = {host.IP(): host for host in self.network.hosts}
+        for scenario in scenarios:
+            for ip, peer_ip in ((scenario.ip1, scenario.ip2), (scenario.ip2, scenario.ip1)):
+                if ip in hosts and (hosts[ip], peer_ip) not in self.resetRules:
+                    hosts[ip].cmd("iptables -I OUTPUT -p tcp -d " + peer_ip + " --tcp-flags RST,ACK RST -j DROP")
+                    self.resetRules.add((hosts[ip], peer_ip))
+
+    def switchIntf(self, host_name):  # interface at the other end of link of host (None - host has no link)
+        intf = self.network.getNodeByName(host_name).defaultIntf()
+        link = getattr(intf, "link", None)
+        if link is None:
+            return None
+        return (link.intf2 if link.intf1 is intf else link.intf1).name
 
     def prepareHost(self, host_name):
         host = self.network.getNodeByName(host_name)
         ip = host.IP()
         mac = host.MAC()
-        vethIp = len(self.ipIntfMap)
         if ip not in self.ipIntfMap:
-            inside_intf, outside_intf = addVeth(host, vethIp, self.network.ipBase)
-            network_interface = host.name + "-eth0"
-
-            # mirror veth to network interface
-            # ingress
-            host.cmd("tc qdisc add dev " + inside_intf + " ingress")
-            host.cmd("tc filter add dev " + inside_intf + " parent ffff: "
-                        "protocol all u32 match u8 0 0 action mirred egress mirror dev " + network_interface)
-            host.cmd("sudo tc filter add dev " + inside_intf + " parent ffff: protocol 0x8942 u32 match u8 0 0 action drop")
-            host.cmd('iptables -t nat -A POSTROUTING -o ' + network_interface + ' MASQUERADE')
-
-            os.system("ifconfig " + outside_intf + " mtu " + str(65535) + " up")  # for tcpreplay to not crush on too big packets
-
+            self.ipIntfMap[ip] = self.__setupHost(host, len(self.ipIntfMap))
+        return self.ipIntfMap[ip], ip, mac
+
+    def prepareHosts(self, host_names, workers=None):
+        # Replay interfaces of all hosts which do not have them yet are set up in parallel (every host has its own
+        # namespace, so setups are independent). Time of every setup is kept in hostSetupTimes.
+        hosts = {}  # { ip : host } in order of first use - numbers of veth subnets do not depend on threads
+        for host_name in host_names:
+            host = self.network.getNodeByName(host_name)
+            if host.IP() not in self.ipIntfMap and host.IP() not in hosts:
+                hosts[host.IP()] = host
+        if not hosts:
+            return
+
+        start = time.perf_counter()
+        first_number = len(self.ipIntfMap)
+        with ThreadPoolExecutor(max_workers=workers or min(32, len(hosts))) as executor:
+            outside_intfs = list(executor.map(self.__setupHost, hosts.values(),
+                                              range(first_number, first_number + len(hosts))))
+        for ip, outside_intf in zip(hosts, outside_intfs):
             self.ipIntfMap[ip] = outside_intf
-        else:
-            outside_intf = self.ipIntfMap[ip]
-        return outside_intf, ip, mac
+
+        times = {host.name: self.hostSetupTimes[host.name] for host in hosts.values()}
+        slowest = max(times, key=lambda name: times[name][0])
+        info('*** Replay interfaces of %d hosts prepared in %.2f s (netlink: %d, shell: %d, slowest: %s %.3f s)\n'
+             % (len(hosts), time.perf_counter() - start, sum(method == "netlink" for seconds, method in times.values()),
+                sum(method == "shell" for seconds, method in times.values()), slowest, times[slowest][0]))
+
+    def __setupHost(self, host, number):  # returns outside interface of replay veth pair (number - subnet 4.4.<number>.0)
+        start = time.perf_counter()
+        network_interface = host.name + "-eth0"
+        if hostPlumbing.available():
+            try:
+                inside_intf, outside_intf = hostPlumbing.setupHost(host.name, host.pid, number, network_interface)
+            except Exception as e:
+                error('Error: netlink setup of replay interfaces of ' + host.name + ' failed (' + str(e) +
+                      '), using shell commands\n')
+            else:
+                Intf(inside_intf, node=host)  # registered in mininet as by addVeth (e.g. for host.intfNames())
+                self.hostSetupTimes[host.name] = (time.perf_counter() - start, "netlink")
+                return outside_intf
+
+        inside_intf, outside_intf = addVeth(host, number, self.network.ipBase)
+
+        # mirror veth to network interface
+        # ingress
+        host.cmd("tc qdisc add dev " + inside_intf + " ingress")
+        host.cmd("tc filter add dev " + inside_intf + " parent ffff: "
+                    "protocol all u32 match u8 0 0 action mirred egress mirror dev " + network_interface)
+        host.cmd("sudo tc filter add dev " + inside_intf + " parent ffff: protocol 0x8942 u32 match u8 0 0 action drop")
+        host.cmd('iptables -t nat -A POSTROUTING -o ' + network_interface + ' -j MASQUERADE')
+
+        os.system("ifconfig " + outside_intf + " mtu " + str(65535) + " up")  # for tcpreplay to not crush on too big packets
+        self.hostSetupTimes[host.name] = (time.perf_counter() - start, "shell")
+        return outside_intf
 
     def clean(self):
         self.stop()
+        self.supervisor.close()
+        self.packetStore.clear()
+        for scenario in self.trafficScenarios:
+            scenario.removeMerged()
+        self.rewriteCache.unpinAll()
+        replayWarmup.removeFlows(self.flowSwitches)
+        self.flowSwitches = set()
+        replayWarmup.removeArp(self.arpEntries)
+        self.arpEntries = {}
         info('*** Removing virtual ethernet pairs')
         self.cleanVethPairs()
 
@@ -160,47 +578,316 @@ class ReplayEngine(QtCore.QObject):
             # os.system('ip link del ' + intf2 + ' type veth')  # unnecessary - Cannot find device "xxx" (one del removes veth pair)
 
 
-class ScenarioReplayer(QtCore.QObject):
+async def runReplayer(replayer, description, restart=None):
+    # Replayer with blocking start() and stop() (e.g. nativeReplay.NativeReplayer) sends packets in its own thread,
+    # the task only waits for it and stops it when cancelled (or when restart event is set).
+    # Returns True if replayer was stopped because of restart.
+    loop = asyncio.get_running_loop()
+    finished = loop.create_future()
+
+    def replay():
+        try:
+            replayer.start()
+        except Exception as e:
+            error('Error: ' + description + ' failed: ' + str(e) + '\n')
+        finally:
+            loop.call_soon_threadsafe(finished.set_result, None)
+
+    threading.Thread(target=replay, daemon=True).start()
+    try:
+        if restart is None:
+            await asyncio.shield(finished)
+            return False
+        return await waitForFirst(asyncio.shield(finished), restart.wait()) == 1
+    finally:
+        replayer.stop()
+        await finished
+
+
+async def waitForFirst(*awaitables):  # returns index of awaitable which finished first, cancels the others
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        return next(i for i, task in enumerate(tasks) if task in done)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+class ReplaySupervisor():
+    # One asyncio event loop (running in its own thread) supervises replay of all scenarios. Replay processes are
+    # awaited instead of polled, so stop and restart are immediate and all scenarios are stopped in parallel.
+    def __init__(self, packet_store=None):
+        self.loop = None
+        self.thread = None
+        self.replayers = {}  # dict { scenario : (ScenarioReplayer or GlobalReplayer, asyncio task) }
+        self.packetStore = packet_store
+
+    def __ensureLoop(self):
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever, name="replay supervisor", daemon=True)
+            self.thread.start()
+
+    def start(self, scenarios, mode, rates, global_rate):
+        # rates - dict { scenario : replayRate.ReplayRate }, global_rate - rate of "global" mode timeline
+        self.__ensureLoop()
+        asyncio.run_coroutine_threadsafe(self.__start(scenarios, mode, rates, global_rate), self.loop).result()
+
+    async def __start(self, scenarios, mode, rates, global_rate):
+        if mode == "global":  # one replayer for all scenarios
+            scenarios = [scenario for scenario in scenarios if scenario not in self.replayers]
+            if scenarios:
+                replayer = GlobalReplayer(scenarios, global_rate, self.packetStore)
+                task = self.loop.create_task(replayer.run())
+                for scenario in scenarios:
+                    self.replayers[scenario] = (replayer, task)
+            return
 
-    def __init__(self, scenario):
-        super(ScenarioReplayer, self).__init__()
-        self.scenario = scenario
-        self._isRunning = False
-
-    def start(self):
-        self._isRunning = True
-        while self._isRunning:
-            for pcap, cache in self.scenario.traffic:
-                # popen.terminate and popen.kill do not work correctly, as popen.pid is the pid of the spawned shell and not of the actual process.
-                # BUT ONLY IF POPEN(SHELL = TRUE)
-                # so full path to tcreplay is required
-                tcpreplay_path = shutil.which("tcpreplay")
-                comm = ' '.join([tcpreplay_path, '--quiet',
-                                 '--intf1=' + self.scenario.intf1,
-                                 '--intf2=' + self.scenario.intf2,
-                                 '--cachefile=' + cache,
-                                 pcap,
-                                 '>/dev/null'])
-                print(comm)
-                process = Popen(args=['sudo', tcpreplay_path, '--quiet',
-                                 '--intf1=' + self.scenario.intf1,
-                                 '--intf2=' + self.scenario.intf2,
-                                 '--cachefile=' + cache,
-                                 pcap,
-                                 '>/dev/null'])
-                process_running = True
-                while process_running:
-                    time.sleep(1)
-                    process_running = process.poll() is None
-                    if not self._isRunning:
-
-                        os.kill(process.pid, signal.SIGTERM)
-                        # process.terminate()
-                        # os.system("kill -9 " + str(process.pid))
-                        os.kill(process.pid, signal.SIGTERM)
-                        process_running = False
-                if not self._isRunning:
-                    break
+        for scenario in scenarios:
+            if scenario not in self.replayers:
+                replayer = ScenarioReplayer(scenario, mode, rates[scenario], self.packetStore)
+                self.replayers[scenario] = (replayer, self.loop.create_task(replayer.run()))
+
+    def telemetry(self):  # dict { scenario : dict (rate, packets, bytes, seconds, pps, mbps, drift_ms, max_drift_ms, errors) }
+        if self.loop is None:
+            return {}
+        return asyncio.run_coroutine_threadsafe(self.__telemetry(), self.loop).result()
+
+    async def __telemetry(self):
+        telemetry = {}
+        for scenario, (replayer, task) in self.replayers.items():
+            telemetry[scenario] = dict(replayer.telemetry(), rate=replayer.rateInUse())
+        return telemetry
+
+    def scenarioChanged(self, scenario):  # files of scenario changed - its replay is restarted (thread-safe)
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.__scenarioChanged, scenario)
+
+    def __scenarioChanged(self, scenario):
+        if scenario in self.replayers:
+            self.replayers[scenario][0].changed.set()
 
     def stop(self):
-        self._isRunning = False
\ No newline at end of file
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self.__stop(), self.loop).result()
+
+    async def __stop(self):
+        tasks = list({task for replayer, task in self.replayers.values()})
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.replayers.clear()
+
+    def close(self):
+        if self.loop is not None:
+            self.stop()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            self.loop = None
+            self.thread = None
+
+
+class ScenarioReplayer():
+    # Replay of one scenario - coroutine run by ReplaySupervisor, stopped by cancelling its task.
+
+    def __init__(self, scenario, mode="persistent", rate=None, packet_store=None):
+        self.scenario = scenario
+        self.mode = mode
+        self.rate = rate if rate is not None else replayRate.ReplayRate()
+        self.packetStore = packet_store
+        self.changed = asyncio.Event()  # set when files of scenario change
+        self.nativeReplayer = None  # nativeReplay.NativeReplayer or liveReplay.LiveReplayer sending from this process
+        # statistics printed by tcpreplay: [packets, bytes, seconds, failed packets] of finished processes and of
+        # the running one, drift of the running one
+        self.tcpreplayTotals = [0, 0, 0.0, 0]
+        self.tcpreplayCurrent = [0, 0, 0.0, 0]
+        self.tcpreplayDrift = (0.0, 0.0)  # (last, max) in ns
+        # rate tcpreplay was started with (None - self.rate), ramp written into timestamps - time.monotonic() of
+        # start of the ramp (multiplier in use changes continuously)
+        self.tcpreplayRate = None
+        self.rampStart = None
+
+    def rateInUse(self):  # rate replayed at now (native and live modes compute ramp for every packet - self.rate)
+        if self.rampStart is not None:
+            multiplier = self.rate.multiplierAt(time.monotonic() - self.rampStart)
+            return "x%.3g (%s)" % (multiplier, self.rate)
+        if self.tcpreplayRate is None or self.rate.mode != "ramp":
+            return str(self.rate)
+        return "%s (%s)" % (self.tcpreplayRate, self.rate)
+
+    def achievedRate(self):
+        if self.nativeReplayer is not None:
+            return self.nativeReplayer.achievedRate()
+        packets, sent_bytes, seconds, failed = [total + current for total, current
+                                                in zip(self.tcpreplayTotals, self.tcpreplayCurrent)]
+        return replayRate.achievedRate(packets, sent_bytes, seconds)
+
+    def telemetry(self):
+        if self.nativeReplayer is not None:
+            return self.nativeReplayer.telemetry()
+        telemetry = self.achievedRate()
+        telemetry.update(drift_ms=self.tcpreplayDrift[0] / 1e6, max_drift_ms=self.tcpreplayDrift[1] / 1e6,
+                         errors=self.tcpreplayTotals[3] + self.tcpreplayCurrent[3])
+        return telemetry
+
+    async def run(self):
+        if self.mode in ("native", "ring"):
+            await self.__runNative()
+        elif self.mode == "live":
+            await self.__runLive()
+        elif self.mode == "persistent":
+            await self.__runPersistent()
+        else:
+            await self.__runPerFile()
+
+    async def __runPersistent(self):
+        # One tcpreplay process loops (--loop=0) over all files of scenario preloaded into memory (--preload-pcap),
+        # so there are no gaps caused by starting new process for every file. Process is restarted only
+        # when list of scenario files changes (or when it exits unexpectedly).
+        # Ramp - file with the ramp in its timestamps (ReplayScenario.rampTraffic) is replayed once before the loop,
+        # which then runs at the end multiplier (looped ramp would start again with every loop).
+        tcpreplay_path = shutil.which("tcpreplay")
+        loop = asyncio.get_running_loop()
+        start_time = time.monotonic()
+        try:
+            while True:
+                self.changed.clear()
+                if not self.scenario.traffic:
+                    await self.changed.wait()
+                    continue
+                elapsed = time.monotonic() - start_time
+                ramping = self.rate.mode == "ramp" and elapsed < self.rate.duration
+                if ramping:
+                    # rest of the ramp (restarted after files changed) is a ramp from the multiplier reached so far
+                    rest = replayRate.ReplayRate("ramp", start=self.rate.multiplierAt(elapsed), end=self.rate.end,
+                                                 duration=self.rate.duration - elapsed)
+                    path, cache_path = await loop.run_in_executor(None, self.scenario.rampTraffic, rest)
+                    rate = replayRate.ReplayRate()  # ramp is already in timestamps
+                    self.rampStart = time.monotonic() - elapsed
+                else:
+                    path, cache_path = await loop.run_in_executor(None, self.scenario.mergeTraffic)
+                    rate = self.rate
+                    if rate.mode == "ramp":
+                        rate = replayRate.ReplayRate("multiplier", rate.end)
+                    self.rampStart = None
+                self.tcpreplayRate = rate
+                schedule = await loop.run_in_executor(None, replayRate.Schedule, path, rate)
+                args = ['sudo', tcpreplay_path, '--stats=1'] + ([] if ramping else ['--loop=0']) + ['--preload-pcap'] + \
+                    rate.tcpreplayArgs() + [
+                        '--intf1=' + self.scenario.intf1,
+                        '--intf2=' + self.scenario.intf2,
+                        '--cachefile=' + cache_path,
+                        path]
+                info(' '.join(args[1:]) + '\n')
+                process = await asyncio.create_subprocess_exec(*args, stdout=PIPE, stderr=DEVNULL)
+                statistics = loop.create_task(self.__readStatistics(process.stdout, schedule))
+                try:
+                    exited = await waitForFirst(process.wait(), self.changed.wait()) == 0
+                finally:
+                    statistics.cancel()
+                    await self.__terminate(process)
+                    self.__processFinished()
+                if exited and not (ramping and process.returncode == 0):  # finished ramp - loop starts right away
+                    await asyncio.sleep(1)  # process ended by itself (e.g. error) - do not restart it in tight loop
+        finally:
+            self.rampStart = None
+
+    async def __runPerFile(self):
+        tcpreplay_path = shutil.which("tcpreplay")
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        while True:
+            for pcap, cache in list(self.scenario.traffic):
+                # ramp - multiplier is changed with every file
+                rate = self.rate
+                if rate.mode == "ramp":
+                    rate = replayRate.ReplayRate("multiplier", rate.multiplierAt(loop.time() - start_time))
+                self.tcpreplayRate = rate
+                schedule = await loop.run_in_executor(None, replayRate.Schedule, pcap, rate)
+                args = ['sudo', tcpreplay_path, '--stats=1'] + rate.tcpreplayArgs() + [
+                        '--intf1=' + self.scenario.intf1,
+                        '--intf2=' + self.scenario.intf2,
+                        '--cachefile=' + cache,
+                        pcap]
+                info(' '.join(args[1:]) + '\n')
+                # output is read (not shown) - statistics are parsed from it
+                process = await asyncio.create_subprocess_exec(*args, stdout=PIPE)
+                statistics = loop.create_task(self.__readStatistics(process.stdout, schedule))
+                try:
+                    await process.wait()
+                finally:
+                    statistics.cancel()
+                    await self.__terminate(process)
+                    self.__processFinished()
+            if not self.scenario.traffic:
+                self.changed.clear()
+                await self.changed.wait()
+
+    async def __runNative(self):
+        self.nativeReplayer = nativeReplay.NativeReplayer(self.scenario, self.rate, ring=self.mode == "ring",
+                                                          store=self.packetStore)
+        await runReplayer(self.nativeReplayer, 'native replay on ' + self.scenario.intf1 + ' and ' + self.scenario.intf2)
+
+    async def __runLive(self):
+        self.nativeReplayer = liveReplay.LiveReplayer(self.scenario, self.rate, store=self.packetStore)
+        await runReplayer(self.nativeReplayer, 'live replay on ' + self.scenario.intf1 + ' and ' + self.scenario.intf2)
+
+    async def __readStatistics(self, stream, schedule):
+        # tcpreplay --stats prints totals of process every second, e.g. "Actual: 1000 packets (64000 bytes) sent
+        # in 1.00 seconds" and "Failed packets: 0", drift is estimated from schedule (replayRate.Schedule)
+        while True:
+            line = await stream.readline()
+            if not line:
+                return
+            line = line.decode(errors="replace")
+            actual = TCPREPLAY_ACTUAL.search(line)
+            if actual:
+                packets, sent_bytes, seconds = int(actual.group(1)), int(actual.group(2)), float(actual.group(3))
+                self.tcpreplayCurrent[:3] = [packets, sent_bytes, seconds]
+                drift = schedule.drift(packets, seconds)
+                if drift is not None:
+                    self.tcpreplayDrift = (drift, max(self.tcpreplayDrift[1], drift))
+            failed = TCPREPLAY_FAILED.search(line)
+            if failed:
+                self.tcpreplayCurrent[3] = int(failed.group(1))
+
+    def __processFinished(self):  # statistics of finished tcpreplay process are added to totals
+        self.tcpreplayTotals = [total + current for total, current in zip(self.tcpreplayTotals, self.tcpreplayCurrent)]
+        self.tcpreplayCurrent = [0, 0, 0.0, 0]
+
+    @staticmethod
+    async def __terminate(process):
+        if process.returncode is None:
+            try:
+                process.send_signal(signal.SIGTERM)  # sudo passes signal to tcpreplay
+            except ProcessLookupError:
+                pass
+            await process.wait()
+
+
+class GlobalReplayer():
+    # Replay of all scenarios on one timeline (replayScheduler.GlobalScheduler) - restarted when files of any scenario
+    # change, so the timeline contains all of them.
+    def __init__(self, scenarios, rate=None, packet_store=None):
+        self.scenarios = scenarios
+        self.rate = rate if rate is not None else replayRate.ReplayRate()
+        self.packetStore = packet_store
+        self.changed = asyncio.Event()
+        self.scheduler = None
+
+    def rateInUse(self):  # scheduler computes ramp for every packet
+        return str(self.rate)
+
+    def telemetry(self):
+        if self.scheduler is None:
+            return dict(replayRate.achievedRate(0, 0, 0), drift_ms=0.0, max_drift_ms=0.0, errors=0)
+        return self.scheduler.telemetry()
+
+    async def run(self):
+        while True:
+            self.changed.clear()
+            self.scheduler = replayScheduler.GlobalScheduler(self.scenarios, self.rate, store=self.packetStore)
+            if not await runReplayer(self.scheduler, 'global replay', self.changed):
+                return
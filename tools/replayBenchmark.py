@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+#   Benchmark of replay backends (tcpreplay, AF_PACKET sendmmsg, PACKET_TX_RING) on one veth pair.
+# Packets are sent as fast as possible to the first interface, delivered packets are counted on its peer.
+# Usage (from repository root, as root):
+#   sudo python3 -m tools.replayBenchmark --packets 100000 --sizes 64 512 1500 --output replay_bench.json
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from tools import pcapFile, nativeReplay, replayRate
+from tools.clusteringBenchmark import currentCommit
+
+BACKENDS = ["tcpreplay", "native", "ring"]
+MAC = "02:00:00:00:00:01"
+
+
+class BenchmarkScenario():  # the same attributes as ReplayScenario used by replayers
+    def __init__(self, intf, pcap_path):
+        self.intf1 = intf
+        self.intf2 = intf
+        self.mac1 = MAC
+        self.clones = 0
+        self.traffic = [(pcap_path, None)]
+
+
+def generatePcap(path, packets, size):
+    # UDP packets (IPv4 with zero checksums) of given frame size
+    destination = bytes.fromhex("020000000002")
+    source = bytes.fromhex(MAC.replace(":", ""))
+    size = max(size, 42)
+    ip_header = bytes.fromhex("4500") + (size - 14).to_bytes(2, "big") + bytes.fromhex("000040004011") \
+        + bytes(2) + bytes([10, 0, 0, 1, 10, 0, 0, 2])
+    udp_header = (5000).to_bytes(2, "big") + (6000).to_bytes(2, "big") + (size - 34).to_bytes(2, "big") + bytes(2)
+    frame = destination + source + b"\x08\x00" + ip_header + udp_header + bytes(size - 42)
+    with pcapFile.PcapWriter(path) as writer:
+        for i in range(packets):
+            writer.write(i * 1000, frame)
+
+
+def createVethPair(intf, peer):
+    subprocess.run(["ip", "link", "add", intf, "type", "veth", "peer", "name", peer], check=True)
+    for name in (intf, peer):
+        subprocess.run(["ip", "link", "set", name, "mtu", "65535", "up"], check=True)
+
+
+def deleteVethPair(intf):
+    subprocess.run(["ip", "link", "del", intf], stderr=subprocess.DEVNULL)
+
+
+def rxPackets(intf):
+    with open("/sys/class/net/" + intf + "/statistics/rx_packets") as file:
+        return int(file.read())
+
+
+def runBackend(backend, intf, peer, pcap_path):
+    received = rxPackets(peer)
+    details = {}
+    start_time = time.time()
+    if backend == "tcpreplay":
+        result = subprocess.run([shutil.which("tcpreplay"), "--topspeed", "--intf1=" + intf, pcap_path],
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        rated = re.search(r"Rated: ([\d.]+) Bps, ([\d.]+) Mbps, ([\d.]+) pps", result.stdout)
+        if rated:  # rate measured by tcpreplay itself (without process start)
+            details = {"tcpreplay_mbps": float(rated.group(2)), "tcpreplay_pps": float(rated.group(3))}
+        errors = 0 if result.returncode == 0 else 1
+    else:
+        replayer = nativeReplay.NativeReplayer(BenchmarkScenario(intf, pcap_path), replayRate.ReplayRate("topspeed"),
+                                               loop=False, ring=backend == "ring", batch_size=1024)
+        replayer.start()
+        errors = replayer.statistics["errors"]
+    total_time = time.time() - start_time
+    time.sleep(0.1)  # let veth deliver queued packets
+    return total_time, rxPackets(peer) - received, errors, details
+
+
+def benchmark(packets, sizes, backends, intf, peer):
+    report = {
+        "commit": currentCommit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "kernel": os.uname().release,
+        "packets": packets,
+        "results": []
+    }
+    directory = tempfile.mkdtemp(prefix="replay_bench_")
+    try:
+        for size in sizes:
+            pcap_path = os.path.join(directory, str(size) + ".pcap")
+            generatePcap(pcap_path, packets, size)
+            for backend in backends:
+                entry = {"size": size, "backend": backend}
+                if backend == "tcpreplay" and shutil.which("tcpreplay") is None:
+                    entry["status"] = "skipped (tcpreplay not found)"
+                else:
+                    total_time, delivered, errors, details = runBackend(backend, intf, peer, pcap_path)
+                    entry.update({
+                        "status": "ok",
+                        "time": total_time,
+                        "delivered": delivered,
+                        "errors": errors,
+                        "pps": packets / total_time,
+                        "mbps": packets * size * 8 / total_time / 1e6
+                    })
+                    entry.update(details)
+                report["results"].append(entry)
+                print(formatEntry(entry))
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(directory)
+    return report
+
+
+def formatEntry(entry):
+    text = "%6d B  %-10s " % (entry["size"], entry["backend"])
+    if entry["status"] != "ok":
+        return text + entry["status"]
+    return text + "%12.0f pps %10.1f Mbps  %7.3f sec.  delivered: %d  errors: %d" % (
+        entry["pps"], entry["mbps"], entry["time"], entry["delivered"], entry["errors"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of replay backends on veth pair.")
+    parser.add_argument("--packets", type=int, default=100000, help="number of packets sent by every backend")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 512, 1500], help="frame sizes in bytes")
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, choices=BACKENDS)
+    parser.add_argument("--intf", default="rbench0", help="name of created veth interface (packets are sent to it)")
+    parser.add_argument("--output", default=os.path.join(tempfile.gettempdir(), "replay_bench.json"),
+                        help="path of JSON report (default - in temporary directory)")
+    args = parser.parse_args()
+
+    peer = args.intf + "p"
+    createVethPair(args.intf, peer)
+    try:
+        report = benchmark(args.packets, args.sizes, args.backends, args.intf, peer)
+    finally:
+        deleteVethPair(args.intf)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print("Report written to " + args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import numpy as np
+
+from tools import pcapFile
+
+MODES = ("multiplier", "pps", "mbps", "topspeed", "ramp")
+TOPSPEED_PPS = 1e6  # expected load of replay as fast as possible - about what one CPU sends
+
+
+class ReplayRate():
+    # Speed of replay:
+    #   "multiplier" - original timing, time between packets divided by value (2.0 - twice as fast)
+    #   "pps" - value packets per second, "mbps" - value Mbit/s (original timing is not kept)
+    #   "topspeed" - as fast as possible
+    #   "ramp" - multiplier changes linearly from start to end during duration seconds (then stays at end)
+    def __init__(self, mode="multiplier", value=1.0, start=1.0, end=1.0, duration=60.0):
+        if mode not in MODES:
+            raise ValueError("Unknown replay rate mode \"" + str(mode) + "\".")
+        if mode in ("multiplier", "pps", "mbps") and not value > 0:
+            raise ValueError("Replay rate (" + mode + ") must be positive.")
+        if mode == "ramp" and not (start > 0 and end > 0 and duration > 0):
+            raise ValueError("Multipliers and duration of replay rate ramp must be positive.")
+        self.mode = mode
+        self.value = float(value)
+        self.start = float(start)
+        self.end = float(end)
+        self.duration = float(duration)
+
+    def __str__(self):
+        if self.mode == "multiplier":
+            return "x%g" % self.value
+        if self.mode == "pps":
+            return "%g pps" % self.value
+        if self.mode == "mbps":
+            return "%g Mbit/s" % self.value
+        if self.mode == "ramp":
+            return "x%g -> x%g in %g s" % (self.start, self.end, self.duration)
+        return "topspeed"
+
+    def isTimeBased(self):  # send time depends only on original timestamps (not on number or size of packets sent before)
+        return self.mode in ("multiplier", "ramp", "topspeed")
+
+    def realOffset(self, capture_offset, packets_before, bytes_before):
+        # ns from start of replay when packet is sent - capture_offset: ns from start of capture,
+        # packets_before, bytes_before: packets and bytes sent before this packet (scalars or NumPy arrays)
+        if self.mode == "multiplier":
+            return capture_offset / self.value
+        if self.mode == "pps":
+            return packets_before * 1e9 / self.value
+        if self.mode == "mbps":
+            return bytes_before * 8000 / self.value  # bits / (Mbit/s * 10^6) * 10^9 ns
+        if self.mode == "topspeed":
+            return capture_offset * 0
+
+        # ramp - capture time replayed until time t is integral of multiplier m(t) = m0 + (m1 - m0) * t / D
+        duration = self.duration * 1e9
+        ramp_capture = (self.start + self.end) / 2 * duration  # capture time replayed during ramp
+        capture_offset = np.asarray(capture_offset, dtype=np.float64)
+        during = np.minimum(capture_offset, ramp_capture)
+        if self.start == self.end:
+            time = during / self.start
+        else:
+            a = (self.end - self.start) / (2 * duration)
+            time = (-self.start + np.sqrt(self.start ** 2 + 4 * a * during)) / (2 * a)
+        return np.where(capture_offset <= ramp_capture, time, duration + (capture_offset - ramp_capture) / self.end)
+
+    def multiplierAt(self, elapsed):  # multiplier after elapsed seconds of replay
+        if self.mode == "ramp":
+            return self.start + (self.end - self.start) * min(elapsed, self.duration) / self.duration
+        return self.value if self.mode == "multiplier" else 1.0
+
+    def expectedPps(self, packets, total_bytes, capture_seconds):
+        # packets per second replayed from capture of packets / total_bytes lasting capture_seconds
+        # (ramp - its highest multiplier, topspeed or capture with no duration - TOPSPEED_PPS)
+        if packets == 0:
+            return 0.0
+        if self.mode == "pps":
+            return self.value
+        if self.mode == "mbps":
+            return self.value * 1e6 / 8 / (total_bytes / packets)
+        if self.mode == "topspeed" or capture_seconds <= 0:
+            return TOPSPEED_PPS
+        return packets / capture_seconds * (max(self.start, self.end) if self.mode == "ramp" else self.value)
+
+    def tcpreplayArgs(self, elapsed=0.0):
+        # tcpreplay has no ramp - multiplier at elapsed seconds of replay is used for the whole run of tcpreplay
+        # (or timestamps of replayed file are changed by timeline() and no multiplier is needed)
+        if self.mode == "pps":
+            return ['--pps=%g' % self.value]
+        if self.mode == "mbps":
+            return ['--mbps=%g' % self.value]
+        if self.mode == "topspeed":
+            return ['--topspeed']
+        multiplier = self.multiplierAt(elapsed)
+        return ['--multiplier=%g' % multiplier] if multiplier != 1.0 else []
+
+    def timeline(self, offsets):  # new offsets (ns) of packets for pcapFile.retime() - replaying result at x1 is the ramp
+        return np.asarray(self.realOffset(offsets, 0, 0)).astype(np.int64)
+
+
+class Schedule():
+    # Planned send times of packets of one file looped by an external tool (tcpreplay) at rate - drift of the tool
+    # is estimated from its progress (packets sent after some seconds)
+    def __init__(self, path, rate):
+        with pcapFile.PcapFile(path) as pcap:
+            timestamps, offsets, lengths = pcap.index()
+        self.planned = None
+        if len(timestamps) and rate.mode != "topspeed":  # topspeed has no schedule
+            bytes_before = np.cumsum(lengths, dtype=np.int64) - lengths
+            self.planned = np.asarray(rate.realOffset(timestamps - timestamps[0],
+                                                      np.arange(len(timestamps), dtype=np.int64), bytes_before))
+            # next loop starts right after the last packet (tcpreplay has no gap between loops)
+            self.period = float(rate.realOffset(timestamps[-1] - timestamps[0], len(timestamps), int(lengths.sum())))
+
+    def drift(self, packets, seconds):  # ns the next packet is late after packets were sent in seconds (None - unknown)
+        if self.planned is None:
+            return None
+        loops, index = divmod(packets, len(self.planned))
+        return max(0.0, seconds * 1e9 - loops * self.period - float(self.planned[index]))
+
+
+def achievedRate(packets, bytes_sent, seconds):
+    if seconds <= 0:
+        return {"packets": packets, "bytes": bytes_sent, "seconds": seconds, "pps": 0.0, "mbps": 0.0}
+    return {"packets": packets, "bytes": bytes_sent, "seconds": seconds,
+            "pps": packets / seconds, "mbps": bytes_sent * 8 / seconds / 1e6}
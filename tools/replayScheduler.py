@@ -0,0 +1,204 @@
+import heapq
+import time
+
+import numpy as np
+
+from tools import pcapFile, nativeReplay, replayRate
+
+LATENESS_SAMPLES = 1 << 20  # lateness of last packets kept for percentiles
+
+
+class TimelineFile():
+    # One rewritten pcap of scenario in global timeline (packets ordered by original timestamps)
+    def __init__(self, path, socket_numbers, mac1, store=None):
+        self.pcap = store.open(path) if store is not None else pcapFile.PcapFile(path)
+        timestamps, offsets, lengths = self.pcap.index()
+        order = np.argsort(timestamps, kind="stable")  # captures are not always sorted
+        self.timestampArray = timestamps[order]
+        self.timestamps = self.timestampArray.tolist()
+        self.offsets = offsets[order].tolist()
+        self.ends = (offsets[order] + lengths[order]).tolist()
+        directions = nativeReplay.sendDirections(self.pcap, offsets, lengths, mac1)[order]
+        self.sockets = [socket_numbers[direction] for direction in directions.tolist()]
+        self.bytes = int(lengths.sum())
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def close(self):
+        self.pcap.close()
+
+
+class GlobalScheduler():
+    # Replays all scenarios on one timeline: packets of all files are merged by their original (absolute) timestamps
+    # with heap-based k-way merge and sent against one monotonic clock, so packets on different host pairs leave
+    # in the original order and with the original spacing (changed by rate - replayRate.ReplayRate, which applies
+    # to the whole timeline). Lateness (send time - planned time) of every packet is measured.
+    # Files are read from store (packetStore.PacketStore) if it is given.
+    def __init__(self, scenarios, rate=None, batch_size=64, batch_window=50000, loop=True, ring=False, store=None):
+        self.scenarios = scenarios
+        self.store = store
+        self.rate = rate if rate is not None else replayRate.ReplayRate()
+        self.batchSize = batch_size
+        self.batchWindow = batch_window
+        self.loop = loop
+        self.ring = ring
+        self._isRunning = False
+        self.statistics = {"packets": 0, "bytes": 0, "errors": 0}
+        self.latenessCount = 0
+        self.latenessSum = 0
+        self.latenessMax = 0
+        self.latenessSamples = np.zeros(LATENESS_SAMPLES, dtype=np.int64)
+        self.startTime = None  # monotonic ns when replay started
+        self.scheduled = [0, 0]  # packets and bytes given a send time (for rates in pps and Mbit/s)
+        self.sockets = []  # open sockets (errors are added to statistics when they are closed)
+
+    def isRunning(self):
+        return self._isRunning
+
+    def achievedRate(self):
+        if self.startTime is None:
+            return replayRate.achievedRate(0, 0, 0)
+        return replayRate.achievedRate(self.statistics["packets"], self.statistics["bytes"],
+                                       (time.monotonic_ns() - self.startTime) / 1e9)
+
+    def telemetry(self):  # achieved rate, drift (lateness of last packet against its planned time) and send errors
+        telemetry = self.achievedRate()
+        last = self.latenessSamples[(self.latenessCount - 1) % LATENESS_SAMPLES] if self.latenessCount else 0
+        telemetry.update(drift_ms=int(last) / 1e6, max_drift_ms=self.latenessMax / 1e6,
+                         errors=self.statistics["errors"] + sum(packet_socket.errors for packet_socket in self.sockets))
+        return telemetry
+
+    def start(self):
+        self._isRunning = True
+        sockets, files = self.__open()
+        self.sockets = sockets
+        try:
+            if not files:
+                return
+            start = min(timeline.timestamps[0] for timeline in files if len(timeline))
+            end = max(timeline.timestamps[-1] for timeline in files if len(timeline))
+            self.startTime = time.monotonic_ns()
+            capture = 0  # capture time (ns from start of timeline) of the first packet in the loop
+            while self._isRunning:
+                self.__replay(files, sockets, capture - start)
+                if not self.loop:
+                    break
+                capture += end - start + 1000000  # next loop starts 1 ms after last packet
+        finally:
+            self.sockets = []
+            for packet_socket in sockets:
+                self.statistics["errors"] += packet_socket.errors
+                packet_socket.close()
+            for timeline in files:
+                timeline.close()
+            self._isRunning = False
+
+    def __open(self):
+        # one socket per interface (interface can be used by several scenarios)
+        sockets = []
+        socket_numbers = {}
+        files = []
+        if self.ring:
+            max_length = nativeReplay.maxFrameLength(pcap for scenario in self.scenarios
+                                                     for pcap, cache in scenario.traffic)
+        for scenario in self.scenarios:
+            for intf in (scenario.intf1, scenario.intf2):
+                if intf not in socket_numbers:
+                    socket_numbers[intf] = len(sockets)
+                    if self.ring:
+                        sockets.append(nativeReplay.TxRing(intf, max_length))
+                    else:
+                        sockets.append(nativeReplay.PacketSocket(intf, self.batchSize))
+            mac1 = nativeReplay.scenarioMacs(scenario)
+            numbers = (socket_numbers[scenario.intf1], socket_numbers[scenario.intf2])
+            for pcap, cache in list(scenario.traffic):
+                timeline = TimelineFile(pcap, numbers, mac1, self.store)
+                if len(timeline):
+                    files.append(timeline)
+                else:
+                    timeline.close()
+        return sockets, files
+
+    def __replay(self, files, sockets, shift):
+        # shift - added to original timestamps gives capture time from start of replay
+        if self.rate.isTimeBased():  # send times of whole files at once
+            deadlines = [(self.startTime + np.asarray(self.rate.realOffset(timeline.timestampArray + shift, 0, 0))
+                          .astype(np.int64)).tolist() for timeline in files]
+        else:
+            deadlines = None
+
+        def deadlineOf(number, position):
+            if deadlines is not None:
+                return deadlines[number][position]
+            return self.startTime + int(self.rate.realOffset(0, self.scheduled[0], self.scheduled[1]))
+
+        # k-way merge - heap of (timestamp, file number, packet number) with the next packet of every file
+        heap = [(timeline.timestamps[0], number, 0) for number, timeline in enumerate(files)]
+        heapq.heapify(heap)
+        buffers = [memoryview(timeline.pcap.buffer) if self.ring else timeline.pcap.buffer for timeline in files]
+        try:
+            while heap and self._isRunning:
+                batch = []  # list of (deadline, socket number, frame)
+                first_deadline = deadlineOf(heap[0][1], heap[0][2])
+                while heap and len(batch) < self.batchSize:
+                    timestamp, number, position = heap[0]
+                    deadline = deadlineOf(number, position)
+                    if deadline - first_deadline > self.batchWindow:
+                        break
+                    timeline = files[number]
+                    batch.append((deadline, timeline.sockets[position],
+                                  buffers[number][timeline.offsets[position]:timeline.ends[position]]))
+                    self.scheduled[0] += 1
+                    self.scheduled[1] += timeline.ends[position] - timeline.offsets[position]
+                    if position + 1 < len(timeline):
+                        heapq.heapreplace(heap, (timeline.timestamps[position + 1], number, position + 1))
+                    else:
+                        heapq.heappop(heap)
+
+                if not nativeReplay.waitUntil(first_deadline, self.isRunning):
+                    break
+                self.__send(batch, sockets)
+                batch = None
+        finally:
+            if self.ring:
+                for buffer in buffers:
+                    buffer.release()
+
+    def __send(self, batch, sockets):
+        # consecutive packets for the same interface are sent together - global order is kept
+        start = 0
+        while start < len(batch):
+            socket_number = batch[start][1]
+            end = start + 1
+            while end < len(batch) and batch[end][1] == socket_number:
+                end += 1
+            frames = [frame for deadline, number, frame in batch[start:end]]
+            sent, sent_bytes = sockets[socket_number].send(frames)
+            self.statistics["packets"] += sent
+            self.statistics["bytes"] += sent_bytes
+            sent_time = time.monotonic_ns()
+            for deadline, number, frame in batch[start:end]:
+                self.__recordLateness(sent_time - deadline)
+            start = end
+
+    def __recordLateness(self, lateness):
+        self.latenessSamples[self.latenessCount % LATENESS_SAMPLES] = lateness
+        self.latenessCount += 1
+        self.latenessSum += lateness
+        self.latenessMax = max(self.latenessMax, lateness)
+
+    def getLateness(self):  # dict of lateness statistics in microseconds
+        packets = self.latenessCount
+        if packets == 0:
+            return {}
+        samples = self.latenessSamples[:min(packets, LATENESS_SAMPLES)]
+        return {
+            "mean_us": self.latenessSum / packets / 1000,
+            "max_us": self.latenessMax / 1000,
+            "p50_us": float(np.percentile(samples, 50)) / 1000,
+            "p99_us": float(np.percentile(samples, 99)) / 1000
+        }
+
+    def stop(self):
+        self._isRunning = False
@@ -0,0 +1,103 @@
+import os
+import csv
+import json
+import time
+import threading
+
+from PyQt5 import QtCore
+
+COLUMNS = ["time", "scenario", "intf1", "intf2", "rate", "packets", "bytes", "seconds", "pps", "mbps",
+           "interval_pps", "interval_mbps", "drift_ms", "max_drift_ms", "errors", "delivered", "delivered_ratio",
+           "delivered_host1", "delivered_host2",
+           "flows", "completed_flows", "completion_ratio", "flow_latency_ms"]
+
+
+def deliveredPackets(intf):
+    # Packets the switch sent to host through intf (switch end of link of host, root namespace) - i.e. packets
+    # the host received (veth reports packets received by its peer as its own tx_packets). None - no counter.
+    if intf is None:
+        return None
+    try:
+        with open(os.path.join("/sys/class/net", intf, "statistics", "tx_packets")) as file:
+            return int(file.read())
+    except (OSError, ValueError):
+        return None
+
+
+class ReplayTelemetry(QtCore.QThread):
+    # Samples telemetry of running replay (ReplayEngine.telemetry) every interval seconds, adds packets delivered
+    # to receiving hosts (delivered_host1, delivered_host2 - counted on switch ports facing them, so packets lost
+    # on the way through the network are missing) and rates in the last interval. Every sample (list of dicts with keys COLUMNS, one per
+    # scenario) is emitted by sampleSignal and appended to log - CSV if log_path ends with ".csv", JSON lines
+    # otherwise - flushed after every sample.
+    # Delivered packets of scenarios sharing a host are counted for each of them (counters are per interface)
+    # and include other traffic to the host (e.g. responses of live peers, ARP).
+    sampleSignal = QtCore.pyqtSignal(object)
+
+    def __init__(self, replay_engine, interval=1.0, log_path=None):
+        super(ReplayTelemetry, self).__init__()
+        self.replayEngine = replay_engine
+        self.interval = interval
+        self.logPath = log_path
+        self.stopped = threading.Event()
+        self.lastSample = []
+        # counters at start - delivered packets are counted from here
+        self.baseline = {intf: deliveredPackets(intf) for scenario in self.replayEngine.trafficScenarios
+                         for intf in (scenario.switchIntf1, scenario.switchIntf2) if intf is not None}
+
+    def run(self):
+        log = open(self.logPath, "a", newline="") if self.logPath else None
+        writer = None
+        if log is not None and self.logPath.endswith(".csv"):
+            writer = csv.DictWriter(log, COLUMNS)
+            if log.tell() == 0:
+                writer.writeheader()
+        previous = {}  # { scenario number : (seconds, packets, bytes) } of previous sample
+        try:
+            while True:
+                stopped = self.stopped.wait(self.interval)
+                self.lastSample = self.sample(previous)
+                self.sampleSignal.emit(self.lastSample)
+                if log is not None:
+                    for row in self.lastSample:
+                        if writer is not None:
+                            writer.writerow(row)
+                        else:
+                            log.write(json.dumps(row) + "\n")
+                    log.flush()
+                if stopped:
+                    break
+        finally:
+            if log is not None:
+                log.close()
+
+    def sample(self, previous):
+        now = time.time()
+        rows = []
+        for telemetry in self.replayEngine.telemetry():
+            row = {column: telemetry.get(column) for column in COLUMNS}
+            row["time"] = now
+
+            seconds, packets, sent_bytes = previous.get(row["scenario"], (0.0, 0, 0))
+            if row["seconds"] > seconds:
+                row["interval_pps"] = (row["packets"] - packets) / (row["seconds"] - seconds)
+                row["interval_mbps"] = (row["bytes"] - sent_bytes) * 8 / (row["seconds"] - seconds) / 1e6
+            else:  # new process (tcpreplay restarted) - no interval yet
+                row["interval_pps"] = row["interval_mbps"] = 0.0
+            previous[row["scenario"]] = (row["seconds"], row["packets"], row["bytes"])
+
+            # packets from host1 are delivered to host2 and the other way round - each direction separately
+            for column, intf in (("delivered_host1", telemetry.get("switch_intf1")),
+                                 ("delivered_host2", telemetry.get("switch_intf2"))):
+                counter = deliveredPackets(intf)
+                row[column] = counter - self.baseline.setdefault(intf, counter) if counter is not None else None
+            delivered = row["delivered_host1"] + row["delivered_host2"] \
+                if row["delivered_host1"] is not None and row["delivered_host2"] is not None else None
+            row["delivered"] = delivered
+            row["delivered_ratio"] = delivered / row["packets"] if delivered is not None and row["packets"] else None
+            rows.append(row)
+        return rows
+
+    def stop(self):  # last sample is taken before the thread ends
+        self.stopped.set()
+        self.wait()
@@ -0,0 +1,170 @@
+import os
+import time
+import tempfile
+import subprocess
+from subprocess import DEVNULL, PIPE
+from concurrent.futures import ThreadPoolExecutor
+
+from tools import topologyPaths
+
+FLOW_COOKIE = 0x7e57  # proactive flows of replay endpoints are removed by their cookie
+FLOW_PRIORITY = 100  # above reactive flows of controllers (e.g. Floodlight forwarding - 1)
+FLOW_BATCH = 1000  # flows added by one ovs-ofctl call
+PING_TIMEOUT = 1  # s - one ping while waiting for data plane
+
+
+def hostCommand(host, *args):  # command in namespaces of host (thread-safe, unlike host.cmd), returns CompletedProcess
+    return subprocess.run(["mnexec", "-a", str(host.pid)] + list(args), stdout=DEVNULL, stderr=PIPE,
+                          universal_newlines=True)
+
+
+def runParallel(function, groups, workers=None):  # function(key, items) for every group in parallel, returns results
+    if not groups:
+        return {}
+    with ThreadPoolExecutor(max_workers=workers or min(32, len(groups))) as executor:
+        futures = {key: executor.submit(function, key, items) for key, items in groups.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+
+def primeArp(host_pairs, workers=None):
+    # Static ARP entries of the other host on both hosts of every pair - the first packets are not delayed by ARP
+    # and controller does not see ARP broadcasts. Entries of one host are added one after another, hosts in parallel.
+    # Entries stay until removeArp - returns dict { host : list of (ip, dev) } of added entries, raises RuntimeError
+    # if some could not be added (entries added before are removed).
+    entries = {}  # { host : set of (ip, mac) }
+    for host1, host2 in host_pairs:
+        entries.setdefault(host1, set()).add((host2.IP(), host2.MAC()))
+        entries.setdefault(host2, set()).add((host1.IP(), host1.MAC()))
+
+    def prime(host, host_entries):
+        added = []
+        failures = []
+        dev = host.defaultIntf().name
+        for ip, mac in sorted(host_entries):
+            result = hostCommand(host, "ip", "neigh", "replace", ip, "lladdr", mac, "dev", dev, "nud", "permanent")
+            if result.returncode != 0:
+                failures.append(ip + " (" + result.stderr.strip() + ")")
+            else:
+                added.append((ip, dev))
+        return added, failures
+
+    results = runParallel(prime, entries, workers)
+    added = {host: host_added for host, (host_added, host_failures) in results.items() if host_added}
+    failed = [host.name + ": " + ", ".join(host_failures) for host, (host_added, host_failures) in results.items()
+              if host_failures]
+    if failed:
+        removeArp(added, workers)
+        raise RuntimeError("ARP entries could not be added - " + "; ".join(failed))
+    return added
+
+
+def removeArp(entries, workers=None):  # static ARP entries added by primeArp are removed (dict { host : [(ip, dev)] })
+    def remove(host, host_entries):
+        for ip, dev in host_entries:
+            hostCommand(host, "ip", "neigh", "del", ip, "dev", dev)
+
+    runParallel(remove, entries, workers)
+
+
+def pathFlows(network, graph, host1, host2):
+    # dict { switch : list of flows } forwarding IPv4 packets between hosts (both directions) along the shortest path
+    # of topology (topologyPaths.shortestPath - the same one as chosen by shortest path routing of controller)
+    path = topologyPaths.shortestPath(graph, host1.name, host2.name)
+    if path is None:
+        raise RuntimeError("no path between " + host1.name + " and " + host2.name)
+    switches = {switch.name for switch in network.switches}
+    flows = {}
+    for nodes, source, destination in ((path, host1, host2), (path[::-1], host2, host1)):
+        for name, next_name in zip(nodes[1:-1], nodes[2:]):
+            if name not in switches:
+                continue
+            switch = network.getNodeByName(name)
+            switch_intf, next_intf = switch.connectionsTo(network.getNodeByName(next_name))[0]
+            flows.setdefault(switch, []).append(
+                "cookie=%#x,priority=%d,ip,nw_src=%s,nw_dst=%s,actions=output:%d"
+                % (FLOW_COOKIE, FLOW_PRIORITY, source.IP(), destination.IP(), switch.ports[switch_intf]))
+    return flows
+
+
+def ofctl(switch, *args):  # ovs-ofctl with OpenFlow version of switch (if it is restricted)
+    protocols = getattr(switch, "protocols", None)
+    version = ["-O", protocols] if protocols else []
+    return subprocess.run(["ovs-ofctl"] + version + list(args), stdout=DEVNULL, stderr=PIPE, universal_newlines=True)
+
+
+def installFlows(network, host_pairs, workers=None):
+    # Proactive flows of all pairs added through ovs-ofctl add-flows in batches of FLOW_BATCH flows (one file per
+    # batch), switches in parallel. Returns dict { switch : number of flows }, raises RuntimeError on failure.
+    graph = topologyPaths.linkGraph([network])
+    flows = {}
+    for host1, host2 in host_pairs:
+        for switch, switch_flows in pathFlows(network, graph, host1, host2).items():
+            flows.setdefault(switch, [])
+            flows[switch] += [flow for flow in switch_flows if flow not in flows[switch]]
+
+    def install(switch, switch_flows):
+        for start in range(0, len(switch_flows), FLOW_BATCH):
+            with tempfile.NamedTemporaryFile("w", suffix=".flows", delete=False) as file:
+                file.write("\n".join(switch_flows[start:start + FLOW_BATCH]) + "\n")
+            try:
+                result = ofctl(switch, "add-flows", switch.name, file.name)
+            finally:
+                os.remove(file.name)
+            if result.returncode != 0:
+                return result.stderr.strip()
+        return None
+
+    failures = {switch: failure for switch, failure in runParallel(install, flows, workers).items() if failure}
+    if failures:
+        raise RuntimeError("flows could not be added - " + "; ".join(switch.name + ": " + failure
+                                                                       for switch, failure in failures.items()))
+    return {switch: len(switch_flows) for switch, switch_flows in flows.items()}
+
+
+def removeFlows(switches):  # proactive flows of replay (by cookie) are removed from switches
+    for switch in switches:
+        ofctl(switch, "del-flows", switch.name, "cookie=%#x/-1" % FLOW_COOKIE)
+
+
+def waitReady(host_pairs, timeout, workers=None):
+    # Every pair pings until the first answer (at most timeout seconds) - answer means ARP, flows (proactive or
+    # installed by controller after packet-in) and both directions work. Returns dict { (host1, host2) : seconds
+    # until the first answer, None - no answer }.
+    deadline = time.monotonic() + timeout
+    start = time.monotonic()
+
+    def ping(pair, unused):
+        host1, host2 = pair
+        while True:
+            if hostCommand(host1, "ping", "-c", "1", "-W", str(PING_TIMEOUT), host2.IP()).returncode == 0:
+                return time.monotonic() - start
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.05)
+
+    return runParallel(ping, {pair: None for pair in host_pairs}, workers)
+
+
+def warmUp(network, host_pairs, proactive_flows=False, timeout=5.0, workers=None):
+    # ARP priming, optional proactive flows and waiting for data plane of host pairs (list of tuples of hosts).
+    # Returns dict (seconds - whole warm-up, arp_seconds, flows_seconds, ready_seconds - its phases, arp - dict
+    # { host : list of (ip, dev) } of static ARP entries, arp_entries - their number, flows - dict { switch : number
+    # of flows }, ready - number of pairs with working data plane, pairs, slowest - seconds until the slowest pair
+    # answered).
+    host_pairs = list(dict.fromkeys(host_pairs))
+    report = {"pairs": len(host_pairs), "flows": {}, "flows_seconds": 0.0}
+    start = time.monotonic()
+    report["arp"] = primeArp(host_pairs, workers)
+    report["arp_entries"] = sum(len(entries) for entries in report["arp"].values())
+    report["arp_seconds"] = time.monotonic() - start
+    if proactive_flows:
+        phase = time.monotonic()
+        report["flows"] = installFlows(network, host_pairs, workers)
+        report["flows_seconds"] = time.monotonic() - phase
+    phase = time.monotonic()
+    answers = waitReady(host_pairs, timeout, workers)
+    report["ready_seconds"] = time.monotonic() - phase
+    report["ready"] = sum(seconds is not None for seconds in answers.values())
+    report["slowest"] = max((seconds for seconds in answers.values() if seconds is not None), default=None)
+    report["seconds"] = time.monotonic() - start
+    return report
@@ -0,0 +1,245 @@
+import os
+import heapq
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from tools import pcapFile
+
+REALTIME_PRIORITY = 50  # SCHED_FIFO priority of workers - above ordinary processes, below kernel threads (99)
+
+
+def expectedLoad(scenario, rate):
+    # expected packets per second of scenario replayed at rate (replayRate.ReplayRate) - from summaries of files
+    # collected while they were prepared (ReplayScenario.summaries), amplified files have clones times more packets
+    # and last longer by clones * cloneOffset
+    packets = 0
+    total_bytes = 0
+    seconds = 0.0
+    for path, cache_path in scenario.prepared:
+        if path not in scenario.summaries:
+            scenario.summaries[path] = pcapFile.summary(path)
+        file_packets, file_bytes, file_seconds = scenario.summaries[path]
+        packets += file_packets * (scenario.clones + 1)
+        total_bytes += file_bytes * (scenario.clones + 1)
+        seconds += file_seconds + scenario.clones * scenario.cloneOffset / 1e9
+    return rate.expectedPps(packets, total_bytes, seconds)
+
+
+def scenarioKey(scenario):  # scenarios are identified in workers by their replay interfaces
+    return scenario.intf1, scenario.intf2
+
+
+def describeScenario(scenario):  # picklable description from which worker rebuilds replay.ReplayScenario
+    return (scenario.intf1, scenario.ip1, scenario.mac1, scenario.intf2, scenario.ip2, scenario.mac2,
+            scenario.rewriter, scenario.mtu, list(scenario.traffic), scenario.switchIntf1, scenario.switchIntf2,
+            scenario.clones)
+
+
+def updateScenario(scenarios, description, replay):
+    # scenario of worker (created if it is new) updated from description - returns it
+    key = description[0], description[3]
+    if key not in scenarios:
+        scenarios[key] = replay.ReplayScenario(*description[:6], rewriter=description[6], mtu=description[7])
+    scenario = scenarios[key]
+    scenario.traffic = description[8]
+    scenario.switchIntf1, scenario.switchIntf2, scenario.clones = description[9:]
+    return scenario
+
+
+def workerMain(connection, cpus, realtime, priority, store_bytes):
+    # Main function of worker process - sets its CPU affinity and scheduling policy (inherited by threads and
+    # tcpreplay processes started later), sends its status and then executes commands of ReplayWorker until "close".
+    status = {"pid": os.getpid(), "cpus": sorted(cpus), "realtime": False, "error": None}
+    try:
+        os.sched_setaffinity(0, cpus)
+    except OSError as e:
+        status["error"] = "CPU affinity not set: " + str(e)
+    if realtime:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+            status["realtime"] = True
+        except (OSError, AttributeError) as e:  # no CAP_SYS_NICE or no SCHED_FIFO on platform
+            status["error"] = "SCHED_FIFO not set: " + str(e)
+
+    from tools import replay, packetStore  # imported after affinity is set - not needed by parent at all
+    supervisor = replay.ReplaySupervisor(packetStore.PacketStore(store_bytes))
+    scenarios = {}  # { scenario key : replay.ReplayScenario }
+    connection.send(("ok", status))
+
+    while True:
+        command, *args = connection.recv()
+        try:
+            result = None
+            if command == "start":
+                descriptions, mode, rates, global_rate = args
+                started = [updateScenario(scenarios, description, replay) for description in descriptions]
+                supervisor.start(started, mode, {scenario: rates[scenarioKey(scenario)] for scenario in started},
+                                 global_rate)
+            elif command == "changed":
+                supervisor.scenarioChanged(updateScenario(scenarios, args[0], replay))
+            elif command == "telemetry":
+                result = {scenarioKey(scenario): telemetry for scenario, telemetry in supervisor.telemetry().items()}
+            elif command == "stop":
+                supervisor.stop()
+            elif command == "close":
+                supervisor.close()
+                connection.send(("ok", None))
+                break
+            connection.send(("ok", result))
+        except Exception:
+            connection.send(("error", traceback.format_exc()))
+
+
+class ReplayWorker():
+    # Parent side of one worker process - commands are sent through pipe and answered one at a time
+    # (lock - GUI and telemetry thread use worker at the same time).
+    def __init__(self, number, cpus, realtime, priority, store_bytes, context):
+        self.number = number
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=workerMain, name="replay worker " + str(number), daemon=True,
+                                       args=(child_connection, set(cpus), realtime, priority, store_bytes))
+        self.process.start()
+        child_connection.close()
+        self.lock = threading.Lock()
+        self.status = None  # dict (pid, cpus, realtime, error) sent by worker after start
+        self.scenarios = {}  # { scenario : expected pps } replayed by worker
+        self.replaysGlobal = False  # worker replays "global" timeline (no other scenarios can be added to it)
+
+    def waitReady(self):
+        self.status = self.__receive()
+
+    def request(self, *command):
+        with self.lock:
+            try:
+                self.connection.send(command)
+            except OSError as e:
+                raise RuntimeError("replay worker " + str(self.number) + " is not running (" + str(e) + ")")
+            return self.__receive()
+
+    def __receive(self):
+        try:
+            result, value = self.connection.recv()
+        except EOFError:
+            raise RuntimeError("replay worker " + str(self.number) + " ended unexpectedly (exit code "
+                               + str(self.process.exitcode) + ")")
+        if result == "error":
+            raise RuntimeError("replay worker " + str(self.number) + " failed:\n" + value)
+        return value
+
+    def load(self):
+        return sum(self.scenarios.values())
+
+    def close(self):
+        if self.process.is_alive():
+            try:
+                self.request("close")
+            except RuntimeError:
+                pass
+            self.process.join(5)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+        self.connection.close()
+
+
+class ReplayWorkerPool():
+    # Replay of scenarios in separate processes instead of threads of GUI process - every worker is pinned to its
+    # CPUs (cpus - list with CPU number or set of CPU numbers of every worker, default - one worker for every CPU
+    # available except the first one, left to GUI, Open vSwitch and controller) and optionally runs with SCHED_FIFO
+    # policy (realtime, needs root). Has the same interface as replay.ReplaySupervisor, which runs in every worker.
+    # Scenarios are spread across workers by expected load (packets per second, see expectedLoad) - every scenario
+    # goes to the least loaded worker, largest scenarios first. Workers are started with first replay and kept.
+    def __init__(self, cpus=None, realtime=False, priority=REALTIME_PRIORITY, store_bytes=1024 ** 3):
+        if cpus is None:
+            available = sorted(os.sched_getaffinity(0))
+            cpus = available[1:] if len(available) > 1 else available
+        self.cpus = [{cpu} if isinstance(cpu, int) else set(cpu) for cpu in cpus]
+        if not self.cpus or not all(self.cpus):
+            raise ValueError("Every replay worker needs at least one CPU.")
+        self.realtime = realtime
+        self.priority = priority
+        self.storeBytes = store_bytes  # memory of packet stores (tools/packetStore.py), split between workers
+        self.context = multiprocessing.get_context("spawn")  # forked copy of GUI process (Qt, threads) is unsafe
+        self.workers = []
+
+    def __ensureWorkers(self, count):  # starts workers (in parallel) until there are count of them (at most one per CPU set)
+        count = min(count, len(self.cpus))
+        started = [ReplayWorker(number, self.cpus[number - 1], self.realtime, self.priority,
+                                self.storeBytes // len(self.cpus), self.context)
+                   for number in range(len(self.workers) + 1, count + 1)]
+        for worker in started:
+            worker.waitReady()
+        self.workers += started
+
+    def start(self, scenarios, mode, rates, global_rate):
+        # rates - dict { scenario : replayRate.ReplayRate }, global_rate - rate of "global" mode timeline
+        # (all scenarios of "global" mode go to one worker - they share one timeline)
+        running = {scenario for worker in self.workers for scenario in worker.scenarios}
+        scenarios = [scenario for scenario in scenarios if scenario not in running]
+        if not scenarios:
+            return
+        global_workers = sum(worker.replaysGlobal for worker in self.workers)
+        self.__ensureWorkers(1 if mode == "global" else global_workers + len(running) + len(scenarios))
+        if mode != "global" and all(worker.replaysGlobal for worker in self.workers):
+            raise RuntimeError("No replay worker is free - all " + str(len(self.workers)) + " of them replay \"global\" "
+                               "timeline (stop it or give the pool more CPUs).")
+
+        loads = {scenario: expectedLoad(scenario, global_rate if mode == "global" else rates[scenario])
+                 for scenario in scenarios}
+        assigned = {worker: [] for worker in self.workers}
+        if mode == "global":
+            worker = next((worker for worker in self.workers if worker.replaysGlobal), None) or \
+                min(self.workers, key=ReplayWorker.load)
+            worker.replaysGlobal = True
+            assigned[worker] = scenarios
+        else:
+            # heap of (load, worker number) - ties go to worker with lower number
+            heap = [(worker.load(), worker.number) for worker in self.workers if not worker.replaysGlobal]
+            heapq.heapify(heap)
+            for scenario in sorted(scenarios, key=loads.get, reverse=True):
+                load, number = heapq.heappop(heap)
+                assigned[self.workers[number - 1]].append(scenario)
+                heapq.heappush(heap, (load + loads[scenario], number))
+
+        for worker, chosen in assigned.items():
+            if chosen:
+                worker.request("start", [describeScenario(scenario) for scenario in chosen], mode,
+                               {scenarioKey(scenario): rates.get(scenario, global_rate) for scenario in chosen},
+                               global_rate)
+                worker.scenarios.update((scenario, loads[scenario]) for scenario in chosen)
+
+    def layout(self):
+        # list of dicts (worker - number, pid, cpus, realtime - True if SCHED_FIFO is set, error - why affinity or
+        # SCHED_FIFO could not be set, scenarios - list of scenarios replayed by worker, pps - their expected load)
+        return [dict(worker.status, worker=worker.number, scenarios=list(worker.scenarios), pps=worker.load())
+                for worker in self.workers]
+
+    def telemetry(self):  # dict { scenario : dict } - see replay.ReplaySupervisor.telemetry
+        telemetry = {}
+        for worker in self.workers:
+            if worker.scenarios:
+                values = worker.request("telemetry")
+                telemetry.update((scenario, values[scenarioKey(scenario)]) for scenario in worker.scenarios
+                                 if scenarioKey(scenario) in values)
+        return telemetry
+
+    def scenarioChanged(self, scenario):  # files of scenario changed - its replay is restarted by its worker
+        for worker in self.workers:
+            if scenario in worker.scenarios:
+                worker.request("changed", describeScenario(scenario))
+
+    def stop(self):  # workers stop their replay in parallel
+        busy = [worker for worker in self.workers if worker.scenarios]
+        if busy:
+            with ThreadPoolExecutor(max_workers=len(busy)) as executor:
+                list(executor.map(lambda worker: worker.request("stop"), busy))
+        for worker in busy:
+            worker.scenarios.clear()
+            worker.replaysGlobal = False
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+        self.workers = []
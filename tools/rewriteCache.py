@@ -0,0 +1,137 @@
+import os
+import hashlib
+import tempfile
+import threading
+
+DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), "testbed_rewrite_cache")
+
+
+class RewriteCache():
+    # Content-addressed cache of prepared traffic (tcpprep caches and rewritten pcaps) in one directory:
+    #   <hash of input>.cache                           - tcpprep output, depends only on content of input file
+    #   <hash of input, endpoints and MAC pairs>.pcap   - tcprewrite output for one host pair
+    #   <hash of rewritten file and amplification>.pcap/.cache - rewritten traffic with its clones (amplifyPaths)
+    # so repeated experiments skip preparation and one file can be rewritten for several host pairs at once.
+    # Total size is limited, least recently used files (by modification time) are removed first.
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=4 * 1024 ** 3):
+        self.directory = directory
+        self.maxBytes = max_bytes
+        self.hashes = {}  # { (path, size, mtime) : sha256 of content }  <- files are hashed once per run
+        self.pinned = set()  # paths of files stored or found during this run (until unpinAll) - never evicted
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def contentHash(self, path):
+        status = os.stat(path)
+        identity = (os.path.abspath(path), status.st_size, status.st_mtime_ns)
+        with self.lock:
+            if identity in self.hashes:
+                return self.hashes[identity]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        with self.lock:
+            self.hashes[identity] = digest.hexdigest()
+        return self.hashes[identity]
+
+    # variant - tool which prepares the file ("tcpprep"/"tcprewrite" or "native"), outputs of tools differ
+    def prepPath(self, original_path, variant="tcpprep"):
+        if variant == "tcpprep":
+            return os.path.join(self.directory, self.contentHash(original_path) + ".cache")
+        digest = hashlib.sha256()
+        digest.update(self.contentHash(original_path).encode())
+        digest.update(variant.encode())
+        return os.path.join(self.directory, digest.hexdigest() + ".cache")
+
+    def rewritePath(self, original_path, ip1, ip2, mac1, mac2, variant="tcprewrite"):
+        digest = hashlib.sha256()
+        digest.update(self.contentHash(original_path).encode())
+        digest.update(repr((ip1, ip2, mac1.lower(), mac2.lower())).encode())
+        if variant != "tcprewrite":
+            digest.update(variant.encode())
+        return os.path.join(self.directory, digest.hexdigest() + ".pcap")
+
+    def amplifyPaths(self, rewritten_path, variant):
+        # (pcap_path, cache_path) of rewritten file amplified by clones (variant - parameters of amplification)
+        digest = hashlib.sha256()
+        digest.update(self.contentHash(rewritten_path).encode())
+        digest.update(("amplify " + variant).encode())
+        stem = os.path.join(self.directory, digest.hexdigest())
+        return stem + ".pcap", stem + ".cache"
+
+    def lookup(self, path):  # True if file is cached (marks it as recently used and pins it)
+        try:
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return False
+        with self.lock:
+            self.hits += 1
+            self.pinned.add(path)
+        return True
+
+    def temporaryPath(self, path):  # output is written here first and moved by store() - readers never see partial file
+        name, extension = os.path.splitext(path)
+        return name + ".tmp" + str(threading.get_ident()) + extension
+
+    def pin(self, path):
+        with self.lock:
+            self.pinned.add(path)
+
+    def unpinAll(self):  # end of run - files of its scenarios can be evicted again
+        with self.lock:
+            self.pinned.clear()
+        self.evict()
+
+    def store(self, temporary_path, path):
+        # pinned before eviction - outputs of earlier jobs of the same run (e.g. tcpprep cache still needed by
+        # tcprewrite) are not evicted while later jobs store theirs, even if the run exceeds maxBytes
+        self.pin(path)
+        os.replace(temporary_path, path)
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        with self.lock:
+            files = []
+            for name in os.listdir(self.directory):
+                if not self.isEntry(name):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    status = os.stat(path)
+                except OSError:
+                    continue
+                files.append((status.st_mtime, status.st_size, path))
+
+            total = sum(size for mtime, size, path in files)
+            for mtime, size, path in sorted(files):
+                if total <= self.maxBytes:
+                    break
+                if path == keep or path in self.pinned:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    @staticmethod
+    def isEntry(name):  # "<sha256>.pcap" or "<sha256>.cache" (other files in directory are not managed by cache)
+        key, extension = os.path.splitext(name)
+        return extension in (".pcap", ".cache") and len(key) == 64 and all(c in "0123456789abcdef" for c in key)
+
+    def clear(self):
+        with self.lock:
+            for name in os.listdir(self.directory):
+                if not self.isEntry(name) or os.path.join(self.directory, name) in self.pinned:
+                    continue
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+            self.hashes.clear()
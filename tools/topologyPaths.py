@@ -0,0 +1,77 @@
+import heapq
+
+
+def parseDelay(delay):  # TCLink delay ("10ms", "500us", "1s" or number of ms) -> ms
+    if delay is None:
+        return 0.0
+    if isinstance(delay, (int, float)):
+        return float(delay)
+    delay = str(delay).strip()
+    for unit, factor in (("ms", 1.0), ("us", 0.001), ("s", 1000.0)):
+        if delay.endswith(unit):
+            return float(delay[:-len(unit)]) * factor
+    return float(delay)
+
+
+def linkParameters(link):  # (bandwidth in Mbit/s or None if not limited, delay in ms)
+    bandwidths = []
+    delay = 0.0
+    for intf in (link.intf1, link.intf2):
+        params = getattr(intf, "params", {}) or {}
+        if params.get("bw") is not None:
+            bandwidths.append(float(params["bw"]))
+        delay = max(delay, parseDelay(params.get("delay")))  # TCLink sets the same delay on both interfaces
+    return (min(bandwidths) if bandwidths else None), delay
+
+
+def linkGraph(networks):  # dict { node name : list of (neighbour name, bandwidth, delay) }
+    graph = {}
+    for network in networks:
+        for link in network.links:
+            node1 = link.intf1.node.name
+            node2 = link.intf2.node.name
+            bandwidth, delay = linkParameters(link)
+            graph.setdefault(node1, []).append((node2, bandwidth, delay))
+            graph.setdefault(node2, []).append((node1, bandwidth, delay))
+    return graph
+
+
+def shortestPath(graph, source, destination):
+    # Dijkstra on (number of hops, delay) - the same path as chosen by shortest path routing of controller
+    queue = [(0, 0.0, source, [source])]
+    visited = set()
+    while queue:
+        hops, delay, node, path = heapq.heappop(queue)
+        if node == destination:
+            return path
+        if node in visited:
+            continue
+        visited.add(node)
+        for neighbour, bandwidth, link_delay in graph.get(node, []):
+            if neighbour not in visited:
+                heapq.heappush(queue, (hops + 1, delay + link_delay, neighbour, path + [neighbour]))
+    return None
+
+
+def pathCapacity(graph, host1, host2):
+    path = shortestPath(graph, host1, host2)
+    capacity = {"bandwidth": None, "delay": 0.0, "path": path}  # bandwidth None - not limited (or path not found)
+    if path is None:
+        return capacity
+
+    for node1, node2 in zip(path, path[1:]):
+        links = [(bandwidth, delay) for neighbour, bandwidth, delay in graph[node1] if neighbour == node2]
+        bandwidths = [bandwidth for bandwidth, delay in links if bandwidth is not None]
+        bandwidth = max(bandwidths) if bandwidths else None  # parallel links - best one
+        delay = min(delay for bandwidth, delay in links)
+        if bandwidth is not None and (capacity["bandwidth"] is None or bandwidth < capacity["bandwidth"]):
+            capacity["bandwidth"] = bandwidth
+        capacity["delay"] += delay
+    return capacity
+
+
+def pathCapacities(networks, hostPairs):
+    # hostPairs - dict { number : (host1, host2) }
+    # returns dict { number : {"bandwidth": Mbit/s (bottleneck) or None, "delay": ms, "path": list of node names} }
+    graph = linkGraph(networks)
+    return {number: pathCapacity(graph, host1, host2) for number, (host1, host2) in hostPairs.items()}
@@ -1,5 +1,6 @@
 import os
 import re
+import tempfile
 
 from PyQt5 import QtWidgets, QtCore, QtGui
 from mininet.node import Docker
@@ -7,7 +8,7 @@ from mininet.term import makeTerms
 from mininet.log import output
 from subprocess import Popen, PIPE
 
-from tools import replay
+from tools import replay, replayTelemetry, replayWorkers, messages
 from windows import ManagerWindowUi
 
 
@@ -30,6 +31,11 @@ class ManagerWindow(QtWidgets.QMainWindow):
 
         self.replayData = None
         self.replayEngine = replay.ReplayEngine(self.network)
+        self.preparationThread = None
+        self.telemetry = None
+        self.telemetryLogPath = os.path.join(tempfile.gettempdir(), "replay_telemetry.jsonl")
+        self.warmUpThread = None
+        self.warmupReport = None  # report of warm-up before the running replay (None - replay started without it)
 
         self.terminalPalette = self.__prepareTerminalPalette()
 
@@ -64,6 +70,9 @@ class ManagerWindow(QtWidgets.QMainWindow):
         self.ui.actionPrepare.triggered.connect(self.prepareReplay)
         self.ui.actionStart.triggered.connect(self.startReplay)
         self.ui.actionStop.triggered.connect(self.stopReplay)
+        # optional warm-up (ARP priming and readiness pings, proactive flows - otherwise controller installs them)
+        self.ui.actionWarmUp.toggled.connect(self.ui.actionProactiveFlows.setEnabled)
+        self.ui.actionWorkers.toggled.connect(self.useReplayWorkers)
         self.ui.actionStart.setEnabled(False)
         self.ui.actionStop.setEnabled(False)
 
@@ -188,30 +197,120 @@ class ManagerWindow(QtWidgets.QMainWindow):
                       stdout=PIPE, stderr=PIPE)
 
     def updateReplayData(self, replayData):
-        self.setEnabled(False)
-        self.repaint()
+        # files are prepared in background (window stays responsive), only replay actions are disabled
         self.replayData = replayData
-        for scenario in replayData:
-            self.replayEngine.prepare(scenario.pcapPath, scenario.hostPair[0], scenario.hostPair[1])
-        self.setEnabled(True)
-        self.ui.actionStart.setEnabled(True)
+        self.ui.actionPrepare.setEnabled(False)
+        self.ui.actionStart.setEnabled(False)
+        self.ui.actionWorkers.setEnabled(False)
+        self.ui.statusbar.showMessage("Preparing replay: 0/" + str(len(replayData)) + " files")
+        self.preparationThread = PreparationThread(self.replayEngine, replayData)
+        self.preparationThread.progressSignal.connect(self.preparationProgress)
+        self.preparationThread.resultsSignal.connect(self.preparationFinished)
+        self.preparationThread.start()
+
+    def preparationProgress(self, done, total, path, error):
+        text = "Preparing replay: " + str(done) + "/" + str(total) + " files"
+        if error is not None:
+            text += " (failed: " + os.path.basename(path) + ")"
+        self.ui.statusbar.showMessage(text)
+
+    def preparationFinished(self, failures):
+        self.ui.actionPrepare.setEnabled(True)
+        self.ui.actionStart.setEnabled(len(failures) < len(self.replayData))
+        self.ui.actionWorkers.setEnabled(True)
+        self.ui.statusbar.showMessage("Replay prepared: " + str(len(self.replayData) - len(failures)) + "/"
+                                      + str(len(self.replayData)) + " files", 10000)
+        if failures:
+            messages.warning(str(len(failures)) + " of " + str(len(self.replayData)) + " files could not be prepared.",
+                             "\n".join(path + ": " + error for path, error in failures.items()))
 
     def prepareReplay(self):
         self.prepareReplaySignal.emit(self.network)
 
     def startReplay(self):
+        self.warmupReport = None
+        self.ui.actionWorkers.setEnabled(False)  # replay stays where it started until it is stopped
+        if not self.ui.actionWarmUp.isChecked():
+            self.beginReplay()
+            return
+        # warm-up in background (window stays responsive), before telemetry - warm-up is not counted into replay
+        self.ui.actionPrepare.setEnabled(False)
+        self.ui.actionStart.setEnabled(False)
+        self.ui.statusbar.showMessage("Warming up replay...")
+        self.warmUpThread = WarmUpThread(self.replayEngine, self.ui.actionProactiveFlows.isChecked())
+        self.warmUpThread.resultsSignal.connect(self.warmUpFinished)
+        self.warmUpThread.start()
+
+    def warmUpFinished(self, report, error):
+        self.warmUpThread = None
+        self.ui.actionPrepare.setEnabled(True)
+        if error is not None:
+            messages.warning("Replay warm-up failed, replay starts without it.", error)
+        self.warmupReport = report
+        self.beginReplay()
+
+    def beginReplay(self):
         self.setEnabled(False)
+        self.telemetry = replayTelemetry.ReplayTelemetry(self.replayEngine, log_path=self.telemetryLogPath)
+        self.telemetry.sampleSignal.connect(self.telemetryUpdated)
         self.replayEngine.start()
+        self.telemetry.start()
+        self.workerLayoutDump()
         self.setEnabled(True)
         self.ui.actionStart.setEnabled(False)
         self.ui.actionStop.setEnabled(True)
 
+    def useReplayWorkers(self, checked):
+        # scenarios are replayed by worker processes pinned to CPUs (GUI process only supervises them)
+        # or by threads of GUI process
+        self.replayEngine.useWorkers(replayWorkers.ReplayWorkerPool() if checked else None)
+
+    def workerLayoutDump(self):
+        layout = self.replayEngine.workerLayout()
+        if not layout:
+            return
+        output("*** REPLAY WORKERS\n")
+        for worker in layout:
+            output("   *  Worker " + str(worker["worker"]) + " | PID: " + str(worker["pid"]) + " | CPU: "
+                   + ",".join(str(cpu) for cpu in worker["cpus"]) + (" | SCHED_FIFO" if worker["realtime"] else "")
+                   + " | Scenarios: " + (", ".join(str(number) for number in worker["scenarios"]) or "-")
+                   + " | Expected: %.0f pps" % worker["pps"]
+                   + (" | " + worker["error"] if worker["error"] else "") + "\n")
+
+    def telemetryUpdated(self, sample):
+        if not sample:
+            return
+        delivered = [row["delivered"] for row in sample]
+        text = "Replay: %.0f pps, %.2f Mbit/s, drift %.2f ms, errors %d" % (
+            sum(row["interval_pps"] for row in sample), sum(row["interval_mbps"] for row in sample),
+            max(row["drift_ms"] for row in sample), sum(row["errors"] for row in sample))
+        if None not in delivered and sum(row["packets"] for row in sample):
+            text += ", delivered %.1f %%" % (100 * sum(delivered) / sum(row["packets"] for row in sample))
+        self.ui.statusbar.showMessage(text)
+
+    def stopTelemetry(self):  # returns last sample
+        if self.telemetry is None:
+            return []
+        self.telemetry.sampleSignal.disconnect()
+        self.telemetry.stop()
+        sample = self.telemetry.lastSample
+        self.telemetry = None
+        return sample
+
     def stopReplay(self):
         self.setEnabled(False)
+        sample = self.stopTelemetry()
+        report = self.warmupReport
+        if sample:
+            self.ui.statusbar.showMessage("Replay stopped" + (", warm-up %.2f s (%d/%d pairs ready)" % (
+                report["seconds"], report["ready"], report["pairs"]) if report else "") + ", achieved rates: " + "; ".join(
+                "%d: %.0f pps, %.2f Mbit/s (%s)" % (row["scenario"], row["pps"], row["mbps"], row["rate"])
+                for row in sample) + " - telemetry in " + self.telemetryLogPath)
         self.replayEngine.stop()
         self.setEnabled(True)
         self.ui.actionStart.setEnabled(True)
         self.ui.actionStop.setEnabled(False)
+        self.ui.actionWorkers.setEnabled(True)
 
     def stopNetworks(self):
         self.stopButton.setEnabled(False)
@@ -235,6 +334,7 @@ class ManagerWindow(QtWidgets.QMainWindow):
             QtWidgets.QMessageBox.No)
 
         if reply == QtWidgets.QMessageBox.Yes:
+            self.stopTelemetry()
             self.replayEngine.clean()
             os.system("sudo docker rm -f " + self.controllerName + " >/dev/null")
             self.stopNetworks()
@@ -244,6 +344,39 @@ class ManagerWindow(QtWidgets.QMainWindow):
             self.setEnabled(True)
             event.ignore()
 
+class PreparationThread(QtCore.QThread):
+    progressSignal = QtCore.pyqtSignal(int, int, str, object)  # done, total, path, error message (None - file prepared)
+    resultsSignal = QtCore.pyqtSignal(object)  # dict { path : error message } of failed files
+
+    def __init__(self, replayEngine, replayData):
+        super(PreparationThread, self).__init__()
+        self.replayEngine = replayEngine
+        self.replayData = replayData
+
+    def run(self):
+        traffic = [(scenario.pcapPath, scenario.hostPair[0], scenario.hostPair[1]) for scenario in self.replayData]
+        try:
+            failures = self.replayEngine.prepareAll(traffic, progress=self.progressSignal.emit)
+        except (RuntimeError, OSError, ValueError) as e:  # e.g. interfaces of hosts could not be set up - no file prepared
+            failures = {traffic_path: str(e) for traffic_path, host1, host2 in traffic}
+        self.resultsSignal.emit(failures)
+
+
+class WarmUpThread(QtCore.QThread):
+    resultsSignal = QtCore.pyqtSignal(object, object)  # report of warm-up (None - failed), error message (None - ok)
+
+    def __init__(self, replayEngine, proactiveFlows):
+        super(WarmUpThread, self).__init__()
+        self.replayEngine = replayEngine
+        self.proactiveFlows = proactiveFlows
+
+    def run(self):
+        try:
+            self.resultsSignal.emit(self.replayEngine.warmUp(proactive_flows=self.proactiveFlows), None)
+        except (RuntimeError, OSError, ValueError) as e:
+            self.resultsSignal.emit(None, str(e))
+
+
 class EmbeddedTerminal(QtWidgets.QWidget):
 
     def __init__(self, network, node):
@@ -68,6 +68,16 @@ class Ui_mainWindow(object):
         self.actionStart.setObjectName("actionStart")
         self.actionStop = QtWidgets.QAction(mainWindow)
         self.actionStop.setObjectName("actionStop")
+        self.actionWarmUp = QtWidgets.QAction(mainWindow)
+        self.actionWarmUp.setCheckable(True)
+        self.actionWarmUp.setObjectName("actionWarmUp")
+        self.actionProactiveFlows = QtWidgets.QAction(mainWindow)
+        self.actionProactiveFlows.setCheckable(True)
+        self.actionProactiveFlows.setEnabled(False)
+        self.actionProactiveFlows.setObjectName("actionProactiveFlows")
+        self.actionWorkers = QtWidgets.QAction(mainWindow)
+        self.actionWorkers.setCheckable(True)
+        self.actionWorkers.setObjectName("actionWorkers")
         self.actionPingAll = QtWidgets.QAction(mainWindow)
         self.actionPingAll.setObjectName("actionPingAll")
         self.actionStartXterms = QtWidgets.QAction(mainWindow)
@@ -91,6 +101,10 @@ class Ui_mainWindow(object):
         self.menuTraffic_replay.addAction(self.actionPrepare)
         self.menuTraffic_replay.addAction(self.actionStart)
         self.menuTraffic_replay.addAction(self.actionStop)
+        self.menuTraffic_replay.addSeparator()
+        self.menuTraffic_replay.addAction(self.actionWarmUp)
+        self.menuTraffic_replay.addAction(self.actionProactiveFlows)
+        self.menuTraffic_replay.addAction(self.actionWorkers)
         self.menubar.addAction(self.menuView.menuAction())
         self.menubar.addAction(self.menuCommands.menuAction())
         self.menubar.addAction(self.menuTraffic_replay.menuAction())
@@ -118,6 +132,9 @@ class Ui_mainWindow(object):
         self.actionPrepare.setText(_translate("mainWindow", "Prepare"))
         self.actionStart.setText(_translate("mainWindow", "Start"))
         self.actionStop.setText(_translate("mainWindow", "Stop"))
+        self.actionWarmUp.setText(_translate("mainWindow", "Warm up before start"))
+        self.actionProactiveFlows.setText(_translate("mainWindow", "Proactive flows in warm-up"))
+        self.actionWorkers.setText(_translate("mainWindow", "Replay in worker processes"))
         self.actionPingAll.setText(_translate("mainWindow", "Ping all"))
         self.actionStartXterms.setText(_translate("mainWindow", "Start xterms"))
         self.actionStopXterms.setText(_translate("mainWindow", "Stop xterms"))
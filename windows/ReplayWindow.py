@@ -1,16 +1,15 @@
 import os
-import copy
 import shutil
 import time
 
 from PyQt5 import QtWidgets, QtCore
 
 from windows import ReplayWindowUi
-from tools import messages, featureExtraction, clustering
+from tools import messages, featureExtraction, clustering, clusteringCache, preprocessing, topologyPaths
 
 
 class ReplayWindow(QtWidgets.QDialog):
-    clustersSignal = QtCore.pyqtSignal(object)  # results of ONE algorithm, see clustering.ClusteringResult class
+    clustersSignal = QtCore.pyqtSignal(object)  # results of ONE algorithm, see clustering.ClusteringLabels class
 
     def __init__(self, networks):
         super(ReplayWindow, self).__init__()
@@ -23,6 +22,10 @@ class ReplayWindow(QtWidgets.QDialog):
         self.directories = []
 
         self.clusteringThread = None
+        self.clusteringCache = clusteringCache.ClusteringCache()  # shared between runs, so "Retry" does not refit algorithms
+        # preprocessing of features before clustering - fixed defaults (log transform, scaling, PCA to 10 components),
+        # not editable in the window (change them here)
+        self.preprocessor = preprocessing.FeaturePreprocessor()
 
         self.ui = ReplayWindowUi.Ui_TrafficDialog()
         self.ui.setupUi(self)
@@ -81,7 +84,7 @@ class ReplayWindow(QtWidgets.QDialog):
         self.ui.pairList.takeItem(self.ui.pairList.currentRow())
 
     def startClusteringThread(self):
-        self.clusteringThread = ClusteringThread(self.ui)
+        self.clusteringThread = ClusteringThread(self.ui, self.clusteringCache, self.networks, self.preprocessor)
         self.clusteringThread.resultsSignal.connect(self.receiveResults)
         self.clusteringThread.directoriesSignal.connect(self.receiveDirectories)
         self.clusteringThread.resultsSignal.connect(self.ui.stackedWidget.repaint)
@@ -167,11 +170,15 @@ class ClusteringThread(QtCore.QThread):
     repaintSignal = QtCore.pyqtSignal()
     errorSignal = QtCore.pyqtSignal()
 
-    def __init__(self, ui):
+    def __init__(self, ui, cache=None, networks=None, preprocessor=None):
         super(ClusteringThread, self).__init__()
         self.ui = ui
+        self.networks = networks if networks is not None else []
         self.featureExtractor = featureExtraction.FeatureExtractor()
         self.clusteringEngine = clustering.ClusteringEngine()
+        self.clusteringEngine.updateCache(cache)
+        self.clusteringEngine.updatePreprocessor(preprocessor if preprocessor is not None
+                                                 else preprocessing.FeaturePreprocessor())
 
         self.modes = []
         self.clusteringResults = []
@@ -205,6 +212,7 @@ class ClusteringThread(QtCore.QThread):
             host2 = host_text.split(" <-> ")[1]
             hostPairs[len(hostPairs)] = (host1, host2)
         self.clusteringEngine.updateHostPairs(hostPairs)
+        self.clusteringEngine.updatePathCapacities(topologyPaths.pathCapacities(self.networks, hostPairs))
 
         split = False  # split pcap files...
         flows = False  # ... into flows (False - into host pairs)
@@ -222,6 +230,8 @@ class ClusteringThread(QtCore.QThread):
             self.modes.append("K-means")
         if self.ui.clusterSpectralButton.isChecked():
             self.modes.append("Spectral clustering")
+        if self.ui.clusterSparseSpectralButton.isChecked():
+            self.modes.append("Sparse spectral clustering")
         if self.ui.clusterDBSCANButton.isChecked():
             self.modes.append("DBSCAN")
         if self.ui.clusterOPTICSButton.isChecked():
@@ -230,6 +240,8 @@ class ClusteringThread(QtCore.QThread):
             self.modes.append("Affinity propagation")
         if self.ui.clusterBirchButton.isChecked():
             self.modes.append("Birch")
+        if self.ui.clusterAutoButton.isChecked():
+            self.modes.append("Automatic")
 
         if not self.modes:
             messages.error("No clustering algorithm selected.")
@@ -272,17 +284,34 @@ class ClusteringThread(QtCore.QThread):
         self.repaintSignal.emit()
 
         self.clusteringEngine.updateFeatures(self.featureExtractor.getAll())
+        self.clusteringEngine.updateProfiles(self.featureExtractor.getProfiles())
 
         self.clusteringResults.clear()
-        clusteringTimeText = ""
+        start_time = time.time()
+        self.clusteringEngine.prepareData()  # fitted once, reused by every selected mode
+        passed_time = time.time() - start_time
+        clusteringTimeText = "- preprocessing = " + str(passed_time) + " sec."
+        stages = self.clusteringEngine.getPreprocessingTimings()
+        if stages:
+            clusteringTimeText += " (" + ", ".join(stage + ": " + "%.3f" % stage_time
+                                                   for stage, stage_time in stages.items()) + ")"
+        clusteringTimeText += "\n"
         self.ui.clusteringTimeLabel.setText(clusteringTimeText)
         for mode in self.modes:
             start_time = time.time()
-            results = copy.deepcopy(self.clusteringEngine.start(mode=mode, restart=True))
+            results = self.clusteringEngine.start(mode=mode, restart=True)  # ClusteringLabels - label arrays only, feature table is shared
             passed_time = time.time() - start_time
             clusteringTimeText = self.ui.clusteringTimeLabel.text() + \
-                                 "- " + mode + " = " + str(passed_time) + " sec.\n"
+                                 "- " + mode + " = " + str(passed_time) + " sec."
+            if self.clusteringEngine.lastFromCache:
+                clusteringTimeText += " (cached)"
+            details = self.clusteringEngine.getDetails()
+            if details:
+                clusteringTimeText += " (" + ", ".join(name + ": " + str(value) for name, value in details.items()) + ")"
+            clusteringTimeText += "\n"
             self.ui.clusteringTimeLabel.setText(clusteringTimeText)
+            if mode == "Automatic":  # leaderboard is cached with results
+                self.ui.clusteringTimeLabel.setToolTip(self.leaderboardText(self.clusteringEngine.getLeaderboard()))
             time.sleep(0.3)
             self.repaintSignal.emit()
             self.clusteringResults.append(results)
@@ -294,3 +323,13 @@ class ClusteringThread(QtCore.QThread):
 
         self.ui.clusteringButtonBox.setEnabled(True)
 
+    def leaderboardText(self, leaderboard):
+        lines = ["Automatic selection - candidates (best first):"]
+        for place, entry in enumerate(leaderboard, start=1):
+            line = str(place) + ". " + entry["mode"] + " - " + entry["status"]
+            if entry["fit_time"] is not None:
+                line += ", fit time: %.3f sec." % entry["fit_time"]
+            if entry["silhouette"] is not None:
+                line += ", silhouette: %.3f, Calinski-Harabasz: %.1f" % (entry["silhouette"], entry["calinski_harabasz"])
+            lines.append(line)
+        return "\n".join(lines)
@@ -101,27 +101,33 @@ class Ui_TrafficDialog(object):
         self.loadGroup_2.setObjectName("loadGroup_2")
         self.startPredefinedlabel_10 = QtWidgets.QLabel(self.loadGroup_2)
         self.startPredefinedlabel_10.setEnabled(True)
-        self.startPredefinedlabel_10.setGeometry(QtCore.QRect(10, 20, 471, 41))
+        self.startPredefinedlabel_10.setGeometry(QtCore.QRect(10, 20, 471, 31))
         self.startPredefinedlabel_10.setWordWrap(True)
         self.startPredefinedlabel_10.setObjectName("startPredefinedlabel_10")
         self.clusterKmeansButton = QtWidgets.QCheckBox(self.loadGroup_2)
-        self.clusterKmeansButton.setGeometry(QtCore.QRect(60, 70, 112, 23))
+        self.clusterKmeansButton.setGeometry(QtCore.QRect(60, 55, 112, 23))
         self.clusterKmeansButton.setObjectName("clusterKmeansButton")
         self.clusterDBSCANButton = QtWidgets.QCheckBox(self.loadGroup_2)
-        self.clusterDBSCANButton.setGeometry(QtCore.QRect(60, 100, 112, 23))
+        self.clusterDBSCANButton.setGeometry(QtCore.QRect(60, 80, 112, 23))
         self.clusterDBSCANButton.setObjectName("clusterDBSCANButton")
         self.clusterAffinityButton = QtWidgets.QCheckBox(self.loadGroup_2)
-        self.clusterAffinityButton.setGeometry(QtCore.QRect(60, 130, 171, 23))
+        self.clusterAffinityButton.setGeometry(QtCore.QRect(60, 105, 171, 23))
         self.clusterAffinityButton.setObjectName("clusterAffinityButton")
         self.clusterSpectralButton = QtWidgets.QCheckBox(self.loadGroup_2)
-        self.clusterSpectralButton.setGeometry(QtCore.QRect(300, 70, 161, 23))
+        self.clusterSpectralButton.setGeometry(QtCore.QRect(300, 55, 161, 23))
         self.clusterSpectralButton.setObjectName("clusterSpectralButton")
         self.clusterOPTICSButton = QtWidgets.QCheckBox(self.loadGroup_2)
-        self.clusterOPTICSButton.setGeometry(QtCore.QRect(300, 100, 112, 23))
+        self.clusterOPTICSButton.setGeometry(QtCore.QRect(300, 80, 112, 23))
         self.clusterOPTICSButton.setObjectName("clusterOPTICSButton")
         self.clusterBirchButton = QtWidgets.QCheckBox(self.loadGroup_2)
-        self.clusterBirchButton.setGeometry(QtCore.QRect(300, 130, 112, 23))
+        self.clusterBirchButton.setGeometry(QtCore.QRect(300, 105, 112, 23))
         self.clusterBirchButton.setObjectName("clusterBirchButton")
+        self.clusterSparseSpectralButton = QtWidgets.QCheckBox(self.loadGroup_2)
+        self.clusterSparseSpectralButton.setGeometry(QtCore.QRect(60, 130, 211, 23))
+        self.clusterSparseSpectralButton.setObjectName("clusterSparseSpectralButton")
+        self.clusterAutoButton = QtWidgets.QCheckBox(self.loadGroup_2)
+        self.clusterAutoButton.setGeometry(QtCore.QRect(300, 130, 211, 23))
+        self.clusterAutoButton.setObjectName("clusterAutoButton")
         self.prepareButtonBox = QtWidgets.QDialogButtonBox(self.preparePage)
         self.prepareButtonBox.setGeometry(QtCore.QRect(10, 630, 511, 25))
         self.prepareButtonBox.setOrientation(QtCore.Qt.Horizontal)
@@ -315,6 +321,8 @@ class Ui_TrafficDialog(object):
         self.clusterSpectralButton.setText(_translate("TrafficDialog", "Spectral clustering"))
         self.clusterOPTICSButton.setText(_translate("TrafficDialog", "OPTICS"))
         self.clusterBirchButton.setText(_translate("TrafficDialog", "Birch"))
+        self.clusterSparseSpectralButton.setText(_translate("TrafficDialog", "Sparse spectral (kNN graph)"))
+        self.clusterAutoButton.setText(_translate("TrafficDialog", "Automatic (time budget)"))
         self.label.setText(_translate("TrafficDialog", "Traffic replay"))
         self.label_3.setText(_translate("TrafficDialog", "Traffic replay"))
         self.label_4.setText(_translate("TrafficDialog", "Preparation"))